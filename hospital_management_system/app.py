@@ -1,28 +1,88 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, current_app, session,
+                   Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from datetime import datetime, date, time, timedelta
 import os
-import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from models import db, User, Doctor, Patient, Department, Appointment, Treatment, DoctorAvailability
+from models import db, User, Doctor, Patient, Department, Appointment, ArchivedAppointment, Treatment
+from queries import (appointment_graph, doctor_page, history_page, todays_appointments, upcoming_appointments,
+                     patient_upcoming_appointments, recent_appointments, doctor_search, SEARCH_PAGE_SIZE,
+                     SEARCH_MAX_PAGE_SIZE, TREATMENT_SEARCH_PAGE_SIZE)
+from pagination import keyset_page
+from search import treatment_history, treatment_search, highlight, rebuild_search_indexes
+from reference import all_departments, cached_json, reference_cache
+from query_budget import init_query_budget, query_budget
+from profiling import init_profiling, profiles
+from assets import init_assets
+from fragments import init_fragment_cache, fragment_cache
+from engine import init_database, read_only
+from commands import register_commands
+from schema import upgrade_schema
+from booking import reserve_slot, SlotTaken
+from slots import slot_index, parse_slot_query
+from profiles import load_current_user, current_profile, invalidate_profile
+from hashing import hashing, HashingBusy
+from tokens import issue_reset_token, peek_reset_token, consume_reset_token
+from outbox import enqueue_email
+from exporter import export_chunks, parse_export_filters, EXPORT_FORMATS
+from stats import (dashboard_counters, reconcile_counters, counter_value, patient_registered, doctor_added,
+                   appointment_booked, appointment_completed)
+from rollups import appointment_status_changed, account_registered, analytics, parse_analytics_range
+from events import event_bus, event_response, appointment_changed, latest_event_id, doctor_channel, ADMIN_CHANNEL
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'hospital-management-secret-key-2025'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///hospital.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Fail requests that go over their @query_budget (always on when app.testing)
+app.config['QUERY_BUDGET_STRICT'] = False
+# Set QUERY_COUNT_HEADER=1 to return X-Query-Count on every response (see loadtest.py)
+app.config['QUERY_COUNT_HEADER'] = os.environ.get('QUERY_COUNT_HEADER') == '1'
+# Set PROFILING=1 for Server-Timing headers, a slow request log and /admin/profiling
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING') == '1'
+app.config['PROFILING_SLOW_REQUEST_MS'] = 500
+
+# Set EVENTS_SSE=1 to stream dashboard updates instead of polling; every open
+# dashboard then holds a connection, so only with async (gevent) workers, see events.py
+app.config['EVENTS_SSE'] = os.environ.get('EVENTS_SSE') == '1'
+
+# Serve the fingerprinted files `flask build-assets` writes to static/dist, cached for a year
+app.config['ASSETS_FINGERPRINT'] = True
+
+# SQLite engine profile ('production' or 'default') and per-worker pool size;
+# read routing sends @read_only views to a separate query_only connection pool
+app.config['DB_ENGINE_PROFILE'] = os.environ.get('DB_ENGINE_PROFILE', 'production')
+app.config['DB_POOL_SIZE'] = 5
+app.config['DB_READ_ROUTING'] = True
+
+# At most HASH_POOL_SIZE password hashes run at once per process, so a login burst cannot take every CPU
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2'
+app.config['HASH_POOL'] = 'thread'
+app.config['HASH_QUEUE_LIMIT'] = 32
+
+# Closed appointments older than this move to the archive tables (see archive.py)
+app.config['ARCHIVE_AFTER_DAYS'] = 365
+
 # Email configuration (for password reset)
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
 app.config['MAIL_PORT'] = 587
 app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = 'your-email@gmail.com'  # Update with your email
 app.config['MAIL_PASSWORD'] = 'your-app-password'     # Update with your app password
-
-db.init_app(app)
+app.config['MAIL_DEFAULT_SENDER'] = app.config['MAIL_USERNAME']
+# 'console' prints queued emails from `flask run-jobs`; set to 'smtp' once the above is configured
+app.config['MAIL_BACKEND'] = 'console'
+
+init_database(app, db)
+hashing.init_app(app)
+init_query_budget(app)
+init_profiling(app)
+init_assets(app)
+init_fragment_cache(app)
+event_bus.init_app(app)
+register_commands(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -30,11 +90,13 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # One query (or none, on a cache hit) for the user and their role profile
+    return load_current_user(int(user_id), session.get('_id'))
 
 def create_tables():
     with app.app_context():
-        db.create_all()
+        # Creates missing tables and adds any indexes older databases lack
+        upgrade_schema()
         
         if not User.query.filter_by(role='admin').first():
             admin_user = User(
@@ -57,54 +119,69 @@ def create_tables():
             db.session.commit()
             print("✅ Admin user created: username='admin', password='admin123'")
             print("✅ Sample departments created")
+        
+        # Seed the dashboard counters from whatever is already in the tables
+        reconcile_counters()
 
-# Store reset tokens (in production, use Redis or database)
-reset_tokens = {}
+def doctor_search_results(text, search_date, cursor, limit):
+    """One page of active doctors matching `text` (and free on `search_date`), as the search JSON"""
+    query, columns = doctor_search(text, search_date)
+    rows, next_cursor = keyset_page(query, columns, cursor, limit)
+    results = []
+    for row in rows:
+        results.append({
+            'id': row.id,
+            'name': row.username,
+            'specialization': row.specialization,
+            'department': row.department,
+            'experience': row.experience,
+            'consultation_fee': row.consultation_fee
+        })
+    
+    return {
+        'doctors': results,
+        'next_cursor': next_cursor
+    }
 
 def send_reset_email(user_email, reset_token):
-    """Send password reset email (simplified version)"""
+    """Queue the password reset email; the outbox job delivers it"""
     try:
-        # In a real application, you would send an actual email
-        # For demo purposes, we'll just print the reset link
-        reset_link = f"http://localhost:5000/reset-password/{reset_token}"
-        print(f"Password reset link for {user_email}: {reset_link}")
-        
-        # For actual email sending (uncomment and configure):
-        '''
-        msg = MIMEMultipart()
-        msg['From'] = app.config['MAIL_USERNAME']
-        msg['To'] = user_email
-        msg['Subject'] = 'Password Reset Request - Hospital Management System'
-        
-        body = f"""
-        Hello,
-        
-        You requested a password reset for your Hospital Management System account.
-        
-        Please click the following link to reset your password:
-        {reset_link}
-        
-        This link will expire in 1 hour.
-        
-        If you didn't request this reset, please ignore this email.
-        
-        Best regards,
-        Hospital Management System Team
-        """
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'])
-        server.starttls()
-        server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        server.send_message(msg)
-        server.quit()
-        '''
-        
+        reset_link = url_for('reset_password', token=reset_token, _external=True)
+        body = f"""Hello,
+
+You requested a password reset for your Hospital Management System account.
+
+Please click the following link to reset your password:
+{reset_link}
+
+This link will expire in 1 hour.
+
+If you didn't request this reset, please ignore this email.
+
+Best regards,
+Hospital Management System Team
+"""
+        enqueue_email(user_email, 'Password Reset Request - Hospital Management System', body)
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        print(f"Error queueing email: {e}")
         return False
 
+def send_appointment_email(recipient, subject, doctor_name, appointment_date, appointment_time, status_line):
+    """Queue a booking confirmation / cancellation notice for a patient"""
+    body = f"""Hello,
+
+{status_line}
+
+Doctor: Dr. {doctor_name}
+Date: {appointment_date}
+Time: {appointment_time.strftime('%H:%M')}
+
+Best regards,
+Hospital Management System Team
+"""
+    enqueue_email(recipient, subject, body)
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
@@ -123,7 +200,21 @@ def login():
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = user is not None and hashing.verify_password(user.password, password)
+        except HashingBusy:
+            flash('Too many sign-ins in progress. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503
+        
+        if valid:
+            # Move old hashes to the configured method/cost while we have the password
+            if hashing.needs_rehash(user.password):
+                try:
+                    user.password = hashing.hash_password(password)
+                    db.session.commit()
+                    invalidate_profile(user.id)
+                except HashingBusy:
+                    pass
             login_user(user)
             flash('Login successful!', 'success')
             return redirect(url_for('index'))
@@ -139,17 +230,15 @@ def forgot_password():
         user = User.query.filter_by(email=email).first()
         
         if user:
-            # Generate reset token
-            reset_token = secrets.token_urlsafe(32)
-            reset_tokens[reset_token] = {
-                'user_id': user.id,
-                'expires': datetime.utcnow() + timedelta(hours=1)
-            }
+            # Generate reset token (stored hashed, shared by all workers)
+            reset_token = issue_reset_token(user.id)
             
-            # Send reset email
+            # Queue the reset email with the token in the same transaction
             if send_reset_email(user.email, reset_token):
+                db.session.commit()
                 flash('Password reset instructions have been sent to your email.', 'info')
             else:
+                db.session.rollback()
                 flash('Failed to send email. Please try again.', 'danger')
         else:
             flash('No account found with that email address.', 'danger')
@@ -161,12 +250,12 @@ def forgot_password():
 @app.route('/reset-password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
     # Check if token is valid
-    token_data = reset_tokens.get(token)
-    if not token_data or token_data['expires'] < datetime.utcnow():
+    user_id = peek_reset_token(token)
+    if not user_id:
         flash('Invalid or expired reset token.', 'danger')
         return redirect(url_for('forgot_password'))
     
-    user = User.query.get(token_data['user_id'])
+    user = db.session.get(User, user_id)
     if not user:
         flash('Invalid user.', 'danger')
         return redirect(url_for('forgot_password'))
@@ -183,12 +272,21 @@ def reset_password(token):
             flash('Password must be at least 6 characters long.', 'danger')
             return render_template('reset_password.html', token=token)
         
-        # Update password
-        user.password = generate_password_hash(new_password)
-        db.session.commit()
+        try:
+            password_hash = hashing.hash_password(new_password)
+        except HashingBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('reset_password.html', token=token), 503
         
-        # Remove used token
-        reset_tokens.pop(token, None)
+        # Use up the token and update the password in one transaction; if
+        # another request consumed it first, nothing is changed
+        if consume_reset_token(token) != user.id:
+            db.session.rollback()
+            flash('Invalid or expired reset token.', 'danger')
+            return redirect(url_for('forgot_password'))
+        user.password = password_hash
+        db.session.commit()
+        invalidate_profile(user.id)
         
         flash('Password reset successfully! You can now login with your new password.', 'success')
         return redirect(url_for('login'))
@@ -210,10 +308,16 @@ def register_patient():
             flash('Email already registered', 'danger')
             return redirect(url_for('register_patient'))
         
+        try:
+            password_hash = hashing.hash_password(password)
+        except HashingBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('register_patient.html', today=date.today().isoformat()), 503
+        
         user = User(
             username=username,
             email=email,
-            password=generate_password_hash(password),
+            password=password_hash,
             role='patient'
         )
         db.session.add(user)
@@ -237,6 +341,8 @@ def register_patient():
             address=request.form.get('address', '')
         )
         db.session.add(patient)
+        patient_registered(user.created_at)
+        account_registered(user.created_at, 'patient')
         db.session.commit()
         
         flash('Registration successful! Please login.', 'success')
@@ -248,62 +354,138 @@ def register_patient():
 
 @app.route('/admin/dashboard')
 @login_required
+@read_only
+@query_budget(4)
 def admin_dashboard():
     if current_user.role != 'admin':
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
     
-    stats = {
-        'doctors': Doctor.query.filter_by(is_active=True).count(),
-        'patients': Patient.query.filter_by(is_active=True).count(),
-        'appointments': Appointment.query.count(),
-        'departments': Department.query.count()
-    }
+    # Read before the page's data: a change made while rendering is then
+    # replayed by the live stream rather than missed
+    events_after = latest_event_id()
     
-    recent_appointments = Appointment.query.order_by(Appointment.created_at.desc()).limit(5).all()
-    return render_template('admin/dashboard.html', stats=stats, appointments=recent_appointments)
-def admin_dashboard():
+    # Maintained incrementally by the write paths, see stats.py
+    stats, today_stats = dashboard_counters()
+    
+    # Details are fetched when a row is opened, see appointment_details
+    return render_template('admin/dashboard.html', 
+                         stats=stats, 
+                         appointments=recent_appointments().all(),
+                         today_stats=today_stats,
+                         today=date.today(),
+                         events_after=events_after)
+
+@app.route('/events/admin')
+@login_required
+@read_only
+@query_budget(3)
+def admin_events():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    # Deltas for the dashboard's counters and recent appointments, see events.py
+    return event_response(ADMIN_CHANNEL)
+
+
+@app.route('/admin/doctors')
+@login_required
+@read_only
+@query_budget(5)
+def admin_doctors():
     if current_user.role != 'admin':
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
     
-    stats = {
-        'doctors': Doctor.query.filter_by(is_active=True).count(),
-        'patients': Patient.query.filter_by(is_active=True).count(),
-        'appointments': Appointment.query.count(),
-        'departments': Department.query.count()
-    }
+    doctors, next_cursor = doctor_page()
+    departments = all_departments()
+    return render_template('admin/doctors.html',
+                         doctors=doctors,
+                         next_cursor=next_cursor,
+                         doctor_count=counter_value('doctors'),
+                         departments=departments)
+
+@app.route('/admin/doctors/page')
+@login_required
+@read_only
+@query_budget(2)
+def admin_doctors_page():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
     
-    # Today's statistics
-    today = date.today()
-    today_stats = {
-        'new_patients': Patient.query.filter(
-            Patient.user.has(User.created_at >= datetime.combine(today, datetime.min.time()))
-        ).count(),
-        'todays_appointments': Appointment.query.filter_by(appointment_date=today).count(),
-        'completed_appointments': Appointment.query.filter_by(
-            appointment_date=today, 
-            status='Completed'
-        ).count()
-    }
+    try:
+        doctors, next_cursor = doctor_page(request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'html': render_template('admin/_doctor_cards.html', doctors=doctors),
+        'next_cursor': next_cursor
+    })
+
+@app.route('/admin/export/appointments')
+@login_required
+def export_appointments():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
     
-    recent_appointments = Appointment.query.order_by(Appointment.created_at.desc()).limit(5).all()
-    return render_template('admin/dashboard.html', 
-                         stats=stats, 
-                         appointments=recent_appointments,
-                         today_stats=today_stats)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Rows are read and sent batch by batch while the client downloads
+    filename = f"appointments-{date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(export_chunks(filters, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
+@app.route('/admin/analytics')
+@login_required
+@read_only
+@query_budget(6)
+def admin_analytics():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        first, last = parse_analytics_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Served from the daily rollups (see rollups.py), never from appointments
+    return jsonify(analytics(first, last))
 
-@app.route('/admin/doctors')
+@app.route('/admin/profiling')
 @login_required
-def admin_doctors():
+@query_budget(1)
+def admin_profiling():
     if current_user.role != 'admin':
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
     
-    doctors = Doctor.query.all()
-    departments = Department.query.all()
-    return render_template('admin/doctors.html', doctors=doctors, departments=departments)
+    endpoints = profiles.summary()
+    if request.args.get('format') == 'json':
+        return jsonify({'enabled': app.config['PROFILING_ENABLED'], 'pid': os.getpid(),
+                        'since': profiles.since.isoformat(), 'endpoints': endpoints})
+    return render_template('admin/profiling.html',
+                         enabled=app.config['PROFILING_ENABLED'],
+                         endpoints=endpoints,
+                         since=profiles.since,
+                         pid=os.getpid())
+
+@app.route('/admin/profiling/reset', methods=['POST'])
+@login_required
+def reset_profiling():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    profiles.reset()
+    flash('Profiling samples cleared', 'success')
+    return redirect(url_for('admin_profiling'))
 
 @app.route('/admin/add_doctor', methods=['POST'])
 @login_required
@@ -319,10 +501,15 @@ def add_doctor():
     if User.query.filter_by(username=username).first():
         return jsonify({'error': 'Username already exists'}), 400
     
+    try:
+        password_hash = hashing.hash_password('doctor123')
+    except HashingBusy:
+        return jsonify({'error': 'The server is busy, please try again'}), 503
+    
     user = User(
         username=username,
         email=email,
-        password=generate_password_hash('doctor123'),
+        password=password_hash,
         role='doctor'
     )
     db.session.add(user)
@@ -342,6 +529,8 @@ def add_doctor():
         consultation_fee=request.form.get('consultation_fee', 0.0, type=float)
     )
     db.session.add(doctor)
+    doctor_added()
+    account_registered(user.created_at, 'doctor')
     db.session.commit()
     
     flash('Doctor added successfully! Default password: doctor123', 'success')
@@ -349,105 +538,260 @@ def add_doctor():
 
 @app.route('/doctor/dashboard')
 @login_required
+@read_only
+@query_budget(5)
 def doctor_dashboard():
     if current_user.role != 'doctor':
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
     
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     if not doctor:
         flash('Doctor profile not found', 'danger')
         return redirect(url_for('logout'))
     
+    # Before the queries, so changes made meanwhile are replayed by the live stream
+    events_after = latest_event_id()
     today = date.today()
-    todays_appointments = Appointment.query.filter_by(
-        doctor_id=doctor.id, 
-        appointment_date=today
-    ).order_by(Appointment.appointment_time).all()
-    
+    # Details and the completion form are fetched when a row is opened, see appointment_details
     next_week = today + timedelta(days=7)
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.doctor_id == doctor.id,
-        Appointment.appointment_date.between(today, next_week),
-        Appointment.status == 'Booked'
-    ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
-    
     return render_template('doctor/dashboard.html', 
                          doctor=doctor,
-                         todays_appointments=todays_appointments,
-                         upcoming_appointments=upcoming_appointments)
+                         todays_appointments=todays_appointments(doctor.id, today).all(),
+                         upcoming_appointments=upcoming_appointments(doctor.id, today, next_week).all(),
+                         today=today,
+                         next_week=next_week,
+                         events_after=events_after)
+
+@app.route('/events/doctor')
+@login_required
+@read_only
+@query_budget(4)
+def doctor_events():
+    if current_user.role != 'doctor':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    doctor = current_profile()
+    if not doctor:
+        return jsonify({'error': 'Doctor profile not found'}), 404
+    
+    # Bookings, cancellations and completions of this doctor, see events.py
+    return event_response(doctor_channel(doctor.id))
 
 @app.route('/patient/dashboard')
 @login_required
+@read_only
+@query_budget(8)
 def patient_dashboard():
     if current_user.role != 'patient':
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
     
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     if not patient:
         flash('Patient profile not found', 'danger')
         return redirect(url_for('logout'))
     
-    upcoming_appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='Booked'
-    ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
+    upcoming = patient_upcoming_appointments(patient.id).all()
     
-    past_appointments = Appointment.query.filter(
+    past_appointments, next_cursor = history_page(patient.id, include_archived=True)
+    past_counts = dict(db.session.query(Appointment.status, db.func.count(Appointment.id)).filter(
         Appointment.patient_id == patient.id,
         Appointment.status.in_(['Completed', 'Cancelled'])
-    ).order_by(Appointment.appointment_date.desc()).all()
+    ).group_by(Appointment.status).all())
+    archived_counts = db.session.query(ArchivedAppointment.status, db.func.count(ArchivedAppointment.id)).filter(
+        ArchivedAppointment.patient_id == patient.id
+    ).group_by(ArchivedAppointment.status).all()
+    for status, count in archived_counts:
+        past_counts[status] = past_counts.get(status, 0) + count
     
-    departments = Department.query.all()
+    departments = all_departments()
     
     return render_template('patient/dashboard.html',
                          patient=patient,
-                         upcoming_appointments=upcoming_appointments,
+                         upcoming_appointments=upcoming,
                          past_appointments=past_appointments,
+                         next_cursor=next_cursor,
+                         past_counts=past_counts,
                          departments=departments)
 
-@app.route('/search_doctors')
+@app.route('/patient/appointments/history')
 @login_required
-def search_doctors():
-    specialization = request.args.get('specialization', '')
-    date_str = request.args.get('date', '')
+@read_only
+@query_budget(3)
+def patient_history_page():
+    if current_user.role != 'patient':
+        return jsonify({'error': 'Access denied'}), 403
     
-    query = Doctor.query.filter_by(is_active=True)
+    patient = current_profile()
+    if not patient:
+        return jsonify({'error': 'Patient profile not found'}), 404
     
-    if specialization:
-        query = query.filter(Doctor.specialization.ilike(f'%{specialization}%'))
+    try:
+        appointments, next_cursor = history_page(patient.id, request.args.get('after'), include_archived=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'html': render_template('patient/_past_appointments.html', past_appointments=appointments),
+        'next_cursor': next_cursor
+    })
+
+@app.route('/appointments/<int:appointment_id>/details')
+@login_required
+@read_only
+@query_budget(2)
+def appointment_details(appointment_id):
+    appointment = Appointment.query.options(*appointment_graph()).filter_by(id=appointment_id).first()
+    if not appointment:
+        return jsonify({'error': 'Appointment not found'}), 404
+    
+    profile = current_profile()
+    if current_user.role == 'doctor':
+        allowed = profile is not None and appointment.doctor_id == profile.id
+    elif current_user.role == 'patient':
+        allowed = profile is not None and appointment.patient_id == profile.id
+    else:
+        allowed = current_user.role == 'admin'
+    if not allowed:
+        return jsonify({'error': 'Access denied'}), 403
     
-    doctors = query.all()
+    # The modal body as an HTML fragment; with ?action=complete a doctor gets the completion form
+    complete = (request.args.get('action') == 'complete' and current_user.role == 'doctor'
+                and appointment.status == 'Booked')
+    return render_template('_appointment_details.html', appointment=appointment, complete=complete)
+
+@app.route('/search_doctors')
+@login_required
+@read_only
+@query_budget(3)
+def search_doctors():
+    text = ' '.join(filter(None, [request.args.get('q', ''), request.args.get('specialization', '')]))
+    date_str = request.args.get('date', '')
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), SEARCH_MAX_PAGE_SIZE))
+    # `after` is the opaque next_cursor of the previous page
+    cursor = request.args.get('after')
     
+    search_date = None
     if date_str:
         try:
             search_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            available_doctors = []
-            for doctor in doctors:
-                availability = DoctorAvailability.query.filter_by(
-                    doctor_id=doctor.id,
-                    date=search_date,
-                    is_available=True
-                ).first()
-                if availability:
-                    available_doctors.append(doctor)
-            doctors = available_doctors
         except ValueError:
             pass
     
+    try:
+        if search_date is not None:
+            # Availability changes all day, so searches by date are neither cached nor validated
+            return jsonify(doctor_search_results(text, search_date, cursor, limit))
+        # Otherwise the result only depends on the doctor directory: built once
+        # per reference data version, and a 304 when the client's copy is current
+        return cached_json(('search_doctors', text, cursor, limit),
+                           lambda: doctor_search_results(text, None, cursor, limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/treatments')
+@login_required
+def treatment_search_page():
+    if current_user.role not in ('admin', 'doctor'):
+        flash('Access denied', 'danger')
+        return redirect(url_for('index'))
+    
+    return render_template('treatment_search.html')
+
+@app.route('/treatments/search')
+@login_required
+@read_only
+@query_budget(2)
+def search_treatments():
+    if current_user.role not in ('admin', 'doctor'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    # Doctors only see the treatment history of their own patients
+    doctor_id = None
+    if current_user.role == 'doctor':
+        doctor = current_profile()
+        if not doctor:
+            return jsonify({'error': 'Doctor profile not found'}), 404
+        doctor_id = doctor.id
+    
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') else None
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    query = treatment_history(request.args.get('q', ''), doctor_id=doctor_id,
+                              patient_id=request.args.get('patient_id', type=int), start=start, end=end)
+    if query is None:
+        return jsonify({'error': 'Enter something to search for'}), 400
+    
+    # Newest first; `after` is the opaque next_cursor of the previous page
+    try:
+        rows, next_cursor = keyset_page(query, [treatment_search.c.rowid], request.args.get('after'),
+                                        TREATMENT_SEARCH_PAGE_SIZE, descending=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     results = []
-    for doctor in doctors:
+    for row in rows:
         results.append({
-            'id': doctor.id,
-            'name': doctor.user.username,
-            'specialization': doctor.specialization,
-            'department': doctor.department.name,
-            'experience': doctor.experience,
-            'consultation_fee': doctor.consultation_fee
+            'treatment_id': row.rowid,
+            'treatment_date': row.treatment_date.isoformat() if row.treatment_date else None,
+            'appointment_id': row.appointment_id,
+            'appointment_date': row.appointment_date.isoformat(),
+            'patient_id': row.patient_id,
+            'patient': row.patient,
+            'doctor': row.doctor,
+            'diagnosis': row.diagnosis,
+            'prescription': row.prescription,
+            'snippet': highlight(row.snippet)
         })
     
-    return jsonify(results)
+    return jsonify({
+        'treatments': results,
+        'next_cursor': next_cursor
+    })
+
+@app.route('/doctors/<int:doctor_id>/free_slots')
+@login_required
+@read_only
+def doctor_free_slots(doctor_id):
+    try:
+        start_day, end_day, duration = parse_slot_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    doctor = db.session.get(Doctor, doctor_id)
+    if not doctor or not doctor.is_active:
+        return jsonify({'error': 'Doctor not found'}), 404
+    
+    slots = slot_index.free_slots([doctor_id], start_day, end_day, duration)
+    return jsonify({
+        'doctor_id': doctor_id,
+        'duration': duration,
+        'slots': slots[doctor_id]
+    })
+
+@app.route('/departments/<int:department_id>/free_slots')
+@login_required
+@read_only
+def department_free_slots(department_id):
+    try:
+        start_day, end_day, duration = parse_slot_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    doctor_ids = [row.id for row in db.session.query(Doctor.id).filter(
+        Doctor.department_id == department_id,
+        Doctor.is_active == True
+    )]
+    
+    slots = slot_index.free_slots(doctor_ids, start_day, end_day, duration)
+    return jsonify({
+        'department_id': department_id,
+        'duration': duration,
+        'doctors': {str(doctor_id): doctor_slots for doctor_id, doctor_slots in slots.items()}
+    })
 
 @app.route('/book_appointment', methods=['POST'])
 @login_required
@@ -455,38 +799,41 @@ def book_appointment():
     if current_user.role != 'patient':
         return jsonify({'error': 'Access denied'}), 403
     
-    patient = Patient.query.filter_by(user_id=current_user.id).first()
+    patient = current_profile()
     if not patient:
         return jsonify({'error': 'Patient profile not found'}), 400
     
-    doctor_id = request.form['doctor_id']
+    doctor_id = int(request.form['doctor_id'])
     appointment_date = datetime.strptime(request.form['date'], '%Y-%m-%d').date()
     appointment_time = datetime.strptime(request.form['time'], '%H:%M').time()
     symptoms = request.form.get('symptoms', '')
     
-    existing_appointment = Appointment.query.filter_by(
-        doctor_id=doctor_id,
-        appointment_date=appointment_date,
-        appointment_time=appointment_time,
-        status='Booked'
-    ).first()
-    
-    if existing_appointment:
-        return jsonify({'error': 'Slot already booked'}), 400
-    
-    appointment = Appointment(
-        patient_id=patient.id,
-        doctor_id=doctor_id,
-        appointment_date=appointment_date,
-        appointment_time=appointment_time,
-        symptoms=symptoms
-    )
+    doctor_name = db.session.query(User.username).join(Doctor, Doctor.user_id == User.id).filter(
+        Doctor.id == doctor_id,
+        Doctor.is_active == True
+    ).scalar()
+    if not doctor_name:
+        return jsonify({'error': 'Doctor not found'}), 404
     
-    db.session.add(appointment)
+    # The check and the insert are one statement, enforced by the
+    # active-slot unique index, so concurrent bookings cannot both succeed
+    try:
+        appointment_id = reserve_slot(db.session, patient.id, doctor_id, appointment_date, appointment_time, symptoms)
+    except SlotTaken:
+        db.session.rollback()
+        return jsonify({'error': 'Slot already booked'}), 409
+    appointment_booked(appointment_date)
+    appointment_status_changed(appointment_date, doctor_id, None, 'Booked')
+    appointment_changed(appointment_id, doctor_id, appointment_date, appointment_time, 'Booked', None,
+                        current_user.username, doctor_name)
+    send_appointment_email(current_user.email, 'Appointment Confirmed - Hospital Management System',
+                           doctor_name, appointment_date, appointment_time,
+                           'Your appointment has been booked.')
     db.session.commit()
+    slot_index.occupy(doctor_id, appointment_date, appointment_time)
     
     flash('Appointment booked successfully!', 'success')
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'appointment_id': appointment_id})
 
 @app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
 @login_required
@@ -495,13 +842,13 @@ def cancel_appointment(appointment_id):
     
     # Check if the current user owns this appointment or is admin
     if current_user.role == 'patient':
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient = current_profile()
         if appointment.patient_id != patient.id:
             flash('You can only cancel your own appointments', 'danger')
             return redirect(url_for('patient_dashboard'))
     
     elif current_user.role == 'doctor':
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor = current_profile()
         if appointment.doctor_id != doctor.id:
             flash('You can only cancel appointments assigned to you', 'danger')
             return redirect(url_for('doctor_dashboard'))
@@ -511,8 +858,21 @@ def cancel_appointment(appointment_id):
         return redirect(url_for('index'))
     
     # Update appointment status to Cancelled
+    was_booked = appointment.status == 'Booked'
+    if appointment.status == 'Completed':
+        appointment_completed(appointment.appointment_date, delta=-1)
+    appointment_status_changed(appointment.appointment_date, appointment.doctor_id, appointment.status, 'Cancelled')
+    appointment_changed(appointment.id, appointment.doctor_id, appointment.appointment_date,
+                        appointment.appointment_time, 'Cancelled', appointment.status,
+                        appointment.patient.user.username, appointment.doctor.user.username)
     appointment.status = 'Cancelled'
+    if was_booked:
+        send_appointment_email(appointment.patient.user.email, 'Appointment Cancelled - Hospital Management System',
+                               appointment.doctor.user.username, appointment.appointment_date,
+                               appointment.appointment_time, 'Your appointment has been cancelled.')
     db.session.commit()
+    if was_booked:
+        slot_index.release(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
     
     flash('Appointment cancelled successfully!', 'success')
     
@@ -527,16 +887,11 @@ def cancel_appointment(appointment_id):
 @app.route('/logout')
 @login_required
 def logout():
+    invalidate_profile(current_user.id)
     logout_user()
     flash('You have been logged out', 'info')
     return redirect(url_for('index'))
 
-if __name__ == '__main__':
-    create_tables()
-    app.run(debug=True)
-
-
-
 @app.route('/complete_appointment/<int:appointment_id>', methods=['POST'])
 @login_required
 def complete_appointment(appointment_id):
@@ -545,7 +900,7 @@ def complete_appointment(appointment_id):
         return redirect(url_for('index'))
     
     appointment = Appointment.query.get_or_404(appointment_id)
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor = current_profile()
     
     # Check if the doctor owns this appointment
     if appointment.doctor_id != doctor.id:
@@ -553,6 +908,12 @@ def complete_appointment(appointment_id):
         return redirect(url_for('doctor_dashboard'))
     
     # Update appointment status to Completed
+    if appointment.status != 'Completed':
+        appointment_completed(appointment.appointment_date)
+    appointment_status_changed(appointment.appointment_date, appointment.doctor_id, appointment.status, 'Completed')
+    appointment_changed(appointment.id, appointment.doctor_id, appointment.appointment_date,
+                        appointment.appointment_time, 'Completed', appointment.status,
+                        appointment.patient.user.username, current_user.username)
     appointment.status = 'Completed'
     
     # Create treatment record
@@ -565,65 +926,12 @@ def complete_appointment(appointment_id):
     
     db.session.add(treatment)
     db.session.commit()
+    slot_index.occupy(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
     
     flash('Appointment marked as completed! Treatment details saved.', 'success')
     return redirect(url_for('doctor_dashboard'))
 
 
-@app.route('/admin/reset_database', methods=['POST'])
-@login_required
-def reset_database():
-    if current_user.role != 'admin':
-        flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-
-    try:
-        db.drop_all()
-        db.create_all()
-
-        # recreate admin & departments
-        create_tables()  
-
-        flash('Database reset successfully!', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash('Error while resetting database.', 'danger')
-        print(e)
-
-    return redirect(url_for('admin_dashboard'))
-
-
-
-@app.route('/admin/reset_database', methods=['POST'])
-@login_required
-def reset_database():
-    if current_user.role != 'admin':
-        flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-
-    confirm_code = request.form.get('confirm_code', '').strip()
-    if confirm_code != 'RESET':
-        flash('Reset cancelled: confirmation text incorrect.', 'warning')
-        return redirect(url_for('admin_dashboard'))
-
-    try:
-        # Drop all tables and recreate
-        db.drop_all()
-        db.create_all()
-        # recreate admin & sample data (call your existing helper)
-        create_tables()
-        flash('Database reset successfully!', 'success')
-    except Exception:
-        db.session.rollback()
-        app.logger.exception('Database reset failed')
-        flash('Error while resetting database. See server logs.', 'danger')
-
-    return redirect(url_for('admin_dashboard'))
-
-
-
-# --- ADD THIS TO app.py (server-side) ---
-from flask import current_app
 
 @app.route('/admin/reset_database', methods=['POST'])
 @login_required
@@ -642,11 +950,18 @@ def reset_database():
     try:
         # Drop all tables and recreate schema
         db.drop_all()
+        invalidate_profile()
+        reference_cache.clear()
+        # Ids start over, so cached rows would render under new appointments
+        fragment_cache.clear()
+        slot_index.invalidate()
         db.create_all()
 
         # Re-create admin and default data (uses your helper)
         # Make sure create_tables() exists in your app.py
         create_tables()
+        # The FTS tables outlive drop_all(); empty them along with their sources
+        rebuild_search_indexes()
 
         flash('Database reset successfully! Default admin and sample data recreated.', 'success')
     except Exception as e:
@@ -655,5 +970,7 @@ def reset_database():
         flash('Error while resetting database. Check server logs.', 'danger')
 
     return redirect(url_for('admin_dashboard'))
-# --- END ROUTE ---
 
+if __name__ == '__main__':
+    create_tables()
+    app.run(debug=True)
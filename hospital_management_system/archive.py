@@ -0,0 +1,92 @@
+"""Hot/cold archiving of closed appointments.
+
+Completed and cancelled appointments are history: nothing books, completes
+or lists them as upcoming again, yet they share the appointments table and
+its indexes with the Booked rows every booking check and dashboard reads.
+archive_closed_appointments() moves the ones older than ARCHIVE_AFTER_DAYS,
+with their treatments, into archived_appointments and archived_treatments,
+which have the same columns and keep the same ids. appointments and
+treatments are AUTOINCREMENT tables, so an id that moved to the archive is
+never handed out again (upgrade_schema() rebuilds older databases that way
+and starts their id sequences above the archive).
+
+Rows move ARCHIVE_BATCH_SIZE appointments at a time, each batch one short
+transaction (copy, then delete), so bookings get the write lock between
+batches and an interrupted run leaves every row in exactly one table. The
+periodic job moves at most ARCHIVE_JOB_MAX_BATCHES per run and catches up
+over several runs; `flask archive-appointments` runs to completion.
+
+Live views only read appointments. Views of history ask for the archive too:
+history_page(include_archived=True) merges pages from both tables, treatment
+search indexes both (see search.py) and exports include both (see
+exporter.py).
+"""
+from datetime import date, timedelta
+from flask import current_app
+from models import db, Appointment, Treatment, ArchivedAppointment, ArchivedTreatment
+from jobs import periodic
+
+# Closed appointments older than this many days are archived
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 200
+# The periodic job stops after this many batches and resumes on its next run
+ARCHIVE_JOB_MAX_BATCHES = 20
+ARCHIVE_INTERVAL = 60 * 60
+
+CLOSED_STATUSES = ('Completed', 'Cancelled')
+
+# Hot table: the archive table sharing its ids
+ARCHIVE_TABLES = {'appointments': ArchivedAppointment.__table__, 'treatments': ArchivedTreatment.__table__}
+
+
+def _copy(source, target, condition):
+    """INSERT INTO target SELECT the same columns FROM source WHERE condition"""
+    columns = [column.name for column in target.__table__.columns]
+    return db.insert(target).from_select(
+        columns, db.select(*[source.__table__.c[name] for name in columns]).where(condition)
+    )
+
+
+def archive_closed_appointments(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                                max_batches=None):
+    """Move closed appointments older than `older_than_days` and their treatments to the archive.
+
+    Returns {'appointments': moved, 'treatments': moved, 'batches': transactions}.
+    """
+    cutoff = date.today() - timedelta(days=older_than_days)
+    closed = db.and_(Appointment.status.in_(CLOSED_STATUSES), Appointment.appointment_date < cutoff)
+    summary = {'appointments': 0, 'treatments': 0, 'batches': 0}
+    while max_batches is None or summary['batches'] < max_batches:
+        # Oldest first, in ix_appointments_date_status order so the scan stops at batch_size
+        ids = db.session.execute(
+            db.select(Appointment.id).where(closed).order_by(Appointment.appointment_date).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        # The copy checks `closed` again under the write lock, so a row changed since
+        # the SELECT stays where it is; only what was copied is deleted
+        db.session.execute(_copy(Appointment, ArchivedAppointment, db.and_(Appointment.id.in_(ids), closed)))
+        copied = db.select(ArchivedAppointment.id).where(ArchivedAppointment.id.in_(ids))
+        db.session.execute(_copy(Treatment, ArchivedTreatment, Treatment.appointment_id.in_(copied)))
+        summary['treatments'] += db.session.execute(
+            db.delete(Treatment).where(Treatment.appointment_id.in_(copied))
+        ).rowcount
+        summary['appointments'] += db.session.execute(
+            db.delete(Appointment).where(Appointment.id.in_(copied))
+        ).rowcount
+        db.session.commit()
+        summary['batches'] += 1
+    return summary
+
+
+@periodic(ARCHIVE_INTERVAL)
+def archive_appointments_job():
+    summary = archive_closed_appointments(current_app.config['ARCHIVE_AFTER_DAYS'],
+                                          max_batches=ARCHIVE_JOB_MAX_BATCHES)
+    return summary if summary['appointments'] else None
+
+
+def archive_counts():
+    """{status: archived appointments}"""
+    return dict(db.session.query(ArchivedAppointment.status, db.func.count())
+                .group_by(ArchivedAppointment.status))
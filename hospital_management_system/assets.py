@@ -0,0 +1,168 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file under static/ (except the output
+directory) to static/dist/ with a digest of its content in the name
+(css/style.css -> dist/css/style.3f2a9c1b7e.css), writes a gzip and, when
+the brotli package is installed, a brotli copy of each text asset next to
+it, and records the mapping in static/dist/manifest.json.
+
+At runtime init_assets() loads the manifest and rewrites
+url_for('static', filename=...) to the fingerprinted file, so templates
+keep referring to the source path. A fingerprinted URL never changes
+content, so it is served with Cache-Control: public, max-age=1 year,
+immutable and browsers stop asking for it until the next build changes the
+name; the precompressed copy matching Accept-Encoding is sent as is, with
+no compression work per request. The files are plain files on disk, so a
+front server can also serve static/dist/ directly (nginx: gzip_static and
+brotli_static) and keep static traffic off the app workers entirely.
+
+Files not in the manifest, or whose source is newer than its last build,
+are served from their original path with Flask's default revalidation, so
+forgetting to rebuild after an edit never serves stale CSS or JS.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Output directory under the static folder and its manifest
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Seconds browsers may keep a fingerprinted asset
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+ASSET_HASH_LENGTH = 10
+# Only these are worth precompressing; images and fonts already are compressed
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+# Content-Encoding -> suffix of the precompressed copy, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _sources(static_folder):
+    """Paths (relative, with '/') of the files to build"""
+    for root, dirs, files in os.walk(static_folder):
+        relative_root = os.path.relpath(root, static_folder)
+        if relative_root == '.':
+            dirs[:] = [name for name in dirs if name != DIST_DIR]
+        for name in sorted(files):
+            yield os.path.normpath(os.path.join(relative_root, name)).replace(os.sep, '/')
+
+
+def _fingerprinted(path, content):
+    stem, extension = os.path.splitext(path)
+    digest = hashlib.sha256(content).hexdigest()[:ASSET_HASH_LENGTH]
+    return f'{stem}.{digest}{extension}'
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def build_assets(static_folder):
+    """Write fingerprinted and compressed copies and the manifest; returns [(source, built, {variant: bytes})]
+
+    Files left over from earlier builds are removed.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    written = {os.path.join(dist, MANIFEST_NAME)}
+    report = []
+    for source in _sources(static_folder):
+        with open(os.path.join(static_folder, source), 'rb') as f:
+            content = f.read()
+        built = _fingerprinted(source, content)
+        target = os.path.join(dist, built)
+        _write(target, content)
+        written.add(target)
+        sizes = {'raw': len(content)}
+
+        if source.endswith(COMPRESSIBLE_EXTENSIONS):
+            # mtime=0 keeps the gzip output identical between builds of the same file
+            variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(content, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) < len(content):
+                    _write(target + suffix, compressed)
+                    written.add(target + suffix)
+                    sizes[suffix.lstrip('.')] = len(compressed)
+
+        manifest[source] = f'{DIST_DIR}/{built}'
+        report.append((source, manifest[source], sizes))
+
+    _write(os.path.join(dist, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    for root, _, files in os.walk(dist):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in written:
+                os.remove(path)
+    return report
+
+
+def load_manifest(static_folder):
+    """{source path: fingerprinted path} for assets whose build is current; empty without a build"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    current = {}
+    for source, built in manifest.items():
+        try:
+            if os.path.getmtime(os.path.join(static_folder, source)) <= os.path.getmtime(
+                    os.path.join(static_folder, built)):
+                current[source] = built
+        except OSError:
+            continue
+    return current
+
+
+def init_assets(app):
+    app.config.setdefault('ASSETS_FINGERPRINT', True)
+    app.config.setdefault('ASSETS_MAX_AGE', ASSET_MAX_AGE)
+    manifest = load_manifest(app.static_folder) if app.config['ASSETS_FINGERPRINT'] else {}
+    app.extensions['assets'] = manifest
+    stale = sorted(set(_sources(app.static_folder)) - set(manifest))
+    if manifest and stale:
+        app.logger.warning('Static assets not built or changed since the last build: %s '
+                           '(run flask build-assets)', ', '.join(stale))
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static':
+            built = manifest.get(values.get('filename'))
+            if built is not None:
+                values['filename'] = built
+
+    send_static = app.view_functions['static']
+
+    def serve_static(filename):
+        if not filename.startswith(DIST_DIR + '/') or filename.endswith(MANIFEST_NAME):
+            return send_static(filename=filename)
+        served, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            path = safe_join(app.static_folder, filename + suffix)
+            if request.accept_encodings[name] and path and os.path.isfile(path):
+                served, encoding = filename + suffix, name
+                break
+        # The type of the original file, not of its .br/.gz copy
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = send_from_directory(app.static_folder, served, mimetype=mimetype,
+                                       max_age=app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = serve_static
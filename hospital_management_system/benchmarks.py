@@ -0,0 +1,348 @@
+"""Stress tests and micro-benchmarks run from the CLI (see commands.py).
+
+booking_stress() works on a throwaway SQLite file. hashing_benchmark() drives
+the app's routes, so it needs DATABASE_URL pointed at a scratch file.
+"""
+import os
+import random
+import tempfile
+import time as timer
+import threading
+import multiprocessing
+from collections import Counter
+from datetime import date, time, timedelta
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from models import db, User, Department, Doctor, Patient, Appointment
+from booking import reserve_slot, SlotTaken
+from hashing import hashing
+from stats import reconcile_counters
+from profiling import percentile
+from engine import SQLITE_PROFILES, apply_pragmas
+
+
+def _scratch_engine(path):
+    # Generous timeout: writers queue on SQLite's file lock instead of failing
+    return create_engine(f'sqlite:///{path}', connect_args={'timeout': 60})
+
+
+def _seed_booking_db(engine, doctors, patients):
+    """Create the schema plus `doctors` doctors and `patients` patients"""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        department_id = conn.execute(
+            db.insert(Department).values(name='Stress').returning(Department.id)
+        ).scalar()
+        conn.execute(db.insert(User), [
+            {'username': f'stress_user_{i}', 'email': f'stress{i}@example.com',
+             'password': 'x', 'role': 'doctor' if i < doctors else 'patient'}
+            for i in range(doctors + patients)
+        ])
+        user_ids = conn.execute(select(User.id).order_by(User.id)).scalars().all()
+        conn.execute(db.insert(Doctor), [
+            {'user_id': user_id, 'department_id': department_id, 'specialization': 'Stress'}
+            for user_id in user_ids[:doctors]
+        ])
+        conn.execute(db.insert(Patient), [
+            {'user_id': user_id} for user_id in user_ids[doctors:]
+        ])
+        doctor_ids = conn.execute(select(Doctor.id).order_by(Doctor.id)).scalars().all()
+        patient_ids = conn.execute(select(Patient.id).order_by(Patient.id)).scalars().all()
+    return doctor_ids, patient_ids
+
+
+def _booking_worker(path, patient_id, slots, seed, start, results):
+    engine = _scratch_engine(path)
+    slots = list(slots)
+    random.Random(seed).shuffle(slots)
+    booked = conflicts = 0
+
+    start.wait()
+    for doctor_id, slot_date, slot_time in slots:
+        try:
+            with engine.begin() as conn:
+                reserve_slot(conn, patient_id, doctor_id, slot_date, slot_time)
+            booked += 1
+        except SlotTaken:
+            conflicts += 1
+    engine.dispose()
+    results.put((booked, conflicts))
+
+
+def booking_stress(workers=8, doctors=10, slots_per_doctor=50):
+    """Have every worker process try to book every slot at once.
+
+    Each slot must end up booked exactly once. Returns a dict with the
+    attempt/booking/conflict counts, the number of double-booked slots found
+    afterwards and the sustained bookings per second.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'booking_stress.db')
+        engine = _scratch_engine(path)
+        doctor_ids, patient_ids = _seed_booking_db(engine, doctors, workers)
+
+        first_day = date.today() + timedelta(days=1)
+        slots = []
+        for doctor_id in doctor_ids:
+            # 32 fifteen-minute slots a day, 09:00 to 16:45
+            for n in range(slots_per_doctor):
+                minutes = (n % 32) * 15
+                slot_date = first_day + timedelta(days=n // 32)
+                slots.append((doctor_id, slot_date, time(9 + minutes // 60, minutes % 60)))
+
+        ctx = multiprocessing.get_context('fork')
+        start = ctx.Event()
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=_booking_worker, args=(path, patient_id, slots, n, start, results))
+            for n, patient_id in enumerate(patient_ids)
+        ]
+        for process in processes:
+            process.start()
+
+        began = timer.perf_counter()
+        start.set()
+        outcomes = [results.get() for _ in processes]
+        elapsed = timer.perf_counter() - began
+        for process in processes:
+            process.join()
+
+        with engine.connect() as conn:
+            per_slot = select(func.count().label('bookings')).where(
+                Appointment.status == 'Booked'
+            ).group_by(
+                Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time
+            ).subquery()
+            double_booked = conn.execute(
+                select(func.count()).select_from(per_slot).where(per_slot.c.bookings > 1)
+            ).scalar()
+            booked_slots = conn.execute(
+                select(func.count()).select_from(per_slot)
+            ).scalar()
+        engine.dispose()
+
+    booked = sum(outcome[0] for outcome in outcomes)
+    return {
+        'workers': workers,
+        'slots': len(slots),
+        'attempts': len(slots) * workers,
+        'booked': booked,
+        'conflicts': sum(outcome[1] for outcome in outcomes),
+        'booked_slots': booked_slots,
+        'double_booked': double_booked,
+        'seconds': elapsed,
+        'bookings_per_second': booked / elapsed if elapsed else 0.0,
+        'attempts_per_second': len(slots) * workers / elapsed if elapsed else 0.0,
+    }
+
+
+def _profile_engines(path, profile):
+    """(write engine, read engine) configured like init_database() would"""
+    if profile == 'default':
+        engine = create_engine(f'sqlite:///{path}')
+        return engine, engine
+    pragmas = SQLITE_PROFILES[profile]
+    writer = create_engine(f'sqlite:///{path}')
+    reader = create_engine(f'sqlite:///{path}')
+    apply_pragmas(writer, pragmas)
+    apply_pragmas(reader, pragmas, query_only=True)
+    return writer, reader
+
+
+def _mixed_worker(path, profile, patient_id, doctor_ids, write_ratio, seconds, seed, start, results):
+    writer, reader = _profile_engines(path, profile)
+    rng = random.Random(seed)
+    first_day = date.today() + timedelta(days=1)
+    counts = Counter()
+
+    start.wait()
+    deadline = timer.perf_counter() + seconds
+    while timer.perf_counter() < deadline:
+        doctor_id = rng.choice(doctor_ids)
+        try:
+            if rng.random() < write_ratio:
+                minutes = rng.randrange(32) * 15
+                slot_date = first_day + timedelta(days=rng.randrange(60))
+                try:
+                    with writer.begin() as conn:
+                        reserve_slot(conn, patient_id, doctor_id, slot_date,
+                                     time(9 + minutes // 60, minutes % 60))
+                    counts['writes'] += 1
+                except SlotTaken:
+                    counts['writes'] += 1
+            else:
+                # Roughly what the doctor dashboard reads
+                with reader.connect() as conn:
+                    conn.execute(
+                        select(Appointment.id, Appointment.appointment_date, Appointment.appointment_time)
+                        .where(Appointment.doctor_id == doctor_id, Appointment.status == 'Booked')
+                        .order_by(Appointment.appointment_date, Appointment.appointment_time)
+                        .limit(20)
+                    ).all()
+                    conn.execute(
+                        select(func.count()).select_from(Appointment).where(Appointment.doctor_id == doctor_id)
+                    ).scalar()
+                counts['reads'] += 1
+        except OperationalError:
+            # "database is locked" after the driver gave up waiting
+            counts['errors'] += 1
+    writer.dispose()
+    reader.dispose()
+    results.put(counts)
+
+
+def engine_profile_benchmark(workers=4, seconds=5.0, write_ratio=0.2, doctors=20,
+                             profiles=('default', 'production')):
+    """Mixed read/write throughput of `workers` processes per engine profile.
+
+    Each worker process runs dashboard-style reads and bookings for `seconds`
+    against a fresh SQLite file. Returns {profile: stats} with operations per
+    second and the number of operations that failed on a locked database.
+    """
+    results = {}
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, f'engine_{profile}.db')
+            engine, _ = _profile_engines(path, profile)
+            doctor_ids, patient_ids = _seed_booking_db(engine, doctors, workers)
+            engine.dispose()
+
+            ctx = multiprocessing.get_context('fork')
+            start = ctx.Event()
+            queue = ctx.Queue()
+            processes = [
+                ctx.Process(target=_mixed_worker, args=(path, profile, patient_id, doctor_ids,
+                                                        write_ratio, seconds, n, start, queue))
+                for n, patient_id in enumerate(patient_ids)
+            ]
+            for process in processes:
+                process.start()
+            start.set()
+            counts = Counter()
+            for _ in processes:
+                counts.update(queue.get())
+            for process in processes:
+                process.join()
+
+        results[profile] = {
+            'reads_per_second': counts['reads'] / seconds,
+            'writes_per_second': counts['writes'] / seconds,
+            'errors': counts['errors'],
+        }
+    return results
+
+
+BENCH_USERS = (('bench_admin', 'admin'), ('bench_login', 'patient'))
+DEFAULT_DATABASE_URL = 'sqlite:///hospital.db'
+
+
+def _require_scratch_database(app):
+    """Raise ValueError unless DATABASE_URL explicitly names a SQLite file other than the default"""
+    configured = os.environ.get('DATABASE_URL')
+    if not configured or configured == DEFAULT_DATABASE_URL:
+        raise ValueError('Set DATABASE_URL to a scratch SQLite file; this benchmark creates an admin account')
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('DATABASE_URL must be a SQLite file')
+
+
+def _create_bench_users(password):
+    hashed = hashing.hash_password(password)
+    for username, role in BENCH_USERS:
+        user = User(username=username, email=f'{username}@example.com', role=role, password=hashed)
+        db.session.add(user)
+        if role == 'patient':
+            db.session.flush()
+            db.session.add(Patient(user_id=user.id))
+    db.session.commit()
+
+
+def _delete_bench_users():
+    user_ids = select(User.id).where(User.username.in_([username for username, _ in BENCH_USERS]))
+    Patient.query.filter(Patient.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def hashing_benchmark(app, logins=200, concurrency=50, modes=('inline', 'thread')):
+    """Dashboard latency while `logins` sign-ins run `concurrency` at a time.
+
+    Runs once per HASH_POOL mode and returns {mode: stats}. With 'inline'
+    every login thread hashes at once and competes with the dashboard for
+    CPU; with a pool only HASH_POOL_SIZE hashes run together. Requests run on
+    test-client threads in one process, so this measures CPU contention only,
+    not how many requests a gunicorn deployment can serve.
+
+    Refuses to run (ValueError) unless DATABASE_URL is a scratch SQLite file.
+    The bench accounts are deleted afterwards.
+    """
+    _require_scratch_database(app)
+    password = 'bench-password'
+    with app.app_context():
+        db.create_all()
+        # Left over if an earlier run was killed
+        _delete_bench_users()
+        _create_bench_users(password)
+        reconcile_counters()
+
+    original_mode = app.config['HASH_POOL']
+    results = {}
+    try:
+        for mode in modes:
+            app.config['HASH_POOL'] = mode
+            hashing.reset()
+
+            dashboard = app.test_client()
+            dashboard.post('/login', data={'username': 'bench_admin', 'password': password})
+            idle = []
+            for _ in range(20):
+                began = timer.perf_counter()
+                dashboard.get('/admin/dashboard')
+                idle.append(timer.perf_counter() - began)
+
+            pending = list(range(logins))
+            statuses = Counter()
+            lock = threading.Lock()
+
+            def sign_in():
+                client = app.test_client()
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        pending.pop()
+                    response = client.post('/login', data={'username': 'bench_login', 'password': password})
+                    with lock:
+                        statuses[response.status_code] += 1
+
+            threads = [threading.Thread(target=sign_in) for _ in range(concurrency)]
+            began = timer.perf_counter()
+            for thread in threads:
+                thread.start()
+
+            loaded = []
+            while any(thread.is_alive() for thread in threads):
+                request_began = timer.perf_counter()
+                dashboard.get('/admin/dashboard')
+                loaded.append(timer.perf_counter() - request_began)
+            for thread in threads:
+                thread.join()
+            elapsed = timer.perf_counter() - began
+
+            results[mode] = {
+                'idle_p50': percentile(idle, 50),
+                'loaded_p50': percentile(loaded, 50),
+                'loaded_p95': percentile(loaded, 95),
+                'dashboard_requests': len(loaded),
+                'logins_ok': statuses[302],
+                'logins_rejected': statuses[503],
+                'logins_per_second': statuses[302] / elapsed if elapsed else 0.0,
+            }
+    finally:
+        app.config['HASH_POOL'] = original_mode
+        hashing.reset()
+        with app.app_context():
+            _delete_bench_users()
+            reconcile_counters()
+    return results
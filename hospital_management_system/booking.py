@@ -0,0 +1,40 @@
+"""Atomic appointment slot reservation.
+
+A partial unique index on appointments (doctor_id, appointment_date,
+appointment_time) WHERE status = 'Booked' means the database itself refuses
+a second active booking for a slot. reserve_slot() inserts with
+ON CONFLICT DO NOTHING, so a concurrent loser sees "no row inserted" and gets
+SlotTaken instead of a double booking - no read-then-write window and no
+application-level locking.
+"""
+from sqlalchemy.dialects.sqlite import insert
+from models import Appointment
+
+
+class SlotTaken(Exception):
+    pass
+
+
+def reserve_slot(executor, patient_id, doctor_id, appointment_date, appointment_time, symptoms=''):
+    """Insert a Booked appointment and return its id, or raise SlotTaken.
+
+    `executor` is anything with .execute() - db.session in the app, or a plain
+    Connection from the stress test. The caller owns the transaction.
+    """
+    statement = insert(Appointment).values(
+        patient_id=patient_id,
+        doctor_id=doctor_id,
+        appointment_date=appointment_date,
+        appointment_time=appointment_time,
+        symptoms=symptoms,
+        status='Booked'
+    ).on_conflict_do_nothing(
+        # Only uq_appointments_active_slot: any other constraint still raises
+        index_elements=[Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time],
+        index_where=Appointment.status == 'Booked'
+    ).returning(Appointment.id)
+
+    appointment_id = executor.execute(statement).scalar()
+    if appointment_id is None:
+        raise SlotTaken(f'Doctor {doctor_id} is already booked at {appointment_date} {appointment_time}')
+    return appointment_id
@@ -0,0 +1,340 @@
+"""Flask CLI commands (run with `flask --app app <command>`)."""
+import click
+from datetime import date, time
+from models import db
+from schema import upgrade_schema, explain_hot_queries, SchemaUpgradeError
+from benchmarks import booking_stress, hashing_benchmark, engine_profile_benchmark
+from stats import reconcile_counters
+from jobs import run_due_jobs, run_jobs, registered_jobs
+from outbox import deliver_pending, outbox_counts, requeue_dead
+from importer import import_file, IMPORT_KINDS, IMPORT_CHUNK_SIZE, BulkImportError
+from exporter import export_chunks, parse_export_filters, EXPORT_FORMATS
+from datagen import generate_dataset, GENERATED_PASSWORD
+from loadtest import (route_benchmark, start_gunicorn, load_baseline, save_baseline, compare_to_baseline,
+                      ROUTES, BASELINE_TOLERANCE, BenchmarkError)
+from schedules import (add_template, add_exception, expand_schedules, parse_weekdays,
+                       SCHEDULE_HORIZON_DAYS)
+from slots import APPOINTMENT_MINUTES
+from search import rebuild_search_indexes
+from assets import build_assets, brotli
+from archive import archive_closed_appointments, archive_counts, ARCHIVE_BATCH_SIZE
+from rollups import rebuild_rollups, data_range
+
+
+def register_commands(app):
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Add missing tables and indexes to an existing database in place."""
+        try:
+            added = upgrade_schema()
+        except SchemaUpgradeError as e:
+            raise click.ClickException(str(e))
+        if added:
+            for name in added:
+                click.echo(f'✅ Created {name}')
+        else:
+            click.echo('Schema is up to date')
+        reconcile_counters()
+
+    @app.cli.command('explain-queries')
+    def explain_queries_command():
+        """Show EXPLAIN QUERY PLAN for each route's queries; fails on table scans."""
+        failures = 0
+        for name, plan, uses_index in explain_hot_queries():
+            click.echo(f"{'ok  ' if uses_index else 'SCAN'} {name}")
+            for step in plan:
+                click.echo(f'       {step}')
+            if not uses_index:
+                failures += 1
+        if failures:
+            raise click.ClickException(f'{failures} queries fall back to a table scan')
+
+    @app.cli.command('stress-booking')
+    @click.option('--workers', default=8, show_default=True, help='Concurrent booking processes.')
+    @click.option('--doctors', default=10, show_default=True)
+    @click.option('--slots', 'slots_per_doctor', default=50, show_default=True, help='Slots per doctor.')
+    def stress_booking_command(workers, doctors, slots_per_doctor):
+        """Race WORKERS processes for the same slots; fails on any double booking."""
+        result = booking_stress(workers=workers, doctors=doctors, slots_per_doctor=slots_per_doctor)
+        click.echo(f"{result['attempts']} attempts by {result['workers']} processes on {result['slots']} slots "
+                   f"in {result['seconds']:.2f}s")
+        click.echo(f"booked {result['booked']}, rejected {result['conflicts']} as taken, "
+                   f"{result['double_booked']} double-booked slots")
+        click.echo(f"{result['bookings_per_second']:.0f} bookings/s, "
+                   f"{result['attempts_per_second']:.0f} attempts/s")
+        if result['double_booked'] or result['booked'] != result['slots']:
+            raise click.ClickException('booking invariant violated')
+
+    @app.cli.command('bench-db')
+    @click.option('--workers', default=4, show_default=True, help='Concurrent worker processes.')
+    @click.option('--seconds', default=5.0, show_default=True, help='Run time per profile.')
+    @click.option('--write-ratio', default=0.2, show_default=True, help='Share of operations that book.')
+    def bench_db_command(workers, seconds, write_ratio):
+        """Compare read/write throughput with the default and production SQLite profiles."""
+        results = engine_profile_benchmark(workers=workers, seconds=seconds, write_ratio=write_ratio)
+        for profile, result in results.items():
+            click.echo(f"{profile:>10}: {result['reads_per_second']:.0f} reads/s, "
+                       f"{result['writes_per_second']:.0f} writes/s, "
+                       f"{result['errors']} locked errors")
+
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        """Recompute the dashboard counters from the source tables."""
+        drift = reconcile_counters()
+        for name, (counted, actual) in drift.items():
+            click.echo(f'{name}: {counted} -> {actual}')
+        click.echo(f'Reconciled ({len(drift)} counters corrected)')
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--from', 'start', help='First day (YYYY-MM-DD), default the oldest data.')
+    @click.option('--to', 'end', help='Last day (YYYY-MM-DD), default the newest data.')
+    def rebuild_rollups_command(start, end):
+        """Recompute the daily analytics rollups from the appointment and user tables."""
+        known = data_range()
+        if known is None:
+            click.echo('Nothing to roll up')
+            return
+        try:
+            first = date.fromisoformat(start) if start else known[0]
+            last = date.fromisoformat(end) if end else known[1]
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        days = rebuild_rollups(first, last)
+        click.echo(f'✅ Rebuilt rollups for {days} days ({first} to {last})')
+
+    @app.cli.command('run-jobs')
+    @click.option('--once', is_flag=True, help='Run every job once and exit (for cron).')
+    def run_jobs_command(once):
+        """Run the periodic maintenance jobs."""
+        if once:
+            for name, result in run_due_jobs(app, force=True).items():
+                click.echo(f'{name}: {result}')
+        else:
+            click.echo(f"Running jobs: {', '.join(registered_jobs())}")
+            run_jobs(app)
+
+    @app.cli.command('bench-hashing')
+    @click.option('--logins', default=200, show_default=True)
+    @click.option('--concurrency', default=50, show_default=True)
+    def bench_hashing_command(logins, concurrency):
+        """Dashboard latency during a login burst, inline vs pooled hashing.
+
+        Needs DATABASE_URL set to a scratch SQLite file; the bench users it
+        creates there are deleted afterwards.
+        """
+        try:
+            results = hashing_benchmark(app, logins=logins, concurrency=concurrency,
+                                        modes=('inline', app.config['HASH_POOL']))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for mode, result in results.items():
+            click.echo(f"{mode:>8}: dashboard p50 {result['idle_p50'] * 1000:.1f}ms idle, "
+                       f"{result['loaded_p50'] * 1000:.1f}ms / p95 {result['loaded_p95'] * 1000:.1f}ms "
+                       f"under load ({result['dashboard_requests']} requests); "
+                       f"{result['logins_ok']} logins ok, {result['logins_rejected']} rejected busy, "
+                       f"{result['logins_per_second']:.1f} logins/s")
+
+    @app.cli.command('outbox')
+    @click.option('--send', is_flag=True, help='Deliver due messages now.')
+    @click.option('--requeue-dead', 'requeue', is_flag=True, help='Retry messages that ran out of attempts.')
+    def outbox_command(send, requeue):
+        """Show outbox message counts; optionally requeue dead messages or send now."""
+        if requeue:
+            click.echo(f'Requeued {requeue_dead()} dead messages')
+        if send:
+            summary = deliver_pending()
+            click.echo(f"Sent {summary['sent']}, retrying {summary['retried']}, dead {summary['dead']}")
+        counts = outbox_counts()
+        click.echo(', '.join(f'{status}: {counts.get(status, 0)}' for status in ('pending', 'sent', 'dead')))
+
+    @app.cli.command('archive-appointments')
+    @click.option('--older-than-days', type=int, help='Defaults to the ARCHIVE_AFTER_DAYS setting.')
+    @click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Appointments per transaction.')
+    def archive_appointments_command(older_than_days, batch_size):
+        """Move old completed and cancelled appointments and their treatments to the archive tables."""
+        if older_than_days is None:
+            older_than_days = app.config['ARCHIVE_AFTER_DAYS']
+        summary = archive_closed_appointments(older_than_days, batch_size=batch_size)
+        click.echo(f"✅ Archived {summary['appointments']} appointments and {summary['treatments']} treatments "
+                   f"older than {older_than_days} days in {summary['batches']} batches")
+        counts = archive_counts()
+        click.echo(', '.join(f'{status}: {counts.get(status, 0)}' for status in ('Completed', 'Cancelled'))
+                   + ' in the archive')
+
+    @app.cli.command('import-data')
+    @click.argument('kind', type=click.Choice(IMPORT_KINDS))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+    @click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+    @click.option('--restart', is_flag=True, help='Ignore saved progress and start from the first row.')
+    def import_data_command(kind, path, fmt, chunk_size, restart):
+        """Bulk import patients, doctors or availability from a CSV/NDJSON file."""
+        def report(summary):
+            rate = (summary['read'] - summary['resumed_from']) / summary['seconds'] if summary['seconds'] else 0
+            click.echo(f"  {summary['read']} rows read, {summary['inserted']} inserted, "
+                       f"{summary['rejected']} rejected ({rate:.0f} rows/s)")
+
+        try:
+            summary = import_file(path, kind, fmt=fmt, chunk_size=chunk_size, restart=restart, progress=report)
+        except BulkImportError as e:
+            raise click.ClickException(str(e))
+        if summary['resumed_from']:
+            click.echo(f"Resumed after {summary['resumed_from']} rows imported earlier")
+        click.echo(f"✅ Imported {summary['inserted']} {kind} in {summary['seconds']:.1f}s "
+                   f"({summary['duplicates']} already present, {summary['rejected']} rejected)")
+        if summary['rejects_file']:
+            click.echo(f"Rejected rows: {summary['rejects_file']}")
+
+    @app.cli.command('export-appointments')
+    @click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+    @click.option('--from', 'start', help='First appointment date (YYYY-MM-DD).')
+    @click.option('--to', 'end', help='Last appointment date (YYYY-MM-DD).')
+    @click.option('--department-id', type=int)
+    @click.option('--doctor-id', type=int)
+    @click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+    def export_appointments_command(fmt, start, end, department_id, doctor_id, output):
+        """Stream appointments with patient, doctor and treatment details as CSV or NDJSON."""
+        try:
+            filters = parse_export_filters({'from': start, 'to': end,
+                                            'department_id': department_id, 'doctor_id': doctor_id})
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        for chunk in export_chunks(filters, fmt):
+            output.write(chunk)
+
+    @app.cli.command('generate-data')
+    @click.option('--patients', default=100000, show_default=True)
+    @click.option('--doctors', default=500, show_default=True)
+    @click.option('--appointments', default=2000000, show_default=True, help='Approximate total.')
+    @click.option('--past-days', default=300, show_default=True)
+    @click.option('--future-days', default=60, show_default=True)
+    @click.option('--seed', default=42, show_default=True)
+    def generate_data_command(patients, doctors, appointments, past_days, future_days, seed):
+        """Fill a scratch database with a seeded synthetic hospital for load tests."""
+        def report(table, count, seconds):
+            click.echo(f'  {table}: {count} ({seconds:.0f}s)')
+
+        try:
+            counts = generate_dataset(patients=patients, doctors=doctors, appointments=appointments,
+                                      past_days=past_days, future_days=future_days, seed=seed, progress=report)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo('✅ Generated ' + ', '.join(f'{count} {table}' for table, count in counts.items()))
+        click.echo(f"Accounts gen_patient_<n> / gen_doctor_<n>, password '{GENERATED_PASSWORD}'")
+
+    @app.cli.command('bench-routes')
+    @click.option('--requests', default=200, show_default=True, help='Requests per route.')
+    @click.option('--concurrency', default=8, show_default=True, help='Concurrent signed-in clients.')
+    @click.option('--routes', default=','.join(ROUTES), show_default=True, help='Comma-separated routes.')
+    @click.option('--gunicorn', 'gunicorn_workers', type=int, help='Serve with gunicorn and this many workers.')
+    @click.option('--url', help='Benchmark an already running server instead.')
+    @click.option('--admin-password', default='admin123', show_default=True)
+    @click.option('--baseline', type=click.Path(dir_okay=False), help='Baseline JSON to compare against.')
+    @click.option('--save-baseline', 'save', is_flag=True, help='Write the results to --baseline instead of comparing.')
+    @click.option('--tolerance', default=BASELINE_TOLERANCE, show_default=True, help='Allowed p95 growth.')
+    def bench_routes_command(requests, concurrency, routes, gunicorn_workers, url, admin_password, baseline,
+                             save, tolerance):
+        """Measure latency, throughput and queries per request for the main routes."""
+        routes = [route.strip() for route in routes.split(',') if route.strip()]
+        server = None
+        if gunicorn_workers:
+            server, url = start_gunicorn(app, workers=gunicorn_workers)
+        mode = url or 'test client'
+        try:
+            results = route_benchmark(app, routes=routes, requests=requests, concurrency=concurrency,
+                                      base_url=url, admin_password=admin_password)
+        except BenchmarkError as e:
+            raise click.ClickException(str(e))
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        click.echo(f'{mode}, {concurrency} clients')
+        click.echo(f"{'route':<20}{'reqs':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'queries':>9}")
+        for route, result in results.items():
+            queries = result['queries_per_request']
+            queries = '-' if queries is None else f'{queries:.1f}'
+            click.echo(f"{route:<20}{result['requests']:>6}{result['errors']:>5}{result['p50_ms']:>9.1f}"
+                       f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['requests_per_second']:>8.1f}"
+                       f"{queries:>9}")
+
+        if baseline and save:
+            save_baseline(baseline, results, mode='gunicorn' if gunicorn_workers else mode,
+                          concurrency=concurrency, requests=requests)
+            click.echo(f'Saved baseline to {baseline}')
+        elif baseline:
+            saved = load_baseline(baseline)
+            current_mode = 'gunicorn' if gunicorn_workers else mode
+            if saved['meta'].get('mode') != current_mode:
+                click.echo(f"Note: baseline was recorded with {saved['meta'].get('mode')}, this run used {current_mode}")
+            regressions = compare_to_baseline(results, saved, tolerance)
+            for regression in regressions:
+                click.echo(f'REGRESSION {regression}')
+            if regressions:
+                raise click.ClickException(f'{len(regressions)} regressions against {baseline}')
+            click.echo(f'No regressions against {baseline}')
+
+    @app.cli.command('add-schedule')
+    @click.argument('doctor_id', type=int)
+    @click.option('--days', default='mon-fri', show_default=True, help='Weekdays, e.g. mon-fri or mon,wed,fri.')
+    @click.option('--start', 'start_time', default='09:00', show_default=True)
+    @click.option('--end', 'end_time', default='17:00', show_default=True)
+    @click.option('--slot', 'slot_minutes', default=APPOINTMENT_MINUTES, show_default=True,
+                  help='Minutes per availability row; 0 for one row per window.')
+    @click.option('--from', 'valid_from', help='First day the schedule applies (YYYY-MM-DD, default today).')
+    @click.option('--until', 'valid_until', help='Last day the schedule applies (YYYY-MM-DD).')
+    def add_schedule_command(doctor_id, days, start_time, end_time, slot_minutes, valid_from, valid_until):
+        """Add a recurring weekly schedule for a doctor."""
+        try:
+            template = add_template(
+                doctor_id, parse_weekdays(days), time.fromisoformat(start_time), time.fromisoformat(end_time),
+                slot_minutes=slot_minutes or None,
+                valid_from=date.fromisoformat(valid_from) if valid_from else None,
+                valid_until=date.fromisoformat(valid_until) if valid_until else None
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        db.session.commit()
+        click.echo(f'✅ Schedule {template.id} added; run `flask expand-schedules` to create the availability')
+
+    @app.cli.command('add-holiday')
+    @click.argument('day')
+    @click.option('--doctor-id', type=int, help='Only this doctor (default: every doctor).')
+    @click.option('--reason')
+    def add_holiday_command(day, doctor_id, reason):
+        """Mark a day off that schedules skip when they are expanded."""
+        try:
+            day = date.fromisoformat(day)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        add_exception(day, doctor_id=doctor_id, reason=reason)
+        db.session.commit()
+        click.echo(f'✅ {day} marked off for ' + (f'doctor {doctor_id}' if doctor_id else 'every doctor'))
+
+    @app.cli.command('expand-schedules')
+    @click.option('--days', 'horizon_days', default=SCHEDULE_HORIZON_DAYS, show_default=True,
+                  help='Days ahead to materialize.')
+    @click.option('--doctor-id', 'doctor_ids', type=int, multiple=True, help='Only these doctors.')
+    def expand_schedules_command(horizon_days, doctor_ids):
+        """Create doctor availability from the recurring schedules."""
+        summary = expand_schedules(horizon_days=horizon_days, doctor_ids=list(doctor_ids) or None)
+        click.echo(f"✅ {summary['inserted']} availability rows added for {summary['doctors']} doctors "
+                   f"({summary['candidates']} in the schedules) in {summary['seconds']:.1f}s")
+
+    @app.cli.command('rebuild-search')
+    def rebuild_search_command():
+        """Rebuild the full-text search indexes from the source tables."""
+        for name, count in rebuild_search_indexes().items():
+            click.echo(f'✅ {name}: {count} rows indexed')
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Write fingerprinted, precompressed copies of the static files to static/dist."""
+        for source, built, sizes in build_assets(app.static_folder):
+            compressed = ', '.join(f'{variant} {size}' for variant, size in sizes.items() if variant != 'raw')
+            click.echo(f"✅ {source} -> {built} ({sizes['raw']} bytes{'; ' + compressed if compressed else ''})")
+        if brotli is None:
+            click.echo('brotli is not installed; only gzip copies were written')
+        click.echo('Restart the app workers to serve the new files')
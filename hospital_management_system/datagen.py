@@ -0,0 +1,216 @@
+"""Seeded synthetic hospital data for load tests; run it against a scratch DATABASE_URL.
+
+Accounts are gen_patient_<n> / gen_doctor_<n>, all with GENERATED_PASSWORD.
+"""
+import hashlib
+import random
+import time as timer
+from datetime import date, time, datetime, timedelta
+from models import (db, User, Department, Doctor, Patient, DoctorAvailability, Appointment, Treatment,
+                    PasswordResetToken, OutboxMessage, ScheduleTemplate)
+from hashing import hashing
+from slots import APPOINTMENT_MINUTES
+from stats import reconcile_counters
+from rollups import rebuild_rollups, data_range
+
+GENERATED_PASSWORD = 'password123'
+GENERATE_BATCH_SIZE = 20000
+
+LAST_NAMES = ('smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez',
+              'martinez', 'sharma', 'patel', 'singh', 'khan', 'chen', 'wang', 'tanaka', 'sato', 'kim', 'lee',
+              'nguyen', 'okafor', 'mensah', 'ivanova', 'rossi', 'silva', 'lopez', 'muller', 'dubois')
+# Rough population shares
+BLOOD_GROUPS = (('O+', 38), ('A+', 34), ('B+', 9), ('AB+', 3), ('O-', 7), ('A-', 6), ('B-', 2), ('AB-', 1))
+SPECIALIZATIONS = {
+    'Cardiology': ('Cardiologist', 'Interventional Cardiologist', 'Electrophysiologist'),
+    'Neurology': ('Neurologist', 'Neurophysiologist', 'Stroke Specialist'),
+    'Pediatrics': ('Pediatrician', 'Neonatologist', 'Pediatric Allergist'),
+    'Orthopedics': ('Orthopedic Surgeon', 'Sports Medicine', 'Spine Specialist'),
+    'Dermatology': ('Dermatologist', 'Dermatopathologist', 'Cosmetic Dermatologist'),
+    'General Medicine': ('General Physician', 'Internist', 'Family Medicine'),
+}
+SYMPTOMS = ('fever and cough', 'chest pain', 'headache', 'back pain', 'skin rash', 'fatigue', 'joint pain',
+            'shortness of breath', 'dizziness', 'sore throat', 'follow-up visit', 'annual checkup', '')
+DIAGNOSES = ('viral infection', 'hypertension', 'migraine', 'muscle strain', 'eczema', 'anemia',
+             'osteoarthritis', 'asthma', 'vertigo', 'tonsillitis', 'no abnormality found')
+PRESCRIPTIONS = ('paracetamol 500mg', 'ibuprofen 400mg', 'amlodipine 5mg', 'cetirizine 10mg',
+                 'iron supplements', 'physiotherapy', 'salbutamol inhaler', 'rest and fluids', '')
+
+
+def _insert(model, rows, returning=False):
+    """executemany INSERT of `rows`; with `returning`, the new ids in row order"""
+    if not rows:
+        return []
+    statement = db.insert(model)
+    connection = db.session.connection()
+    if returning:
+        statement = statement.returning(model.id, sort_by_parameter_order=True)
+        return connection.execute(statement, rows).scalars().all()
+    connection.execute(statement, rows)
+    return []
+
+
+def generate_dataset(patients=100000, doctors=500, appointments=2000000, past_days=300, future_days=60,
+                     seed=42, batch_size=GENERATE_BATCH_SIZE, progress=None):
+    """Insert a synthetic dataset and return {table: rows inserted}.
+
+    `appointments` is a target: each doctor's weekday slots in the window are
+    booked with the probability that produces about that many.
+    """
+    rng = random.Random(seed)
+    counts = {}
+    today = date.today()
+    now = datetime.utcnow()
+    began = timer.perf_counter()
+
+    def report(table, count):
+        counts[table] = count
+        if progress:
+            progress(table, count, timer.perf_counter() - began)
+
+    if User.query.filter(User.username.like('gen\\_%', escape='\\')).first():
+        raise ValueError('This database already has generated data; point DATABASE_URL at a fresh file')
+
+    password = hashing.hash_password(GENERATED_PASSWORD)
+
+    # Departments: the six from create_tables plus any that are missing
+    departments = {department.name: department.id for department in Department.query.all()}
+    missing = [{'name': name, 'description': f'{name} department'}
+               for name in SPECIALIZATIONS if name not in departments]
+    for row, department_id in zip(missing, _insert(Department, missing, returning=True)):
+        departments[row['name']] = department_id
+    department_names = [name for name in SPECIALIZATIONS]
+
+    # Doctors
+    doctor_users = []
+    for n in range(doctors):
+        doctor_users.append({
+            'username': f'gen_doctor_{n}', 'email': f'gen_doctor_{n}@example.com', 'password': password,
+            'role': 'doctor', 'created_at': now - timedelta(days=rng.randrange(past_days, past_days + 3650)),
+        })
+    user_ids = _insert(User, doctor_users, returning=True)
+    doctor_rows = []
+    for n, user_id in enumerate(user_ids):
+        department = department_names[n % len(department_names)]
+        doctor_rows.append({
+            'user_id': user_id, 'department_id': departments[department],
+            'specialization': rng.choice(SPECIALIZATIONS[department]),
+            'license_number': f'GEN-{seed}-{n:06d}',
+            'experience': rng.randrange(1, 35),
+            'consultation_fee': float(rng.randrange(30, 250, 5)),
+            'is_active': rng.random() > 0.02,
+        })
+    doctor_ids = _insert(Doctor, doctor_rows, returning=True)
+    report('doctors', len(doctor_ids))
+    # The weekly hours the availability below follows (see schedules.py)
+    _insert(ScheduleTemplate, [
+        {'doctor_id': doctor_id, 'weekdays': '12345', 'start_time': time(9, 0), 'end_time': time(17, 0),
+         'slot_minutes': None, 'valid_from': today - timedelta(days=past_days), 'is_active': True,
+         'expanded_until': today + timedelta(days=future_days)}
+        for doctor_id in doctor_ids
+    ])
+    report('schedule_templates', len(doctor_ids))
+
+    # Patients, in batches
+    patient_ids, patient_user_ids = [], []
+    for start in range(0, patients, batch_size):
+        users, profiles = [], []
+        for n in range(start, min(start + batch_size, patients)):
+            users.append({
+                'username': f'gen_patient_{n}', 'email': f'gen_patient_{n}@example.com', 'password': password,
+                'role': 'patient', 'created_at': now - timedelta(days=rng.random() * 3 * past_days),
+            })
+            birth = today - timedelta(days=rng.randrange(365, 95 * 365))
+            profiles.append({
+                'date_of_birth': birth,
+                'blood_group': rng.choices([group for group, _ in BLOOD_GROUPS],
+                                           [share for _, share in BLOOD_GROUPS])[0],
+                'phone': f'+1555{rng.randrange(10 ** 7):07d}',
+                'address': f'{rng.randrange(1, 9999)} {rng.choice(LAST_NAMES).title()} Street',
+                'emergency_contact': f'+1555{rng.randrange(10 ** 7):07d}',
+                'is_active': True,
+            })
+        for profile, user_id in zip(profiles, _insert(User, users, returning=True)):
+            profile['user_id'] = user_id
+            patient_user_ids.append(user_id)
+        patient_ids.extend(_insert(Patient, profiles, returning=True))
+        db.session.commit()
+        report('patients', len(patient_ids))
+
+    # Availability on weekdays, 09:00-17:00, and appointments on 15 minute slots
+    first_day = today - timedelta(days=past_days)
+    days = [first_day + timedelta(days=n) for n in range(past_days + future_days + 1)]
+    weekdays = [day for day in days if day.weekday() < 5]
+    slots = [time(9 + minute // 60, minute % 60) for minute in range(0, 8 * 60, APPOINTMENT_MINUTES)]
+    booking_rate = min(1.0, appointments / max(1, len(doctor_ids) * len(weekdays) * len(slots)))
+
+    availability, pending = [], []
+    totals = {'availability': 0, 'appointments': 0, 'treatments': 0}
+
+    def flush_appointments():
+        ids = _insert(Appointment, [row for row, _ in pending], returning=True)
+        treatments = [
+            {'appointment_id': appointment_id, 'diagnosis': rng.choice(DIAGNOSES),
+             'prescription': rng.choice(PRESCRIPTIONS), 'notes': rng.choice(('', 'review in 2 weeks', 'stable')),
+             'treatment_date': treated_at}
+            for appointment_id, (_, treated_at) in zip(ids, pending) if treated_at
+        ]
+        _insert(Treatment, treatments)
+        totals['appointments'] += len(ids)
+        totals['treatments'] += len(treatments)
+        pending.clear()
+
+    for doctor_id in doctor_ids:
+        for day in weekdays:
+            availability.append({'doctor_id': doctor_id, 'date': day, 'start_time': time(9, 0),
+                                 'end_time': time(17, 0), 'is_available': rng.random() > 0.05})
+            for slot in slots:
+                if rng.random() >= booking_rate:
+                    continue
+                when = datetime.combine(day, slot)
+                if day < today:
+                    status = 'Completed' if rng.random() < 0.8 else 'Cancelled'
+                else:
+                    status = 'Booked' if rng.random() < 0.88 else 'Cancelled'
+                row = {
+                    'patient_id': rng.choice(patient_ids), 'doctor_id': doctor_id,
+                    'appointment_date': day, 'appointment_time': slot, 'status': status,
+                    'symptoms': rng.choice(SYMPTOMS),
+                    'created_at': when - timedelta(days=rng.randrange(1, 30), minutes=rng.randrange(600)),
+                }
+                pending.append((row, when + timedelta(minutes=10) if status == 'Completed' else None))
+                if len(pending) >= batch_size:
+                    flush_appointments()
+                    db.session.commit()
+                    report('appointments', totals['appointments'])
+        if len(availability) >= batch_size:
+            _insert(DoctorAvailability, availability)
+            totals['availability'] += len(availability)
+            availability.clear()
+    flush_appointments()
+    _insert(DoctorAvailability, availability)
+    totals['availability'] += len(availability)
+    db.session.commit()
+    for table in ('availability', 'appointments', 'treatments'):
+        report(table, totals[table])
+
+    # A trickle of expired reset links and delivered notifications
+    sample = rng.sample(range(len(patient_ids)), min(len(patient_ids), max(1, patients // 100)))
+    tokens, messages = [], []
+    for n in sample:
+        issued = now - timedelta(days=rng.randrange(2, past_days))
+        tokens.append({'token_hash': hashlib.sha256(f'{seed}-{n}'.encode()).hexdigest(),
+                       'user_id': patient_user_ids[n], 'expires_at': issued + timedelta(hours=1), 'created_at': issued})
+        messages.append({'recipient': f'gen_patient_{n}@example.com',
+                         'subject': 'Appointment Confirmed - Hospital Management System',
+                         'body': 'Your appointment has been booked.', 'status': 'sent', 'attempts': 1,
+                         'next_attempt_at': issued, 'created_at': issued, 'sent_at': issued})
+    _insert(PasswordResetToken, tokens)
+    _insert(OutboxMessage, messages)
+    db.session.commit()
+    report('password_reset_tokens', len(tokens))
+    report('outbox_messages', len(messages))
+
+    reconcile_counters()
+    rebuild_rollups(*data_range())
+    return counts
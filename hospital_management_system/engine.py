@@ -0,0 +1,115 @@
+"""SQLite engine profile (WAL, pragmas, pool size) and read routing for @read_only views.
+
+Non-SQLite URLs and :memory: databases are left alone.
+"""
+import os
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+SQLITE_PROFILES = {
+    # Driver defaults: rollback journal, full fsync, pysqlite's 5s lock wait
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        # Safe with WAL: a power loss can only drop the last commits, never corrupt
+        'synchronous': 'NORMAL',
+        # Negative sizes are in KiB, i.e. 8 MiB of page cache per connection
+        'cache_size': -8000,
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        # Truncate the WAL file back to 64 MiB after checkpoints
+        'journal_size_limit': 64 * 1024 * 1024,
+        'busy_timeout': 15000,
+    },
+}
+
+
+def read_only(view):
+    """Route the view's SELECTs to the read engine when read routing is on"""
+    view._read_only = True
+    return view
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends @read_only reads to the 'read' bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_app_context() and g.get('read_only')):
+            engine = self._db.engines.get('read')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.drivername in ('sqlite', 'sqlite+pysqlite') and url.database not in (None, '', ':memory:')
+
+
+def apply_pragmas(engine, pragmas, query_only=False):
+    """Run `pragmas` on every new connection of `engine`"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if query_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def init_database(app, db):
+    """Configure engines from DB_* settings, then initialise `db` for `app`"""
+    app.config.setdefault('DB_ENGINE_PROFILE', 'production')
+    app.config.setdefault('DB_POOL_SIZE', 5)
+    app.config.setdefault('DB_MAX_OVERFLOW', 10)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10)
+    app.config.setdefault('DB_READ_ROUTING', True)
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    sqlite_file = is_sqlite_file(uri)
+    if sqlite_file:
+        pool = {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        }
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        for name, value in pool.items():
+            options.setdefault(name, value)
+        if app.config['DB_READ_ROUTING']:
+            app.config.setdefault('SQLALCHEMY_BINDS', {})['read'] = {'url': uri, **pool}
+
+    db.init_app(app)
+
+    if sqlite_file:
+        pragmas = SQLITE_PROFILES[app.config['DB_ENGINE_PROFILE']]
+        with app.app_context():
+            engines = db.engines
+            apply_pragmas(engines[None], pragmas)
+            if 'read' in engines:
+                apply_pragmas(engines['read'], pragmas, query_only=True)
+
+        def dispose_inherited_pools():
+            # Connections opened before gunicorn forked (--preload) belong to the
+            # parent; each worker starts with an empty pool of its own
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+
+        os.register_at_fork(after_in_child=dispose_inherited_pools)
+
+    @app.before_request
+    def route_reads():
+        view = app.view_functions.get(request.endpoint)
+        g.read_only = getattr(view, '_read_only', False)
+
+    @app.teardown_request
+    def stop_routing_reads(exc):
+        # g outlives the request inside CLI commands and tests
+        g.pop('read_only', None)
@@ -0,0 +1,271 @@
+"""Live dashboard updates from the events table: short polls, or server-sent events with EVENTS_SSE.
+
+A stream holds its worker, so only turn EVENTS_SSE on under an async worker (gunicorn -k gevent).
+"""
+import json
+import os
+import queue
+import threading
+import time as timer
+from datetime import datetime, timedelta
+from flask import current_app, request, jsonify, Response
+from models import db, Event
+from jobs import periodic
+
+# How often a dashboard polls when server-sent events are off
+EVENTS_CLIENT_POLL_SECONDS = 10
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_POLL_BATCH = 500
+# Comment lines sent on idle streams so proxies do not time them out
+EVENTS_HEARTBEAT = 15
+# How long the browser waits before reconnecting a dropped stream
+EVENTS_RETRY_MS = 3000
+EVENTS_STREAM_SECONDS = 5 * 60
+# Streams per worker; further clients get 503 and retry
+EVENTS_MAX_SUBSCRIBERS = 5000
+# Undelivered events per stream before it is dropped
+EVENTS_QUEUE_SIZE = 100
+# A reconnecting client that missed more than this reloads the page instead
+EVENTS_REPLAY_LIMIT = 200
+EVENTS_RETENTION = timedelta(days=1)
+EVENTS_SWEEP_INTERVAL = 10 * 60
+
+ADMIN_CHANNEL = 'admin'
+
+
+def doctor_channel(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+def publish(channel, kind, payload):
+    """Queue an event in the current transaction; the caller commits"""
+    event = Event(channel=channel, kind=kind, payload=json.dumps(payload, separators=(',', ':')))
+    db.session.add(event)
+    return event
+
+
+def appointment_changed(appointment_id, doctor_id, day, at, status, previous, patient, doctor):
+    """Announce a booked, cancelled or completed appointment to its doctor and the admins.
+
+    `previous` is the status before the change (None for a new booking).
+    """
+    payload = {'id': appointment_id, 'date': day.isoformat(), 'time': at.strftime('%H:%M'),
+               'status': status, 'previous': previous, 'patient': patient, 'doctor': doctor}
+    publish(doctor_channel(doctor_id), 'appointment', payload)
+    publish(ADMIN_CHANNEL, 'appointment', payload)
+
+
+def new_events_query(after):
+    """The next batch of events of every channel after id `after`, as the bus polls them"""
+    return (db.select(Event.id, Event.channel, Event.kind, Event.payload)
+            .where(Event.id > after).order_by(Event.id).limit(EVENTS_POLL_BATCH))
+
+
+def channel_events_query(channel, after):
+    """Events of `channel` after id `after`, one more than a client may replay"""
+    return (db.select(Event.id, Event.kind, Event.payload)
+            .where(Event.channel == channel, Event.id > after)
+            .order_by(Event.id).limit(EVENTS_REPLAY_LIMIT + 1))
+
+
+def latest_event_id():
+    """Id of the newest event; pages pass it to their stream so nothing published after rendering is missed"""
+    return db.session.query(db.func.max(Event.id)).scalar() or 0
+
+
+class Subscription:
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+
+class EventBus:
+    """Per-process fan-out of the events table to open streams"""
+
+    def __init__(self):
+        self._channels = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_id = 0
+
+    def init_app(self, app):
+        # Stream to the browser; only with async workers, see the module docstring
+        app.config.setdefault('EVENTS_SSE', False)
+        app.config.setdefault('EVENTS_CLIENT_POLL_SECONDS', EVENTS_CLIENT_POLL_SECONDS)
+        app.config.setdefault('EVENTS_POLL_INTERVAL', EVENTS_POLL_INTERVAL)
+        app.config.setdefault('EVENTS_HEARTBEAT', EVENTS_HEARTBEAT)
+        app.config.setdefault('EVENTS_STREAM_SECONDS', EVENTS_STREAM_SECONDS)
+        app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', EVENTS_MAX_SUBSCRIBERS)
+
+    def _start(self, config):
+        # Threads do not survive fork, so gunicorn workers each start their own poller
+        if self._pid == os.getpid():
+            return
+        # Read engine when read routing is on: its connections never wait on a writer
+        engine = db.engines.get('read') or db.engine
+        # Taken before the caller replays, so every event is either replayed or polled
+        self._last_id = latest_event_id()
+        self._channels = {}
+        self._count = 0
+        self._pid = os.getpid()
+        threading.Thread(target=self._poll, args=(engine, config['EVENTS_POLL_INTERVAL'], current_app.logger),
+                         name='event-bus', daemon=True).start()
+
+    def subscribe(self, channel):
+        """A Subscription for `channel`, or None when this worker has no room for another stream"""
+        config = current_app.config
+        with self._lock:
+            self._start(config)
+            if self._count >= config['EVENTS_MAX_SUBSCRIBERS']:
+                return None
+            subscription = Subscription(channel, EVENTS_QUEUE_SIZE)
+            self._channels.setdefault(channel, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[subscription.channel]
+            self._count -= 1
+
+    def subscriber_count(self):
+        return self._count
+
+    def _dispatch(self, rows):
+        with self._lock:
+            for row in rows:
+                for subscription in self._channels.get(row.channel, ()):
+                    if subscription.dropped:
+                        continue
+                    try:
+                        subscription.queue.put_nowait(row)
+                    except queue.Full:
+                        # Ends the stream; the browser reconnects and replays from the table
+                        subscription.dropped = True
+
+    def _poll(self, engine, interval, logger):
+        newest = db.select(db.func.max(Event.id))
+        while True:
+            timer.sleep(interval)
+            try:
+                with engine.connect() as conn:
+                    latest = conn.execute(newest).scalar() or 0
+                    if latest < self._last_id:
+                        # Swept empty, or recreated by a database reset
+                        self._last_id = 0
+                    while latest > self._last_id:
+                        rows = conn.execute(new_events_query(self._last_id)).all()
+                        if not rows:
+                            break
+                        self._dispatch(rows)
+                        self._last_id = rows[-1].id
+            except Exception:
+                # A locked or missing table: try again on the next tick
+                logger.warning('Event bus poll failed', exc_info=True)
+
+
+event_bus = EventBus()
+
+
+def _message(event):
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {event.payload}\n\n'
+
+
+def _stream(subscription, replay, heartbeat, seconds):
+    try:
+        yield f'retry: {EVENTS_RETRY_MS}\n\n'
+        sent = 0
+        if len(replay) > EVENTS_REPLAY_LIMIT:
+            yield 'event: reload\ndata: {}\n\n'
+            return
+        for event in replay:
+            yield _message(event)
+            sent = event.id
+
+        deadline = timer.monotonic() + seconds
+        while not subscription.dropped:
+            remaining = deadline - timer.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = subscription.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            # Replayed already
+            if event.id <= sent:
+                continue
+            yield _message(event)
+            sent = event.id
+    finally:
+        # Runs when the stream ends or the server closes it after the client went away
+        event_bus.unsubscribe(subscription)
+
+
+def _after():
+    """The event id the client has seen, from Last-Event-ID or ?after=; raises ValueError"""
+    after = request.headers.get('Last-Event-ID') or request.args.get('after')
+    return int(after) if after else None
+
+
+def _events_after(channel, after):
+    return db.session.execute(channel_events_query(channel, after)).all()
+
+
+def event_response(channel):
+    """Events of `channel` after the client's last one: a stream with EVENTS_SSE, else one JSON batch"""
+    try:
+        after = _after()
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+    if current_app.config['EVENTS_SSE']:
+        return _event_stream(channel, after)
+
+    if after is None:
+        return jsonify({'error': "'after' is required"}), 400
+    events = _events_after(channel, after)
+    if len(events) > EVENTS_REPLAY_LIMIT:
+        return jsonify({'events': [], 'reload': True})
+    # Payloads are JSON already; splice them in rather than parse and re-encode
+    body = ','.join(f'{{"id":{event.id},"kind":{json.dumps(event.kind)},"data":{event.payload}}}'
+                    for event in events)
+    return Response(f'{{"events":[{body}],"reload":false}}', mimetype='application/json',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+def _event_stream(channel, after):
+    subscription = event_bus.subscribe(channel)
+    if subscription is None:
+        return jsonify({'error': 'Too many live connections, try again shortly'}), 503, {'Retry-After': '30'}
+    try:
+        replay = _events_after(channel, after) if after is not None else []
+    except Exception:
+        event_bus.unsubscribe(subscription)
+        raise
+
+    config = current_app.config
+    # Not wrapped in stream_with_context: an idle stream holds no request
+    # context and no database connection
+    return Response(_stream(subscription, replay, config['EVENTS_HEARTBEAT'], config['EVENTS_STREAM_SECONDS']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def sweep_events(retention=EVENTS_RETENTION):
+    """Delete events older than `retention`; returns how many"""
+    removed = Event.query.filter(Event.created_at < datetime.utcnow() - retention).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+@periodic(EVENTS_SWEEP_INTERVAL)
+def sweep_events_job():
+    removed = sweep_events()
+    return {'events_removed': removed} if removed else None
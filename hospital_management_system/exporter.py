@@ -0,0 +1,136 @@
+"""Streaming export of appointments with patient, doctor and treatment data.
+
+export_rows() runs one SELECT and fetches it EXPORT_BATCH_SIZE rows at a
+time (yield_per), so SQLite steps through the result as the consumer reads it:
+the first bytes go out as soon as the first batch is formatted and memory
+stays at one batch however many rows match. The admin endpoint wraps
+export_chunks() in a streaming response; `flask export-appointments` writes
+the same chunks to a file.
+
+Archived appointments (see archive.py) are exported too: the statement is a
+UNION ALL of the live and archive tables, which SQLite merges in order.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy.orm import aliased
+from models import (db, User, Doctor, Patient, Department, Appointment, Treatment, ArchivedAppointment,
+                    ArchivedTreatment)
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+PatientUser = aliased(User, name='patient_user')
+DoctorUser = aliased(User, name='doctor_user')
+
+
+def _export_columns(appointment, treatment):
+    """The exported columns, read from `appointment` and `treatment` (live or archive models)"""
+    return (
+        appointment.id.label('appointment_id'),
+        appointment.appointment_date,
+        appointment.appointment_time,
+        appointment.status,
+        appointment.symptoms,
+        appointment.created_at,
+        Patient.id.label('patient_id'),
+        PatientUser.username.label('patient_username'),
+        PatientUser.email.label('patient_email'),
+        Doctor.id.label('doctor_id'),
+        DoctorUser.username.label('doctor_username'),
+        Doctor.specialization,
+        Doctor.consultation_fee,
+        Department.id.label('department_id'),
+        Department.name.label('department'),
+        treatment.diagnosis,
+        treatment.prescription,
+        treatment.notes,
+        treatment.treatment_date,
+    )
+
+
+EXPORT_FIELDS = [column.key for column in _export_columns(Appointment, Treatment)]
+
+
+def parse_export_filters(args):
+    """from/to/department_id/doctor_id from a mapping; raises ValueError when invalid"""
+    filters = {}
+    for name in ('from', 'to'):
+        if args.get(name):
+            filters[name] = datetime.strptime(args[name], '%Y-%m-%d').date()
+    if 'from' in filters and 'to' in filters and filters['to'] < filters['from']:
+        raise ValueError("'to' must not be before 'from'")
+    for name in ('department_id', 'doctor_id'):
+        if args.get(name) not in (None, ''):
+            filters[name] = int(args[name])
+    return filters
+
+
+def _export_select(filters, appointment, treatment):
+    statement = db.select(*_export_columns(appointment, treatment)).select_from(appointment).join(
+        Patient, appointment.patient_id == Patient.id
+    ).join(
+        PatientUser, Patient.user_id == PatientUser.id
+    ).join(
+        Doctor, appointment.doctor_id == Doctor.id
+    ).join(
+        DoctorUser, Doctor.user_id == DoctorUser.id
+    ).join(
+        Department, Doctor.department_id == Department.id
+    ).outerjoin(
+        treatment, treatment.appointment_id == appointment.id
+    )
+    if 'from' in filters:
+        statement = statement.where(appointment.appointment_date >= filters['from'])
+    if 'to' in filters:
+        statement = statement.where(appointment.appointment_date <= filters['to'])
+    if 'doctor_id' in filters:
+        statement = statement.where(appointment.doctor_id == filters['doctor_id'])
+    if 'department_id' in filters:
+        statement = statement.where(Doctor.department_id == filters['department_id'])
+    return statement
+
+
+def export_statement(filters):
+    statement = db.union_all(
+        _export_select(filters, Appointment, Treatment),
+        _export_select(filters, ArchivedAppointment, ArchivedTreatment),
+    )
+    columns = statement.selected_columns
+    return statement.order_by(columns.appointment_date, columns.appointment_time, columns.appointment_id)
+
+
+def export_rows(filters, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of up to `batch_size` result rows"""
+    # Reads use the query_only pool when read routing is configured
+    engine = db.engines.get('read') or db.engine
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(export_statement(filters))
+        for batch in result.partitions():
+            yield batch
+
+
+def _plain(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_chunks(filters, fmt, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the export as text chunks, one per batch of rows"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        yield buffer.getvalue()
+        for batch in export_rows(filters, batch_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([[_plain(value) for value in row] for row in batch])
+            yield buffer.getvalue()
+    else:
+        for batch in export_rows(filters, batch_size):
+            yield ''.join(
+                json.dumps(dict(zip(EXPORT_FIELDS, map(_plain, row)))) + '\n' for row in batch
+            )
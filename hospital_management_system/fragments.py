@@ -0,0 +1,88 @@
+"""Fragment caching for templates.
+
+    {% cache 'doctor-today', appointment|fragment_version %} ... {% endcache %}
+
+renders the block once per key and then reuses the HTML from a small LRU
+cache in each process. Keys are made of the values the block shows, so a
+changed row gets a new key and its stale fragment is simply never read
+again (it ages out of the LRU); there is nothing to invalidate.
+
+fragment_version gives the key of an appointment row: every field the row
+blocks render, so a status change, a reschedule or edited symptoms all get a
+new key. Blocks must only render what their key covers, and nothing specific
+to the viewer. Ids start over after a database reset, so reset_database
+clears the cache.
+"""
+import threading
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+FRAGMENT_CACHE_SIZE = 4096
+
+
+class FragmentCache:
+    """LRU of rendered template fragments"""
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache key, ... %} ... {% endcache %} tag"""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        key = tuple(key)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = caller()
+            fragment_cache.put(key, html)
+        return html
+
+
+def fragment_version(appointment):
+    """What an appointment row's fragment depends on"""
+    return (appointment.id, appointment.status, appointment.appointment_date, appointment.appointment_time,
+            appointment.symptoms, appointment.patient.user.username, appointment.patient.phone,
+            appointment.doctor.user.username)
+
+
+def init_fragment_cache(app):
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', FRAGMENT_CACHE_SIZE)
+    fragment_cache.size = app.config['FRAGMENT_CACHE_SIZE']
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.filters['fragment_version'] = fragment_version
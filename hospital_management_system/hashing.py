@@ -0,0 +1,95 @@
+"""Password hashing with a per-process cap on concurrent hashes.
+
+Werkzeug's password hashes are deliberately slow, and a burst of logins
+hashing all at once takes every CPU from unrelated requests. HashingService
+runs them on a small thread or process pool: at most HASH_POOL_SIZE hashes
+run at once in each worker process, at most HASH_QUEUE_LIMIT wait for a
+slot, and callers beyond that get HashingBusy after HASH_QUEUE_TIMEOUT
+seconds so the route can answer 503 immediately.
+
+This only caps CPU concurrency, per process. The request still waits for its
+hash, so it occupies its thread (or a whole sync worker) for the full hash
+time just as inline hashing does, and the limits are not shared between
+gunicorn workers: N workers can run N * HASH_POOL_SIZE hashes at once.
+
+needs_rehash() tells the login route when a stored hash was made with an
+older method or cost than PASSWORD_HASH_METHOD, so it can be upgraded with
+the password the user just proved they know.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingService:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Werkzeug method string, e.g. 'pbkdf2', 'pbkdf2:sha256:900000' or 'scrypt'
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2')
+        # 'thread', 'process' or 'inline' (no pool, hash in the request thread)
+        app.config.setdefault('HASH_POOL', 'thread')
+        app.config.setdefault('HASH_POOL_SIZE', max(1, (os.cpu_count() or 2) // 2))
+        app.config.setdefault('HASH_QUEUE_LIMIT', 32)
+        app.config.setdefault('HASH_QUEUE_TIMEOUT', 2.0)
+
+    def _pool(self, config):
+        with self._lock:
+            # Pools do not survive fork, so gunicorn workers each build their own
+            if self._executor is None or self._pid != os.getpid():
+                size = config['HASH_POOL_SIZE']
+                if config['HASH_POOL'] == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=size)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='hashing')
+                self._slots = threading.BoundedSemaphore(size + config['HASH_QUEUE_LIMIT'])
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def _run(self, func, *args):
+        config = current_app.config
+        if config['HASH_POOL'] == 'inline':
+            return func(*args)
+
+        executor, slots = self._pool(config)
+        if not slots.acquire(timeout=config['HASH_QUEUE_TIMEOUT']):
+            raise HashingBusy('Too many password hashes in progress')
+        try:
+            return executor.submit(func, *args).result()
+        finally:
+            slots.release()
+
+    def hash_password(self, password):
+        return self._run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+    def verify_password(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if `pwhash` was not made with the configured method and cost"""
+        method = current_app.config['PASSWORD_HASH_METHOD']
+        if method not in self._prefixes:
+            # Let Werkzeug expand defaults (e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000')
+            self._prefixes[method] = generate_password_hash('', method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefixes[method]
+
+    def reset(self):
+        """Shut the pool down; the next call builds a new one from current config"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+hashing = HashingService()
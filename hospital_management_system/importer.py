@@ -0,0 +1,345 @@
+"""Bulk import of patients, doctors and doctor availability.
+
+import_file() streams a CSV or NDJSON file record by record, validates each
+chunk in Python and writes it with executemany INSERTs in one transaction per
+chunk, instead of the per-person queries, flush and commit of the web forms.
+Existing usernames, emails and license numbers are loaded into sets once, so
+duplicate checks (against the database and earlier rows of the same file)
+cost no queries. Memory use is one chunk plus those key sets.
+
+Invalid rows are written to <file>.rejects.ndjson with their line number and
+the reason. After every committed chunk the number of records done is saved
+to <file>.progress, so rerunning the same import after an interruption skips
+what is already in the database.
+
+Passwords: a `password_hash` column (Werkzeug format) is stored as is; a
+`password` column is hashed per row, which is slow for large files; rows with
+neither get the kind's default password, hashed once per import. Imported
+accounts can change it with "Forgot password".
+"""
+import csv
+import itertools
+import json
+import os
+import time as timer
+from datetime import date, time, datetime
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Doctor, Patient, Department, DoctorAvailability
+from hashing import hashing
+from stats import bump, daily_key
+from rollups import account_registered
+
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_KINDS = ('patients', 'doctors', 'availability')
+# Same default as doctors added from the admin page
+DEFAULT_PASSWORDS = {'patients': 'patient123', 'doctors': 'doctor123'}
+_TRUE = {'1', 'true', 'yes', 'y'}
+_FALSE = {'0', 'false', 'no', 'n'}
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+class BulkImportError(Exception):
+    pass
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    raise BulkImportError(f'Cannot tell the format of {path}; pass --format csv or ndjson')
+
+
+def read_records(path, fmt):
+    """Yield (line number, record) pairs; a record is a dict or an ImportRowError"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, ImportRowError(f'Invalid JSON: {e}')
+                continue
+            if not isinstance(record, dict):
+                record = ImportRowError('Expected a JSON object')
+            yield number, record
+
+
+def _text(record, name, max_length=None, required=False):
+    value = record.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ImportRowError(f'{name} is required')
+    if max_length and len(value) > max_length:
+        raise ImportRowError(f'{name} is longer than {max_length} characters')
+    return value or None
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(value)
+
+
+def _value(record, name, parser, required=False):
+    value = record.get(name)
+    if value is None or value == '':
+        if required:
+            raise ImportRowError(f'{name} is required')
+        return None
+    try:
+        return parser(value.strip() if isinstance(value, str) else value)
+    except (ValueError, TypeError):
+        raise ImportRowError(f'{name} has an invalid value: {value!r}')
+
+
+class _Progress:
+    """Records done for one input file, kept in <file>.progress"""
+
+    def __init__(self, path, kind):
+        self.path = path + '.progress'
+        stat = os.stat(path)
+        self.signature = {'kind': kind, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if {name: saved.get(name) for name in self.signature} != self.signature:
+            # A different or modified file: start over
+            return 0
+        return saved.get('records_done', 0)
+
+    def save(self, records_done):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(dict(self.signature, records_done=records_done), f)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkImporter:
+    def __init__(self, kind):
+        if kind not in IMPORT_KINDS:
+            raise BulkImportError(f'Unknown import kind {kind!r}')
+        self.kind = kind
+        self.usernames = set()
+        self.emails = set()
+        self.licenses = set()
+        self.departments = {}
+        self.doctors = {}
+        self._default_hash = None
+
+    def load_existing(self):
+        """Read the keys new rows are checked against"""
+        if self.kind == 'availability':
+            rows = db.session.execute(db.select(Doctor.id, User.username).join(User, Doctor.user_id == User.id))
+            for doctor_id, username in rows:
+                self.doctors[username] = doctor_id
+                self.doctors[doctor_id] = doctor_id
+            return
+
+        for username, email in db.session.execute(db.select(User.username, User.email)).yield_per(10000):
+            self.usernames.add(username)
+            self.emails.add(email)
+        if self.kind == 'doctors':
+            self.licenses.update(db.session.execute(
+                db.select(Doctor.license_number).filter(Doctor.license_number != None)
+            ).scalars())
+            for department_id, name in db.session.execute(db.select(Department.id, Department.name)):
+                self.departments[name.lower()] = department_id
+                self.departments[department_id] = department_id
+
+    def _password(self, record):
+        password_hash = _text(record, 'password_hash', 200)
+        if password_hash:
+            if password_hash.count('$') != 2:
+                raise ImportRowError('password_hash is not a Werkzeug password hash')
+            return password_hash
+        password = _text(record, 'password')
+        if password:
+            return hashing.hash_password(password)
+        if self._default_hash is None:
+            self._default_hash = hashing.hash_password(DEFAULT_PASSWORDS[self.kind])
+        return self._default_hash
+
+    def _account(self, record, role):
+        username = _text(record, 'username', 80, required=True)
+        email = _text(record, 'email', 120, required=True)
+        if '@' not in email:
+            raise ImportRowError('email is not an email address')
+        if username in self.usernames:
+            raise ImportRowError(f'username {username!r} already exists')
+        if email in self.emails:
+            raise ImportRowError(f'email {email!r} already registered')
+        return {'username': username, 'email': email, 'password': self._password(record), 'role': role}
+
+    def _patient(self, record):
+        account = self._account(record, 'patient')
+        profile = {
+            'phone': _text(record, 'phone', 15),
+            'date_of_birth': _value(record, 'date_of_birth', date.fromisoformat),
+            'blood_group': _text(record, 'blood_group', 5),
+            'address': _text(record, 'address'),
+            'emergency_contact': _text(record, 'emergency_contact', 15),
+        }
+        return account, profile
+
+    def _doctor(self, record):
+        account = self._account(record, 'doctor')
+        department = _value(record, 'department_id', int) or _text(record, 'department', required=True).lower()
+        if department not in self.departments:
+            raise ImportRowError(f'unknown department {department!r}')
+        license_number = _text(record, 'license_number', 50)
+        if license_number and license_number in self.licenses:
+            raise ImportRowError(f'license number {license_number!r} already exists')
+        profile = {
+            'department_id': self.departments[department],
+            'specialization': _text(record, 'specialization', 100, required=True),
+            'license_number': license_number,
+            'experience': _value(record, 'experience', int),
+            'consultation_fee': _value(record, 'consultation_fee', float) or 0.0,
+        }
+        return account, profile
+
+    def _availability(self, record):
+        doctor = _value(record, 'doctor_id', int) or _text(record, 'doctor', required=True)
+        if doctor not in self.doctors:
+            raise ImportRowError(f'unknown doctor {doctor!r}')
+        start_time = _value(record, 'start_time', time.fromisoformat, required=True)
+        end_time = _value(record, 'end_time', time.fromisoformat, required=True)
+        if end_time <= start_time:
+            raise ImportRowError('end_time must be after start_time')
+        is_available = _value(record, 'is_available', _boolean)
+        return {
+            'doctor_id': self.doctors[doctor],
+            'date': _value(record, 'date', date.fromisoformat, required=True),
+            'start_time': start_time,
+            'end_time': end_time,
+            'is_available': True if is_available is None else is_available,
+        }
+
+    def validate(self, record):
+        """The row(s) to insert for one record; raises ImportRowError"""
+        if isinstance(record, ImportRowError):
+            raise record
+        if self.kind == 'availability':
+            return self._availability(record)
+        row = self._patient(record) if self.kind == 'patients' else self._doctor(record)
+        # Reserve the keys so later rows in the same file are checked too
+        account, profile = row
+        self.usernames.add(account['username'])
+        self.emails.add(account['email'])
+        if profile.get('license_number'):
+            self.licenses.add(profile['license_number'])
+        return row
+
+    def write(self, rows):
+        """Insert one chunk in the session's transaction; returns rows inserted"""
+        connection = db.session.connection()
+        if self.kind == 'availability':
+            # The unique_doctor_slot constraint drops slots that already exist
+            result = connection.execute(
+                insert(DoctorAvailability).on_conflict_do_nothing(
+                    index_elements=['doctor_id', 'date', 'start_time']
+                ),
+                rows
+            )
+            return result.rowcount
+
+        # One registration time per chunk, so the counters and rollup below match the rows
+        created_at = datetime.utcnow()
+        role = 'patient' if self.kind == 'patients' else 'doctor'
+        user_ids = connection.execute(
+            db.insert(User).returning(User.id, sort_by_parameter_order=True),
+            [dict(account, created_at=created_at) for account, _ in rows]
+        ).scalars().all()
+        profile_model = Patient if self.kind == 'patients' else Doctor
+        connection.execute(db.insert(profile_model), [
+            dict(profile, user_id=user_id) for (_, profile), user_id in zip(rows, user_ids)
+        ])
+        if self.kind == 'patients':
+            bump('patients', daily_key('new_patients', created_at.date()), delta=len(rows))
+        else:
+            bump('doctors', delta=len(rows))
+        account_registered(created_at, role, count=len(rows))
+        return len(rows)
+
+
+def import_file(path, kind, fmt=None, chunk_size=IMPORT_CHUNK_SIZE, restart=False, progress=None):
+    """Import `path` into the database in chunks; returns a summary dict.
+
+    `progress` is called with the running summary after every chunk.
+    """
+    fmt = fmt or detect_format(path)
+    importer = BulkImporter(kind)
+    importer.load_existing()
+
+    tracker = _Progress(path, kind)
+    if restart:
+        tracker.clear()
+    resumed = tracker.load()
+    rejects_path = path + '.rejects.ndjson'
+
+    summary = {'resumed_from': resumed, 'read': resumed, 'inserted': 0, 'duplicates': 0, 'rejected': 0,
+               'seconds': 0.0, 'rejects_file': rejects_path}
+    began = timer.perf_counter()
+    records = itertools.islice(read_records(path, fmt), resumed, None)
+    with open(rejects_path, 'a' if resumed else 'w', encoding='utf-8') as rejects:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for line, record in chunk:
+                try:
+                    rows.append(importer.validate(record))
+                except ImportRowError as e:
+                    summary['rejected'] += 1
+                    rejects.write(json.dumps({'line': line, 'error': str(e),
+                                              'record': record if isinstance(record, dict) else None}) + '\n')
+            try:
+                inserted = importer.write(rows) if rows else 0
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                raise BulkImportError(
+                    f'Rows from line {chunk[0][0]} conflict with data written since the import started '
+                    f'({e.orig}); run the import again to resume from there'
+                )
+            rejects.flush()
+            summary['read'] += len(chunk)
+            summary['inserted'] += inserted
+            summary['duplicates'] += len(rows) - inserted
+            tracker.save(summary['read'])
+            summary['seconds'] = timer.perf_counter() - began
+            if progress:
+                progress(summary)
+
+    tracker.clear()
+    if not summary['rejected'] and not resumed:
+        os.remove(rejects_path)
+        summary['rejects_file'] = None
+    summary['seconds'] = timer.perf_counter() - began
+    return summary
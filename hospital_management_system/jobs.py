@@ -0,0 +1,47 @@
+"""Periodic maintenance jobs.
+
+Modules register jobs with @periodic(seconds). They are not run inside the
+web workers: start `flask run-jobs` as one extra process next to gunicorn,
+or call `flask run-jobs --once` from cron.
+"""
+import time as timer
+
+_jobs = []
+
+
+def periodic(interval):
+    """Register a function to run every `interval` seconds by run_jobs()"""
+    def decorator(func):
+        _jobs.append({'name': func.__name__, 'interval': interval, 'func': func, 'last_run': None})
+        return func
+    return decorator
+
+
+def registered_jobs():
+    return [job['name'] for job in _jobs]
+
+
+def run_due_jobs(app, force=False):
+    """Run every job whose interval has elapsed; returns {name: result}"""
+    results = {}
+    now = timer.monotonic()
+    for job in _jobs:
+        if not force and job['last_run'] is not None and now - job['last_run'] < job['interval']:
+            continue
+        job['last_run'] = now
+        with app.app_context():
+            try:
+                results[job['name']] = job['func']()
+            except Exception:
+                app.logger.exception(f"Job {job['name']} failed")
+                results[job['name']] = None
+    return results
+
+
+def run_jobs(app, poll_interval=1.0):
+    """Run jobs forever, each on its own schedule"""
+    while True:
+        for name, result in run_due_jobs(app).items():
+            if result:
+                app.logger.info(f'{name}: {result}')
+        timer.sleep(poll_interval)
@@ -0,0 +1,295 @@
+"""Per-route latency, throughput and queries-per-request benchmark, compared against a saved baseline."""
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time as timer
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from models import User, Doctor
+from profiling import percentile
+from datagen import GENERATED_PASSWORD, SPECIALIZATIONS
+from slots import APPOINTMENT_MINUTES
+
+ROUTES = ('login', 'admin_dashboard', 'doctor_dashboard', 'patient_dashboard', 'search_doctors',
+          'book_appointment', 'cancel_appointment')
+# p95 may grow by this share (and at least BASELINE_NOISE_MS) before it counts as a regression
+BASELINE_TOLERANCE = 0.25
+BASELINE_NOISE_MS = 5.0
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class ClientTransport:
+    """Requests through the Flask test client, in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get('X-Query-Count'), response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """Requests over HTTP with a cookie jar, like one browser"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.headers.get('X-Query-Count'), response.read()
+        except urllib.error.HTTPError as e:
+            # Redirects (not followed) and error statuses both land here
+            return e.code, e.headers.get('X-Query-Count'), e.read()
+
+
+def _login(transport, username, password):
+    status, _, _ = transport.request('POST', '/login', {'username': username, 'password': password})
+    if status != 302:
+        raise BenchmarkError(f'Could not sign in as {username} (HTTP {status})')
+
+
+class _Fixture:
+    """Accounts and ids the scenarios use, read once from the database"""
+
+    def __init__(self, concurrency, admin_password, seed):
+        self.rng = random.Random(seed)
+        self.admin_password = admin_password
+        self.patients = [name for (name,) in User.query.with_entities(User.username).filter(
+            User.username.like('gen\\_patient\\_%', escape='\\')
+        ).limit(max(concurrency, 50))]
+        self.doctors = [name for (name,) in User.query.with_entities(User.username).filter(
+            User.username.like('gen\\_doctor\\_%', escape='\\')
+        ).limit(concurrency)]
+        self.doctor_ids = [doctor_id for (doctor_id,) in Doctor.query.with_entities(Doctor.id).filter_by(
+            is_active=True
+        )]
+        if not self.patients or not self.doctors or not self.doctor_ids:
+            raise BenchmarkError('No generated accounts found; run `flask generate-data` first')
+        # Book far enough ahead not to collide with generated appointments
+        self.first_booking_day = date.today() + timedelta(days=120)
+
+
+def _page(path):
+    return lambda transport, state: ('GET', path, None, (200,))
+
+
+def _scenario(route, fixture):
+    """(role, setup(transport, n) -> state, step(transport, state) -> request or None)
+
+    A request is (method, path, form data, acceptable statuses).
+    """
+    rng = fixture.rng
+
+    def as_admin(transport, n):
+        _login(transport, 'admin', fixture.admin_password)
+        return {}
+
+    def as_doctor(transport, n):
+        _login(transport, fixture.doctors[n % len(fixture.doctors)], GENERATED_PASSWORD)
+        return {}
+
+    def as_patient(transport, n):
+        _login(transport, fixture.patients[n % len(fixture.patients)], GENERATED_PASSWORD)
+        return {'booked': []}
+
+    def login(transport, state):
+        form = {'username': rng.choice(fixture.patients), 'password': GENERATED_PASSWORD}
+        return 'POST', '/login', form, (302,)
+
+    def search(transport, state):
+        params = urllib.parse.urlencode({
+            'specialization': rng.choice(list(SPECIALIZATIONS))[:4],
+            'date': (date.today() + timedelta(days=rng.randrange(1, 30))).isoformat(),
+        })
+        return 'GET', f'/search_doctors?{params}', None, (200,)
+
+    def book(transport, state):
+        minute = rng.randrange(0, 8 * 60, APPOINTMENT_MINUTES)
+        form = {
+            'doctor_id': rng.choice(fixture.doctor_ids),
+            'date': (fixture.first_booking_day + timedelta(days=rng.randrange(365))).isoformat(),
+            'time': f'{9 + minute // 60:02d}:{minute % 60:02d}',
+        }
+        # 409: another client got the slot first
+        return 'POST', '/book_appointment', form, (200, 409)
+
+    def cancel(transport, state):
+        # Cancels what this client booked in the book_appointment run
+        if not state['booked']:
+            return None
+        return 'POST', f"/cancel_appointment/{state['booked'].pop()}", None, (302,)
+
+    scenarios = {
+        'login': ('anonymous', lambda transport, n: {}, login),
+        'admin_dashboard': ('admin', as_admin, _page('/admin/dashboard')),
+        'doctor_dashboard': ('doctor', as_doctor, _page('/doctor/dashboard')),
+        'patient_dashboard': ('patient', as_patient, _page('/patient/dashboard')),
+        'search_doctors': ('patient', as_patient, search),
+        'book_appointment': ('patient', as_patient, book),
+        'cancel_appointment': ('patient', as_patient, cancel),
+    }
+    if route not in scenarios:
+        raise BenchmarkError(f'Unknown route {route!r}')
+    return scenarios[route]
+
+
+def _run_route(route, fixture, sessions, make_transport, requests, concurrency):
+    role, setup, step = _scenario(route, fixture)
+    remaining = [requests]
+    lock = threading.Lock()
+    samples = []
+    failures = []
+
+    def worker(n):
+        # Threads keep their signed-in client across routes of the same role
+        key = (role, n)
+        if key not in sessions:
+            transport = make_transport()
+            sessions[key] = (transport, setup(transport, n))
+        transport, state = sessions[key]
+        warm = False
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            planned = step(transport, state)
+            if planned is None:
+                return
+            method, path, data, ok = planned
+            if method == 'GET' and not warm:
+                # One untimed read per client first, so cold caches and pools don't skew p95
+                transport.request(method, path, data)
+                warm = True
+            began = timer.perf_counter()
+            status, queries, body = transport.request(method, path, data)
+            elapsed = timer.perf_counter() - began
+            with lock:
+                samples.append((elapsed, int(queries) if queries is not None else None))
+                if status not in ok:
+                    failures.append(f'{method} {path} -> {status}')
+            if route == 'book_appointment' and status == 200:
+                state['booked'].append(json.loads(body)['appointment_id'])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    began = timer.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = timer.perf_counter() - began
+
+    latencies = [elapsed * 1000 for elapsed, _ in samples]
+    counted = [queries for _, queries in samples if queries is not None]
+    return {
+        'requests': len(samples),
+        'errors': len(failures),
+        'first_error': failures[0] if failures else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'requests_per_second': len(samples) / wall if wall else 0.0,
+        'queries_per_request': sum(counted) / len(counted) if counted else None,
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(app, workers=2, threads=4):
+    """Start gunicorn serving this app on a free local port; returns (process, base_url)"""
+    port = _free_port()
+    env = dict(os.environ, QUERY_COUNT_HEADER='1')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=app.root_path, env=env
+    )
+    deadline = timer.monotonic() + 30
+    while timer.monotonic() < deadline:
+        if process.poll() is not None:
+            raise BenchmarkError('gunicorn exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            timer.sleep(0.2)
+    process.terminate()
+    raise BenchmarkError('gunicorn did not start listening within 30s')
+
+
+def route_benchmark(app, routes=ROUTES, requests=200, concurrency=8, base_url=None, admin_password='admin123',
+                    seed=7):
+    """Benchmark each route in turn; returns {route: stats}.
+
+    Without `base_url` requests go through the test client in this process.
+    Must be called inside an app context.
+    """
+    fixture = _Fixture(concurrency, admin_password, seed)
+    if base_url:
+        make_transport = lambda: HttpTransport(base_url)
+    else:
+        make_transport = lambda: ClientTransport(app)
+
+    original = app.config.get('QUERY_COUNT_HEADER', False)
+    app.config['QUERY_COUNT_HEADER'] = True
+    sessions = {}
+    results = {}
+    try:
+        for route in routes:
+            results[route] = _run_route(route, fixture, sessions, make_transport, requests, concurrency)
+    finally:
+        app.config['QUERY_COUNT_HEADER'] = original
+    return results
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, **meta):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'routes': results}, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(results, baseline, tolerance=BASELINE_TOLERANCE):
+    """Human-readable regressions of `results` against a saved baseline"""
+    regressions = []
+    for route, current in results.items():
+        if current['errors']:
+            regressions.append(f"{route}: {current['errors']} failed requests ({current['first_error']})")
+        previous = baseline['routes'].get(route)
+        if not previous:
+            continue
+        allowed = max(previous['p95_ms'] * (1 + tolerance), previous['p95_ms'] + BASELINE_NOISE_MS)
+        if current['p95_ms'] > allowed:
+            regressions.append(f"{route}: p95 {current['p95_ms']:.1f}ms, baseline {previous['p95_ms']:.1f}ms")
+        if (current['queries_per_request'] is not None and previous['queries_per_request'] is not None
+                and current['queries_per_request'] > previous['queries_per_request'] + 0.5):
+            regressions.append(f"{route}: {current['queries_per_request']:.1f} queries/request, "
+                               f"baseline {previous['queries_per_request']:.1f}")
+    return regressions
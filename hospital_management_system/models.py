@@ -2,8 +2,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 import sqlite3
+from engine import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -16,6 +17,11 @@ class User(UserMixin, db.Model):
     
     doctor_profile = db.relationship('Doctor', backref='user', uselist=False, cascade='all, delete-orphan')
     patient_profile = db.relationship('Patient', backref='user', uselist=False, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # New-registration counts on the admin dashboard
+        db.Index('ix_users_created_at', 'created_at'),
+    )
 
 class Department(db.Model):
     __tablename__ = 'departments'
@@ -38,6 +44,10 @@ class Doctor(db.Model):
     
     availabilities = db.relationship('DoctorAvailability', backref='doctor', lazy=True)
     appointments = db.relationship('Appointment', backref='doctor', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_doctors_user_id', 'user_id'),
+    )
 
 class Patient(db.Model):
     __tablename__ = 'patients'
@@ -51,6 +61,10 @@ class Patient(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     appointments = db.relationship('Appointment', backref='patient', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_patients_user_id', 'user_id'),
+    )
 
 class DoctorAvailability(db.Model):
     __tablename__ = 'doctor_availability'
@@ -61,7 +75,44 @@ class DoctorAvailability(db.Model):
     end_time = db.Column(db.Time, nullable=False)
     is_available = db.Column(db.Boolean, default=True)
     
-    __table_args__ = (db.UniqueConstraint('doctor_id', 'date', 'start_time', name='unique_doctor_slot'),)
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'date', 'start_time', name='unique_doctor_slot'),
+        # Free slots: "which days is this doctor available"
+        db.Index('ix_doctor_availability_lookup', 'doctor_id', 'date', 'is_available'),
+        # Doctor search by date: the doctors available that day, in id order
+        db.Index('ix_doctor_availability_day', 'date', 'is_available', 'doctor_id'),
+    )
+
+class ScheduleTemplate(db.Model):
+    """A doctor's recurring weekly hours, expanded into doctor_availability by schedules.py"""
+    __tablename__ = 'schedule_templates'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    weekdays = db.Column(db.String(7), nullable=False)  # ISO weekday digits, '12345' = Mon-Fri
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    slot_minutes = db.Column(db.Integer)  # None: one availability row for the whole window
+    valid_from = db.Column(db.Date, nullable=False)
+    valid_until = db.Column(db.Date)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    expanded_until = db.Column(db.Date)  # Last day materialized by expand_schedules()
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_schedule_templates_doctor_id', 'doctor_id'),
+    )
+
+class ScheduleException(db.Model):
+    """A day off (holiday, leave) that schedule templates skip; doctor_id None means every doctor"""
+    __tablename__ = 'schedule_exceptions'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'))
+    date = db.Column(db.Date, nullable=False)
+    reason = db.Column(db.String(100))
+    
+    __table_args__ = (
+        db.Index('ix_schedule_exceptions_date', 'date'),
+    )
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
@@ -75,6 +126,23 @@ class Appointment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     treatment = db.relationship('Treatment', backref='appointment', uselist=False, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Slot checks and the doctor's today / upcoming lists
+        db.Index('ix_appointments_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time', 'status'),
+        # At most one active booking per doctor slot (see booking.reserve_slot)
+        db.Index('uq_appointments_active_slot', 'doctor_id', 'appointment_date', 'appointment_time',
+                 unique=True, sqlite_where=db.text("status = 'Booked'")),
+        # Patient's upcoming and past lists
+        db.Index('ix_appointments_patient_status', 'patient_id', 'status', 'appointment_date', 'appointment_time'),
+        # Keyset pages of a patient's history, newest first (see queries.history_page)
+        db.Index('ix_appointments_patient_history', 'patient_id', 'appointment_date', 'appointment_time'),
+        # Admin dashboard: today's counts and most recent bookings
+        db.Index('ix_appointments_date_status', 'appointment_date', 'status'),
+        db.Index('ix_appointments_created_at', 'created_at'),
+        # Archived rows keep their ids (see archive.py), so ids must never be handed out again
+        {'sqlite_autoincrement': True},
+    )
 
 class Treatment(db.Model):
     __tablename__ = 'treatments'
@@ -83,4 +151,157 @@ class Treatment(db.Model):
     diagnosis = db.Column(db.Text)
     prescription = db.Column(db.Text)
     notes = db.Column(db.Text)
-    treatment_date = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    treatment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_treatments_appointment_id', 'appointment_id'),
+        # Archived rows keep their ids (see archive.py), so ids must never be handed out again
+        {'sqlite_autoincrement': True},
+    )
+
+class ArchivedAppointment(db.Model):
+    """A closed appointment moved out of appointments by archive.py; same columns and id"""
+    __tablename__ = 'archived_appointments'
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    appointment_time = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    symptoms = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    
+    # Same attribute names as Appointment, so templates render either
+    patient = db.relationship('Patient')
+    doctor = db.relationship('Doctor')
+    treatment = db.relationship('ArchivedTreatment', backref='appointment', uselist=False)
+    
+    __table_args__ = (
+        # Keyset pages of a patient's history (see queries.history_page)
+        db.Index('ix_archived_appointments_patient_history', 'patient_id', 'appointment_date', 'appointment_time'),
+        # Doctor scope of treatment search and filtered exports
+        db.Index('ix_archived_appointments_doctor', 'doctor_id', 'appointment_date'),
+        db.Index('ix_archived_appointments_date', 'appointment_date'),
+    )
+
+class ArchivedTreatment(db.Model):
+    """The treatment of an archived appointment; same columns and id as in treatments"""
+    __tablename__ = 'archived_treatments'
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('archived_appointments.id'), nullable=False)
+    diagnosis = db.Column(db.Text)
+    prescription = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    treatment_date = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_archived_treatments_appointment_id', 'appointment_id'),
+    )
+
+class StatCounter(db.Model):
+    """Running totals for the admin dashboard, see stats.py"""
+    __tablename__ = 'stat_counters'
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DoctorDailyRollup(db.Model):
+    """Appointments of one doctor on one day, see rollups.py"""
+    __tablename__ = 'doctor_daily_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), primary_key=True)
+    appointments = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    
+    # Rows are only ever read by primary key range, so store them in that order
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class DoctorMonthlyRollup(db.Model):
+    """DoctorDailyRollup summed over a calendar month (month = its first day)"""
+    __tablename__ = 'doctor_monthly_rollups'
+    month = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), primary_key=True)
+    appointments = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class DepartmentDailyRollup(db.Model):
+    """Appointments of one department on one day, see rollups.py"""
+    __tablename__ = 'department_daily_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), primary_key=True)
+    appointments = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class RegistrationDailyRollup(db.Model):
+    """New accounts per role on one day (UTC, like users.created_at), see rollups.py"""
+    __tablename__ = 'registration_daily_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    role = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class PasswordResetToken(db.Model):
+    """Single-use password reset links; only a SHA-256 digest of the token is stored"""
+    __tablename__ = 'password_reset_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_password_reset_tokens_user_id', 'user_id'),
+        # Sweeper range-deletes expired rows
+        db.Index('ix_password_reset_tokens_expires_at', 'expires_at'),
+    )
+
+class OutboxMessage(db.Model):
+    """Queued outgoing email, delivered by the background sender in outbox.py"""
+    __tablename__ = 'outbox_messages'
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # The sender's "what is due" scan
+        db.Index('ix_outbox_messages_due', 'status', 'next_attempt_at'),
+        # Sweeper range-deletes old sent rows
+        db.Index('ix_outbox_messages_sent', 'status', 'sent_at'),
+    )
+
+class Event(db.Model):
+    """Change published to live dashboards, fanned out to their streams by events.py"""
+    __tablename__ = 'events'
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(40), nullable=False)  # doctor:<id>, admin
+    kind = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Replay after a reconnect: one channel's events after an id
+        db.Index('ix_events_channel_id', 'channel', 'id'),
+        # Sweeper range-deletes old rows
+        db.Index('ix_events_created_at', 'created_at'),
+        # Ids are never reused after the sweep, so pollers can follow them
+        {'sqlite_autoincrement': True},
+    )
\ No newline at end of file
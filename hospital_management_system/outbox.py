@@ -0,0 +1,193 @@
+"""Email outbox.
+
+Routes never talk to the mail server. enqueue_email() adds a row to
+outbox_messages in the caller's transaction and returns immediately; the
+periodic deliver_pending() job (run by `flask run-jobs`) claims due messages
+in batches, sends them over one reused SMTP connection, retries failures with
+exponential backoff and marks a message dead after OUTBOX_MAX_ATTEMPTS.
+Sent messages are deleted by a periodic sweep after OUTBOX_SENT_RETENTION;
+dead ones stay until they are requeued (`flask outbox --requeue-dead`).
+
+MAIL_BACKEND = 'console' prints messages instead of sending them, which is
+the default until real SMTP settings are configured. Point MAIL_SERVER /
+MAIL_PORT at a local stand-in (e.g. `python -m aiosmtpd -n -l localhost:1025`
+with MAIL_USE_TLS = False) to exercise the SMTP path.
+"""
+import smtplib
+import time as timer
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from flask import current_app
+from models import db, OutboxMessage
+from jobs import periodic
+
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+# Retry after 30s, 1m, 2m, 4m... capped at an hour
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 60 * 60
+# A claimed batch is released for other senders if not finished in time
+OUTBOX_CLAIM_SECONDS = 120
+OUTBOX_SENT_RETENTION = timedelta(days=30)
+OUTBOX_SWEEP_INTERVAL = 60 * 60
+
+
+def enqueue_email(recipient, subject, body):
+    """Queue an email in the current transaction; the caller commits"""
+    message = OutboxMessage(recipient=recipient, subject=subject, body=body)
+    db.session.add(message)
+    return message
+
+
+class SmtpConnection:
+    """One SMTP session kept open across batches and reopened when it drops"""
+
+    def __init__(self, idle_timeout=60, check_after=5):
+        self.idle_timeout = idle_timeout
+        # Only spend a NOOP round trip on a session that has been idle a while
+        self.check_after = check_after
+        self._server = None
+        self._last_used = 0.0
+
+    def _open(self, config):
+        server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=30)
+        if config['MAIL_USE_TLS']:
+            server.starttls()
+        if config.get('MAIL_USERNAME') and config.get('MAIL_PASSWORD'):
+            server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        return server
+
+    def _alive(self):
+        try:
+            return self._server.noop()[0] == 250
+        except OSError:
+            return False
+
+    def get(self, config):
+        idle = timer.monotonic() - self._last_used
+        if self._server is not None and (
+            idle > self.idle_timeout or (idle > self.check_after and not self._alive())
+        ):
+            self.close()
+        if self._server is None:
+            self._server = self._open(config)
+        self._last_used = timer.monotonic()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except OSError:
+                pass
+            self._server = None
+
+
+smtp_connection = SmtpConnection()
+
+
+def _send(message, config):
+    if config['MAIL_BACKEND'] == 'console':
+        print(f'📧 To: {message.recipient}\nSubject: {message.subject}\n\n{message.body}')
+        return
+
+    mime = MIMEText(message.body, 'plain')
+    mime['From'] = config.get('MAIL_DEFAULT_SENDER') or config['MAIL_USERNAME']
+    mime['To'] = message.recipient
+    mime['Subject'] = message.subject
+    try:
+        smtp_connection.get(config).send_message(mime)
+    except smtplib.SMTPServerDisconnected:
+        # The server closed an idle session under us: reconnect once
+        smtp_connection.close()
+        smtp_connection.get(config).send_message(mime)
+
+
+def _claim_batch(now, batch_size):
+    """Lease up to batch_size due messages to this sender"""
+    due = db.select(OutboxMessage.id).where(
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= now,
+        db.or_(OutboxMessage.claimed_until == None, OutboxMessage.claimed_until < now)
+    ).order_by(OutboxMessage.next_attempt_at).limit(batch_size)
+    ids = db.session.execute(
+        db.update(OutboxMessage).where(OutboxMessage.id.in_(due))
+        .values(claimed_until=now + timedelta(seconds=OUTBOX_CLAIM_SECONDS))
+        .returning(OutboxMessage.id)
+    ).scalars().all()
+    db.session.commit()
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id).all() if ids else []
+
+
+def deliver_pending(batch_size=OUTBOX_BATCH_SIZE):
+    """Send due messages in batches until none are left; returns a summary"""
+    config = current_app.config
+    summary = {'sent': 0, 'retried': 0, 'dead': 0}
+    while True:
+        now = datetime.utcnow()
+        batch = _claim_batch(now, batch_size)
+        if not batch:
+            break
+        for message in batch:
+            message.attempts += 1
+            message.claimed_until = None
+            try:
+                _send(message, config)
+            except OSError as e:
+                # smtplib.SMTPException is an OSError too
+                smtp_connection.close()
+                message.last_error = str(e)
+                if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    message.status = 'dead'
+                    summary['dead'] += 1
+                else:
+                    delay = min(OUTBOX_RETRY_BASE * 2 ** (message.attempts - 1), OUTBOX_RETRY_MAX)
+                    message.next_attempt_at = now + timedelta(seconds=delay)
+                    summary['retried'] += 1
+            else:
+                message.status = 'sent'
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+                summary['sent'] += 1
+        db.session.commit()
+        if summary['retried'] or summary['dead']:
+            # Don't hammer a failing server within one run
+            break
+    return summary
+
+
+@periodic(OUTBOX_POLL_INTERVAL)
+def deliver_outbox_job():
+    summary = deliver_pending()
+    return summary if any(summary.values()) else None
+
+
+def sweep_sent(retention=OUTBOX_SENT_RETENTION):
+    """Delete messages sent more than `retention` ago; returns how many"""
+    removed = OutboxMessage.query.filter(
+        OutboxMessage.status == 'sent',
+        OutboxMessage.sent_at < datetime.utcnow() - retention
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+@periodic(OUTBOX_SWEEP_INTERVAL)
+def sweep_outbox_job():
+    removed = sweep_sent()
+    return {'sent_messages_removed': removed} if removed else None
+
+
+def outbox_counts():
+    return dict(db.session.query(OutboxMessage.status, db.func.count()).group_by(OutboxMessage.status))
+
+
+def requeue_dead():
+    """Give dead messages a fresh set of attempts; returns how many"""
+    count = OutboxMessage.query.filter_by(status='dead').update(
+        {'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
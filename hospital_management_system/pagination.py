@@ -0,0 +1,84 @@
+"""Keyset (cursor) pagination.
+
+OFFSET pagination reads and discards every row before the requested page, so
+deep pages get slower as a list grows. keyset_page() instead orders by a
+unique sort key (ending in the primary key) and asks for rows strictly after
+the last one the client saw, which an index on the key answers by seeking
+straight to the page. The client only ever sees an opaque cursor string.
+"""
+import base64
+import json
+from datetime import date, time, datetime
+from models import db
+
+_PARSERS = {date: date.fromisoformat, time: time.fromisoformat, datetime: datetime.fromisoformat}
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Sort key values for `columns` from a cursor; raises ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    parsed = []
+    for column, value in zip(columns, values):
+        python_type = column.type.python_type
+        try:
+            parsed.append(_PARSERS.get(python_type, python_type)(value))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+    return tuple(parsed)
+
+
+def keyset_query(query, columns, cursor=None, limit=20, descending=False):
+    """`query` narrowed to the page after `cursor`: the statement keyset_page() runs"""
+    if cursor:
+        key = db.tuple_(*columns)
+        after = db.tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(key < after if descending else key > after)
+    query = query.order_by(*[column.desc() if descending else column for column in columns])
+    # One extra row tells us whether another page exists
+    return query.limit(limit + 1)
+
+
+def keyset_page(query, columns, cursor=None, limit=20, descending=False):
+    """One page of `query` ordered by `columns`; returns (rows, next_cursor).
+
+    `columns` must end in a unique column so the order is total. next_cursor
+    is None on the last page.
+    """
+    rows = keyset_query(query, columns, cursor, limit, descending).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+
+def merged_keyset_page(sources, cursor=None, limit=20, descending=False):
+    """One page over several queries that share a sort key; returns (rows, next_cursor).
+
+    `sources` is [(query, columns)] with columns of the same types in the
+    same order, and a key must not appear in more than one query. Each query
+    is paged with keyset_page() and the pages are merged, so the cursor works
+    for all of them.
+    """
+    keyed = []
+    more = False
+    for query, columns in sources:
+        rows, next_cursor = keyset_page(query, columns, cursor, limit, descending)
+        more = more or next_cursor is not None
+        keyed.extend((tuple(getattr(row, column.key) for column in columns), row) for row in rows)
+    keyed.sort(key=lambda item: item[0], reverse=descending)
+    more = more or len(keyed) > limit
+    keyed = keyed[:limit]
+    rows = [row for _, row in keyed]
+    if not more:
+        return rows, None
+    return rows, encode_cursor(keyed[-1][0])
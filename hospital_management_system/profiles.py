@@ -0,0 +1,125 @@
+"""Current user and role profile resolution.
+
+load_current_user() fetches the user together with their doctor/patient
+profile in one query, so routes read current_user.doctor_profile or
+current_user.patient_profile instead of running a second filter_by(user_id=...)
+lookup. The column values are also kept in a small LRU cache keyed by
+(user id, login session); a hit rebuilds the objects in the request's session
+without touching the database.
+
+Entries are dropped on password reset, logout and database reset via
+invalidate_profile(). Other worker processes keep their own cache, so each
+entry also expires after PROFILE_CACHE_TTL seconds.
+"""
+import threading
+import time as timer
+from collections import OrderedDict
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from models import db, User, Doctor, Patient
+
+PROFILE_CACHE_SIZE = 1024
+PROFILE_CACHE_TTL = 30
+
+
+def _columns(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+class ProfileCache:
+    def __init__(self, size=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, snapshot = entry
+            if timer.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def put(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (timer.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == user_id]:
+                    del self._entries[key]
+
+
+profile_cache = ProfileCache()
+
+
+def _snapshot(user):
+    profile = user.doctor_profile or user.patient_profile
+    return {
+        'user': _columns(user),
+        'profile': (type(profile), _columns(profile)) if profile else None,
+    }
+
+
+def _hydrate(snapshot):
+    """Rebuild a cached user (and profile) as persistent objects in db.session"""
+    user = User(**snapshot['user'])
+    user.doctor_profile = None
+    user.patient_profile = None
+    if snapshot['profile']:
+        profile_class, columns = snapshot['profile']
+        profile = profile_class(**columns)
+        if profile_class is Doctor:
+            user.doctor_profile = profile
+        else:
+            user.patient_profile = profile
+        make_transient_to_detached(profile)
+    make_transient_to_detached(user)
+    db.session.add(user)
+    return user
+
+
+def user_query(user_id):
+    """The user with their doctor and patient profiles joined in"""
+    return User.query.options(
+        joinedload(User.doctor_profile),
+        joinedload(User.patient_profile)
+    ).filter_by(id=user_id)
+
+
+def load_current_user(user_id, session_key=None):
+    """The user with their role profile loaded, from the cache when possible"""
+    key = (user_id, session_key)
+    snapshot = profile_cache.get(key)
+    if snapshot is not None:
+        return _hydrate(snapshot)
+
+    user = user_query(user_id).first()
+    if user is not None:
+        profile_cache.put(key, _snapshot(user))
+    return user
+
+
+def current_profile():
+    """The Doctor or Patient row of the logged-in user, or None"""
+    if current_user.role == 'doctor':
+        return current_user.doctor_profile
+    if current_user.role == 'patient':
+        return current_user.patient_profile
+    return None
+
+
+def invalidate_profile(user_id=None):
+    """Drop cached entries for a user (or everyone) after their data changes"""
+    profile_cache.invalidate(user_id)
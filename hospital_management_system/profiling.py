@@ -0,0 +1,198 @@
+"""Opt-in per-request profiling.
+
+With PROFILING_ENABLED every request records its wall time, the number of
+SQL statements (the count query_budget.py already keeps), the time spent in
+those statements, the time spent rendering templates and its slowest
+statements. The numbers are reported three ways:
+
+- a Server-Timing header (app, db and tpl), which browser dev tools show
+  next to the request
+- one JSON log line per request slower than PROFILING_SLOW_REQUEST_MS
+- /admin/profiling, p50/p95/p99 per endpoint over the last
+  PROFILING_WINDOW requests of each endpoint
+
+The hooks cost two perf_counter() calls per statement and per template
+and one deque append per request; percentiles are only computed when the
+admin page is opened. Samples live in the memory of each worker process,
+so under gunicorn the page shows the worker that served it.
+"""
+import heapq
+import json
+import os
+import threading
+import time as timer
+from collections import deque
+from datetime import datetime
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from query_budget import query_count
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class RequestProfile:
+    """What one request spent its time on"""
+
+    def __init__(self, top_statements):
+        self.started = timer.perf_counter()
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.template_started = None
+        self.top_statements = top_statements
+        # Min-heap of (seconds, statement), the slowest `top_statements` seen
+        self.statements = []
+
+    def add_statement(self, seconds, statement):
+        self.sql_seconds += seconds
+        if len(self.statements) < self.top_statements:
+            heapq.heappush(self.statements, (seconds, statement))
+        elif self.statements and seconds > self.statements[0][0]:
+            heapq.heapreplace(self.statements, (seconds, statement))
+
+    def slowest(self):
+        return [(seconds, statement) for seconds, statement in sorted(self.statements, reverse=True)]
+
+
+class ProfileStore:
+    """Recent samples per endpoint, in this process"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self.since = datetime.utcnow()
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, wall_ms, sql_ms, template_ms, queries):
+        with self.lock:
+            samples = self.samples.get(endpoint)
+            if samples is None:
+                samples = self.samples[endpoint] = deque(maxlen=self.window)
+            samples.append((wall_ms, sql_ms, template_ms, queries))
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.since = datetime.utcnow()
+
+    def summary(self):
+        """Per-endpoint percentiles, slowest p95 first"""
+        with self.lock:
+            snapshot = {endpoint: list(samples) for endpoint, samples in self.samples.items()}
+        rows = []
+        for endpoint, samples in snapshot.items():
+            wall = [sample[0] for sample in samples]
+            rows.append({
+                'endpoint': endpoint,
+                'requests': len(samples),
+                'p50_ms': percentile(wall, 50),
+                'p95_ms': percentile(wall, 95),
+                'p99_ms': percentile(wall, 99),
+                'max_ms': max(wall),
+                'sql_ms': sum(sample[1] for sample in samples) / len(samples),
+                'template_ms': sum(sample[2] for sample in samples) / len(samples),
+                'queries': sum(sample[3] for sample in samples) / len(samples),
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+profiles = ProfileStore()
+
+
+def _profile():
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _profile() is not None:
+        context._profiling_started = timer.perf_counter()
+
+
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_profiling_started', None)
+    if started is None:
+        return
+    profile = _profile()
+    if profile is not None:
+        profile.add_statement(timer.perf_counter() - started, statement)
+
+
+def _template_started(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None:
+        # Only the outermost render counts, so nested render_template calls aren't added twice
+        if profile.template_depth == 0:
+            profile.template_started = timer.perf_counter()
+        profile.template_depth += 1
+
+
+def _template_finished(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None and profile.template_depth:
+        profile.template_depth -= 1
+        if profile.template_depth == 0:
+            profile.template_seconds += timer.perf_counter() - profile.template_started
+
+
+def init_profiling(app):
+    app.config.setdefault('PROFILING_ENABLED', False)
+    # Requests slower than this are logged with their slowest statements
+    app.config.setdefault('PROFILING_SLOW_REQUEST_MS', 500)
+    app.config.setdefault('PROFILING_TOP_STATEMENTS', 3)
+    app.config.setdefault('PROFILING_WINDOW', 500)
+    app.config.setdefault('PROFILING_SERVER_TIMING', True)
+    if not app.config['PROFILING_ENABLED']:
+        return
+
+    profiles.window = app.config['PROFILING_WINDOW']
+    if not event.contains(Engine, 'before_cursor_execute', _statement_started):
+        event.listen(Engine, 'before_cursor_execute', _statement_started)
+        event.listen(Engine, 'after_cursor_execute', _statement_finished)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def start_profile():
+        g.profile = RequestProfile(app.config['PROFILING_TOP_STATEMENTS'])
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        wall_ms = (timer.perf_counter() - profile.started) * 1000
+        sql_ms = profile.sql_seconds * 1000
+        template_ms = profile.template_seconds * 1000
+        queries = query_count()
+        endpoint = request.endpoint or '<unmatched>'
+        profiles.record(endpoint, wall_ms, sql_ms, template_ms, queries)
+
+        if app.config['PROFILING_SERVER_TIMING']:
+            response.headers.add('Server-Timing', ', '.join([
+                f'app;dur={wall_ms:.1f}',
+                f'db;dur={sql_ms:.1f};desc="{queries} queries"',
+                f'tpl;dur={template_ms:.1f}',
+            ]))
+        if wall_ms >= app.config['PROFILING_SLOW_REQUEST_MS']:
+            app.logger.warning('Slow request %s', json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': endpoint,
+                'status': response.status_code,
+                'wall_ms': round(wall_ms, 1),
+                'sql_ms': round(sql_ms, 1),
+                'template_ms': round(template_ms, 1),
+                'queries': queries,
+                'slowest': [{'ms': round(seconds * 1000, 1), 'sql': ' '.join(statement.split())[:500]}
+                            for seconds, statement in profile.slowest()],
+                'pid': os.getpid(),
+            }))
+        return response
@@ -0,0 +1,168 @@
+"""Loader options and list queries for the dashboard views.
+
+Every relationship in models.py is lazy, so templates that walk
+appointment.patient.user or appointment.doctor.department would issue a
+SELECT per row. The *_graph() helpers pull the whole graph in with the
+parent query.
+
+The list queries below are what the views run, built here rather than in
+the routes so that `flask explain-queries` (schema.hot_queries()) checks the
+plans of the same statements.
+"""
+from sqlalchemy.orm import joinedload
+from models import db, User, Department, Doctor, Patient, Appointment, ArchivedAppointment, DoctorAvailability
+from pagination import keyset_page, merged_keyset_page
+from search import ranked_doctors
+
+# Doctor search page sizes
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Keyset page sizes for the admin doctor list and patient appointment history
+DOCTOR_PAGE_SIZE = 20
+HISTORY_PAGE_SIZE = 10
+TREATMENT_SEARCH_PAGE_SIZE = 20
+
+
+def appointment_graph():
+    """Eager-load patient, doctor, department and treatment for appointment rows"""
+    doctor = joinedload(Appointment.doctor)
+    return (
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        doctor.joinedload(Doctor.user),
+        doctor.joinedload(Doctor.department),
+        joinedload(Appointment.treatment),
+    )
+
+
+def appointment_list_graph():
+    """appointment_graph() without the treatment, which only the detail modal shows"""
+    doctor = joinedload(Appointment.doctor)
+    return (
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        doctor.joinedload(Doctor.user),
+        doctor.joinedload(Doctor.department),
+    )
+
+
+def archived_appointment_graph():
+    """appointment_graph() for archived appointments"""
+    doctor = joinedload(ArchivedAppointment.doctor)
+    return (
+        joinedload(ArchivedAppointment.patient).joinedload(Patient.user),
+        doctor.joinedload(Doctor.user),
+        doctor.joinedload(Doctor.department),
+        joinedload(ArchivedAppointment.treatment),
+    )
+
+
+def doctor_graph():
+    """Eager-load the user account and department of a doctor"""
+    return (
+        joinedload(Doctor.user),
+        joinedload(Doctor.department),
+    )
+
+
+def doctor_list():
+    """All doctors with their account and department, for keyset pages in id order"""
+    return Doctor.query.options(*doctor_graph()), [Doctor.id]
+
+
+def doctor_page(cursor=None):
+    """One page of doctors in id order, with the next page's cursor"""
+    return keyset_page(*doctor_list(), cursor, DOCTOR_PAGE_SIZE)
+
+
+def history_sources(patient_id, include_archived=False):
+    """[(query, sort columns)] of a patient's past appointments, archived ones too if `include_archived`"""
+    query = Appointment.query.options(*appointment_graph()).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.status.in_(['Completed', 'Cancelled'])
+    )
+    sources = [(query, [Appointment.appointment_date, Appointment.appointment_time, Appointment.id])]
+    if include_archived:
+        archived = ArchivedAppointment.query.options(*archived_appointment_graph()).filter(
+            ArchivedAppointment.patient_id == patient_id
+        )
+        sources.append((archived, [ArchivedAppointment.appointment_date, ArchivedAppointment.appointment_time,
+                                   ArchivedAppointment.id]))
+    return sources
+
+
+def history_page(patient_id, cursor=None, include_archived=False):
+    """One page of a patient's past appointments, newest first, archived ones too if `include_archived`"""
+    sources = history_sources(patient_id, include_archived)
+    if len(sources) == 1:
+        return keyset_page(*sources[0], cursor, HISTORY_PAGE_SIZE, descending=True)
+    return merged_keyset_page(sources, cursor, HISTORY_PAGE_SIZE, descending=True)
+
+
+def todays_appointments(doctor_id, day):
+    """A doctor's appointments on `day` in time order"""
+    return Appointment.query.options(*appointment_list_graph()).filter_by(
+        doctor_id=doctor_id,
+        appointment_date=day
+    ).order_by(Appointment.appointment_time)
+
+
+def upcoming_appointments(doctor_id, start, end):
+    """A doctor's booked appointments from `start` to `end`, soonest first"""
+    return Appointment.query.options(*appointment_list_graph()).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date.between(start, end),
+        Appointment.status == 'Booked'
+    ).order_by(Appointment.appointment_date, Appointment.appointment_time)
+
+
+def patient_upcoming_appointments(patient_id):
+    """A patient's booked appointments, soonest first"""
+    return Appointment.query.options(*appointment_graph()).filter_by(
+        patient_id=patient_id,
+        status='Booked'
+    ).order_by(Appointment.appointment_date, Appointment.appointment_time)
+
+
+def recent_appointments(limit=5):
+    """The newest bookings for the admin dashboard"""
+    return Appointment.query.options(*appointment_list_graph()).order_by(
+        Appointment.created_at.desc()
+    ).limit(limit)
+
+
+def doctor_search(text, search_date=None):
+    """Active doctors matching `text` (and free on `search_date`) and the keyset columns to page them by"""
+    # Project only the columns the results need instead of loading
+    # Doctor/User/Department objects row by row
+    query = db.session.query(
+        Doctor.id,
+        User.username,
+        Doctor.specialization,
+        Department.name.label('department'),
+        Doctor.experience,
+        Doctor.consultation_fee
+    ).join(User, Doctor.user_id == User.id).join(
+        Department, Doctor.department_id == Department.id
+    ).filter(Doctor.is_active == True)
+
+    # Free text goes through the FTS index (name, specialization, department),
+    # best matches first; without it doctors are listed in id order
+    ranked = ranked_doctors(text)
+    if ranked is not None:
+        query = query.join(ranked, ranked.c.doctor_id == Doctor.id).add_columns(ranked.c.rank)
+        columns = [ranked.c.rank, Doctor.id]
+    else:
+        columns = [Doctor.id]
+
+    if search_date is not None:
+        # Driven by the doctors available that day (ix_doctor_availability_day)
+        # rather than a check per doctor in id order
+        query = query.filter(
+            Doctor.id.in_(
+                db.select(DoctorAvailability.doctor_id).where(
+                    DoctorAvailability.date == search_date,
+                    DoctorAvailability.is_available == True
+                )
+            )
+        )
+    return query, columns
@@ -0,0 +1,62 @@
+"""Per-request SQL statement counting with an optional budget per view.
+
+Views declare how many statements they are allowed to run with
+@query_budget(n). Every statement executed while a request is active is
+counted; when a view goes over its budget a warning is logged, or, in
+testing / QUERY_BUDGET_STRICT mode, QueryBudgetExceeded is raised so N+1
+regressions fail loudly.
+"""
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Declare the maximum number of SQL statements a view may execute"""
+    def decorator(view):
+        view._query_budget = limit
+        return view
+    return decorator
+
+
+def query_count():
+    """Number of SQL statements executed so far in the current request"""
+    return g.get('query_count', 0)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def init_query_budget(app):
+    app.config.setdefault('QUERY_BUDGET_STRICT', False)
+    # Report the statement count in an X-Query-Count response header (load tests)
+    app.config.setdefault('QUERY_COUNT_HEADER', False)
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+    @app.before_request
+    def reset_query_count():
+        # g outlives the request when an app context was already pushed
+        # (CLI commands, tests), so start every request from zero
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        view = app.view_functions.get(request.endpoint)
+        limit = getattr(view, '_query_budget', None)
+        count = query_count()
+        if limit is not None and count > limit:
+            message = f'{request.endpoint} ran {count} SQL statements (budget {limit})'
+            if app.testing or app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        if app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(count)
+        return response
@@ -0,0 +1,140 @@
+"""Cached reads of reference data (departments and the doctor directory).
+
+Departments and doctor profiles change rarely but are read on almost every
+page: the department list on the dashboards and the doctor search JSON. A
+write to them, from any code path or worker, bumps the 'reference_data' row
+of stat_counters through SQLite triggers (add_doctor, the importer, the data
+generator and edits made by hand all included). That row is the version of
+the reference data: values computed from it are kept in a small LRU cache
+in each process together with the version they were computed at, and reused
+as long as reading the row (one primary-key lookup) returns the same version.
+
+cached_json() also turns the version into HTTP validators. The response
+carries an ETag (a digest of the body) and Last-Modified (the time of the
+last write), with Cache-Control: private, no-cache so browsers revalidate
+on every use; a request whose If-None-Match still matches gets a 304
+without the query being run or the body being sent.
+
+The version is the counter value together with the time of the last write
+(in milliseconds), so a counter restarted by a database reset cannot
+collide with a version cached before it.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app, request
+from werkzeug.http import generate_etag
+from models import db, Department, StatCounter
+
+REFERENCE_COUNTER = 'reference_data'
+# Cached values (department list, search responses) kept per process
+REFERENCE_CACHE_SIZE = 512
+
+_BUMP_VERSION = f"""
+    INSERT INTO stat_counters (name, value, updated_at)
+    VALUES ('{REFERENCE_COUNTER}', 1, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    ON CONFLICT (name) DO UPDATE SET value = value + 1, updated_at = excluded.updated_at;
+"""
+
+# trigger name -> the writes it fires on; only columns the cached values show
+_REFERENCE_WRITES = {
+    'doctor_insert': 'AFTER INSERT ON doctors',
+    'doctor_update': 'AFTER UPDATE OF user_id, department_id, specialization, experience, consultation_fee, '
+                     'is_active ON doctors',
+    'doctor_delete': 'AFTER DELETE ON doctors',
+    'doctor_username': 'AFTER UPDATE OF username ON users '
+                       'WHEN EXISTS (SELECT 1 FROM doctors WHERE user_id = new.id)',
+    'department_insert': 'AFTER INSERT ON departments',
+    'department_update': 'AFTER UPDATE OF name, description ON departments',
+    'department_delete': 'AFTER DELETE ON departments',
+}
+
+DepartmentRow = namedtuple('DepartmentRow', 'id name description')
+CachedJson = namedtuple('CachedJson', 'body etag')
+
+
+def create_reference_triggers():
+    """Create the triggers that version the reference data (and its counter row)"""
+    with db.engine.begin() as conn:
+        for name, event in _REFERENCE_WRITES.items():
+            conn.exec_driver_sql(f'CREATE TRIGGER IF NOT EXISTS {REFERENCE_COUNTER}_{name} {event} BEGIN'
+                                 f'{_BUMP_VERSION}END')
+        conn.exec_driver_sql(
+            "INSERT OR IGNORE INTO stat_counters (name, value, updated_at) "
+            "VALUES (?, 0, strftime('%Y-%m-%d %H:%M:%f', 'now'))", (REFERENCE_COUNTER,)
+        )
+
+
+class ReferenceCache:
+    """LRU of values computed from reference data, each tagged with its version"""
+
+    def __init__(self, size=REFERENCE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+reference_cache = ReferenceCache()
+
+
+def reference_version():
+    """(writes counted, time of the last write) of the reference data"""
+    row = db.session.query(StatCounter.value, StatCounter.updated_at).filter_by(name=REFERENCE_COUNTER).first()
+    return tuple(row) if row else (0, None)
+
+
+def cached(key, build):
+    """build() once per reference version (per process)"""
+    version = reference_version()
+    value = reference_cache.get(key, version)
+    if value is None:
+        value = build()
+        reference_cache.put(key, version, value)
+    return value
+
+
+def all_departments():
+    """Every department as DepartmentRow tuples, in id order"""
+    return cached('departments', lambda: [
+        DepartmentRow(*row)
+        for row in db.session.query(Department.id, Department.name, Department.description).order_by(Department.id)
+    ])
+
+
+def cached_json(key, build):
+    """A conditional JSON response of build() (a dict), rebuilt only when the reference data changes
+
+    build() may raise; nothing is cached then.
+    """
+    version = reference_version()
+    entry = reference_cache.get(key, version)
+    if entry is None:
+        body = current_app.json.dumps(build())
+        entry = CachedJson(body, generate_etag(body.encode()))
+        reference_cache.put(key, version, entry)
+
+    response = current_app.response_class(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    if version[1] is not None:
+        response.last_modified = version[1]
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,266 @@
+"""Daily rollups for the admin analytics.
+
+Small tables hold one row per day and doctor, per day and department, and
+per day and role of new accounts, plus the doctor rows summed per calendar
+month. An appointment counts on its appointment date: how many were booked
+for that day, how many of those were completed or cancelled, and the
+consultation fees of the completed ones.
+
+Like the dashboard counters in stats.py, the rows are kept current by the
+writes themselves: booking, cancelling and completing call
+appointment_status_changed() and registrations call account_registered(),
+each an upsert in the caller's transaction. rebuild_rollups() recomputes a
+date range from the source tables (live and archived appointments),
+ROLLUP_REBUILD_CHUNK_DAYS days per transaction; `flask rebuild-rollups`
+backfills with it, and a periodic job rebuilds the days that can still
+change, which also picks up bulk writes that bypass the routes.
+
+analytics() answers any date range from the rollups alone: per-department
+daily series, per-doctor totals and rates, weekly registrations and revenue.
+Doctor totals add up whole months from the monthly rows and only the days
+before the first and after the last whole month from the daily ones, so a
+year costs about as much as two months.
+Revenue uses each doctor's fee at the time of completion, or at the last
+rebuild of that day.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert
+from models import (db, User, Doctor, Appointment, ArchivedAppointment, DoctorDailyRollup, DoctorMonthlyRollup,
+                    DepartmentDailyRollup, RegistrationDailyRollup)
+from reference import all_departments
+from jobs import periodic
+
+ROLLUP_REFRESH_INTERVAL = 60 * 60
+# The periodic rebuild covers days from this far back to this far ahead,
+# where appointments can still be booked, completed or cancelled
+ROLLUP_REFRESH_PAST_DAYS = 7
+ROLLUP_REFRESH_FUTURE_DAYS = 60
+ROLLUP_REBUILD_CHUNK_DAYS = 7
+# Range analytics() serves without from/to, and the longest it serves
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 3 * 366
+
+METRICS = ('appointments', 'completed', 'cancelled', 'revenue')
+# Appointment status -> the metric it counts towards
+STATUS_METRICS = {'Completed': 'completed', 'Cancelled': 'cancelled'}
+# Accounts counted as registrations (the admin account is not)
+REGISTRATION_ROLES = ('patient', 'doctor')
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _bump_appointments(day, doctor_id, appointments=0, completed=0, cancelled=0):
+    """Add to the doctor's daily and monthly rollups and the doctor's department's rollup of `day`"""
+    fee = db.func.coalesce(Doctor.consultation_fee, 0.0)
+    for model, period_name, period, key, column in (
+        (DoctorDailyRollup, 'day', day, 'doctor_id', Doctor.id),
+        (DoctorMonthlyRollup, 'month', _month(day), 'doctor_id', Doctor.id),
+        (DepartmentDailyRollup, 'day', day, 'department_id', Doctor.department_id),
+    ):
+        rows = db.select(
+            db.literal(period, db.Date), column, db.literal(appointments), db.literal(completed),
+            db.literal(cancelled), fee * completed
+        ).where(Doctor.id == doctor_id)
+        statement = insert(model).from_select([period_name, key, *METRICS], rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[period_name, key],
+            set_={name: getattr(model, name) + getattr(statement.excluded, name) for name in METRICS}
+        ))
+
+
+def appointment_status_changed(day, doctor_id, old_status, new_status):
+    """Update the rollups of `day` for an appointment going from `old_status` (None when booked) to `new_status`"""
+    if old_status == new_status:
+        return
+    deltas = {'appointments': 1 if old_status is None else 0, 'completed': 0, 'cancelled': 0}
+    for status, sign in ((old_status, -1), (new_status, 1)):
+        if status in STATUS_METRICS:
+            deltas[STATUS_METRICS[status]] += sign
+    _bump_appointments(day, doctor_id, **deltas)
+
+
+def account_registered(created_at, role, count=1):
+    """Count `count` new accounts on their (UTC) registration day"""
+    statement = insert(RegistrationDailyRollup).values(day=created_at.date(), role=role, count=count)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['day', 'role'],
+        set_={'count': RegistrationDailyRollup.count + count}
+    ))
+
+
+def _rebuild_chunk(first, last):
+    """Replace the rollups of first..last (inclusive) with counts from the source tables"""
+    for model in (DoctorDailyRollup, DepartmentDailyRollup, RegistrationDailyRollup):
+        db.session.execute(db.delete(model).where(model.day.between(first, last)))
+
+    appointments = db.union_all(*[
+        db.select(model.appointment_date.label('day'), model.doctor_id, model.status)
+        .where(model.appointment_date.between(first, last))
+        for model in (Appointment, ArchivedAppointment)
+    ]).subquery()
+    is_completed = db.case((appointments.c.status == 'Completed', 1), else_=0)
+    is_cancelled = db.case((appointments.c.status == 'Cancelled', 1), else_=0)
+    db.session.execute(insert(DoctorDailyRollup).from_select(
+        ['day', 'doctor_id', *METRICS],
+        db.select(
+            appointments.c.day, appointments.c.doctor_id, db.func.count(), db.func.sum(is_completed),
+            db.func.sum(is_cancelled), db.func.sum(is_completed * db.func.coalesce(Doctor.consultation_fee, 0.0))
+        ).join(Doctor, Doctor.id == appointments.c.doctor_id)
+        .group_by(appointments.c.day, appointments.c.doctor_id)
+    ))
+    db.session.execute(insert(DepartmentDailyRollup).from_select(
+        ['day', 'department_id', *METRICS],
+        db.select(
+            DoctorDailyRollup.day, Doctor.department_id,
+            *[db.func.sum(getattr(DoctorDailyRollup, name)) for name in METRICS]
+        ).join(Doctor, Doctor.id == DoctorDailyRollup.doctor_id)
+        .where(DoctorDailyRollup.day.between(first, last))
+        .group_by(DoctorDailyRollup.day, Doctor.department_id)
+    ))
+
+    # Months overlapping the chunk, summed again from their (now current) days
+    first_month, end_month = _month(first), _next_month(last)
+    db.session.execute(db.delete(DoctorMonthlyRollup).where(
+        DoctorMonthlyRollup.month >= first_month, DoctorMonthlyRollup.month < end_month
+    ))
+    month = db.func.date(DoctorDailyRollup.day, 'start of month')
+    db.session.execute(insert(DoctorMonthlyRollup).from_select(
+        ['month', 'doctor_id', *METRICS],
+        db.select(month, DoctorDailyRollup.doctor_id,
+                  *[db.func.sum(getattr(DoctorDailyRollup, name)) for name in METRICS])
+        .where(DoctorDailyRollup.day >= first_month, DoctorDailyRollup.day < end_month)
+        .group_by(month, DoctorDailyRollup.doctor_id)
+    ))
+
+    start = datetime.combine(first, datetime.min.time())
+    db.session.execute(insert(RegistrationDailyRollup).from_select(
+        ['day', 'role', 'count'],
+        db.select(db.func.date(User.created_at), User.role, db.func.count())
+        .where(User.created_at >= start, User.created_at < start + timedelta(days=(last - first).days + 1),
+               User.role.in_(REGISTRATION_ROLES))
+        .group_by(db.func.date(User.created_at), User.role)
+    ))
+
+
+def rebuild_rollups(first, last, chunk_days=ROLLUP_REBUILD_CHUNK_DAYS):
+    """Recompute the rollups of first..last (inclusive), one transaction per chunk; returns the days rebuilt"""
+    day = first
+    while day <= last:
+        chunk_last = min(day + timedelta(days=chunk_days - 1), last)
+        _rebuild_chunk(day, chunk_last)
+        db.session.commit()
+        day = chunk_last + timedelta(days=1)
+    return max((last - first).days + 1, 0)
+
+
+def data_range():
+    """(first, last) day with any appointment or registration; None for an empty database"""
+    days = []
+    for model in (Appointment, ArchivedAppointment):
+        days.extend(db.session.query(db.func.min(model.appointment_date), db.func.max(model.appointment_date)).one())
+    first_user, last_user = db.session.query(db.func.min(User.created_at), db.func.max(User.created_at)).one()
+    days.extend(value.date() for value in (first_user, last_user) if value is not None)
+    days = [day for day in days if day is not None]
+    return (min(days), max(days)) if days else None
+
+
+@periodic(ROLLUP_REFRESH_INTERVAL)
+def refresh_rollups_job():
+    today = date.today()
+    rebuild_rollups(today - timedelta(days=ROLLUP_REFRESH_PAST_DAYS),
+                    today + timedelta(days=ROLLUP_REFRESH_FUTURE_DAYS))
+
+
+def parse_analytics_range(args):
+    """(first, last) from the from/to of a mapping, ending today by default; raises ValueError when invalid"""
+    last = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else date.today()
+    if args.get('from'):
+        first = datetime.strptime(args['from'], '%Y-%m-%d').date()
+    else:
+        first = last - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if last < first:
+        raise ValueError("'to' must not be before 'from'")
+    if (last - first).days >= ANALYTICS_MAX_DAYS:
+        raise ValueError(f'The range can be at most {ANALYTICS_MAX_DAYS} days')
+    return first, last
+
+
+def _doctor_totals(first, last):
+    """Subquery of (doctor_id, *METRICS) summed over first..last"""
+    def rows(model, period, start, end):
+        return db.select(model.doctor_id, *[getattr(model, name) for name in METRICS]).where(
+            period >= start, period < end
+        )
+
+    after_last = last + timedelta(days=1)
+    months_start = first if first.day == 1 else _next_month(first)
+    months_end = _month(after_last)
+    if months_start < months_end:
+        parts = [rows(DoctorDailyRollup, DoctorDailyRollup.day, first, months_start),
+                 rows(DoctorMonthlyRollup, DoctorMonthlyRollup.month, months_start, months_end),
+                 rows(DoctorDailyRollup, DoctorDailyRollup.day, months_end, after_last)]
+    else:
+        parts = [rows(DoctorDailyRollup, DoctorDailyRollup.day, first, after_last)]
+    periods = db.union_all(*parts).subquery()
+    return db.select(
+        periods.c.doctor_id, *[db.func.sum(periods.c[name]).label(name) for name in METRICS]
+    ).group_by(periods.c.doctor_id).subquery('doctor_totals')
+
+
+def _rate(part, total):
+    return round(part / total, 4) if total else None
+
+
+def analytics(first, last):
+    """Appointment and registration trends for first..last (inclusive) from the rollups"""
+    names = {department.id: department.name for department in all_departments()}
+    departments = {}
+    for row in db.session.query(
+        DepartmentDailyRollup.department_id, DepartmentDailyRollup.day,
+        *[getattr(DepartmentDailyRollup, name) for name in METRICS]
+    ).filter(
+        DepartmentDailyRollup.day.between(first, last)
+    ).order_by(DepartmentDailyRollup.department_id, DepartmentDailyRollup.day):
+        if row.department_id not in departments:
+            departments[row.department_id] = {'department_id': row.department_id,
+                                              'department': names.get(row.department_id), 'days': []}
+        departments[row.department_id]['days'].append({
+            'date': row.day.isoformat(),
+            **{name: getattr(row, name) for name in METRICS}
+        })
+
+    totals = _doctor_totals(first, last)
+    doctors = []
+    for row in db.session.query(
+        totals.c.doctor_id, User.username, Doctor.department_id, *[totals.c[name] for name in METRICS]
+    ).join(Doctor, Doctor.id == totals.c.doctor_id).join(User, User.id == Doctor.user_id).order_by(totals.c.doctor_id):
+        doctors.append({
+            'doctor_id': row.doctor_id,
+            'doctor': row.username,
+            'department_id': row.department_id,
+            **{name: getattr(row, name) for name in METRICS},
+            'completion_rate': _rate(row.completed, row.appointments),
+            'cancellation_rate': _rate(row.cancelled, row.appointments),
+        })
+
+    # Weeks start on Monday; the first and last week only count days inside the range
+    weeks = {}
+    for row in RegistrationDailyRollup.query.filter(RegistrationDailyRollup.day.between(first, last)):
+        week = weeks.setdefault(row.day - timedelta(days=row.day.weekday()), {})
+        week[row.role] = week.get(row.role, 0) + row.count
+    registrations = [{'week_start': week.isoformat(), **counts} for week, counts in sorted(weeks.items())]
+
+    return {
+        'from': first.isoformat(),
+        'to': last.isoformat(),
+        'departments': list(departments.values()),
+        'doctors': doctors,
+        'registrations': registrations,
+        'revenue': sum(doctor['revenue'] for doctor in doctors),
+    }
@@ -0,0 +1,232 @@
+"""Recurring doctor schedules, expanded into doctor_availability in bulk.
+
+A ScheduleTemplate is one doctor's weekly hours ("Mon-Fri 09:00-13:00 in
+15 minute slots"); ScheduleException rows are days off, for one doctor or
+for everyone (holidays). expand_schedules() materializes a rolling horizon
+of availability for every active template at once:
+
+- the calendar is computed once per run (horizon days grouped by weekday)
+  and each distinct (start, end, slot length) grid once, so a doctor's
+  candidate rows are just the product of the two
+- each template remembers the last day it was expanded through
+  (expanded_until), so the nightly run only computes the day that entered
+  the horizon, not the whole horizon again
+- doctors are processed in batches; each batch reads the availability keys
+  it already has in the days being expanded with one query and inserts only
+  the missing rows, with one executemany INSERT ... ON CONFLICT DO NOTHING,
+  so rows added meanwhile by hand or by another run are skipped by
+  unique_doctor_slot instead of failing the batch
+- rows are tuples of dates and times already in SQLite's storage format
+  (formatted once per day and per slot), handed to the driver directly;
+  per-row parameter processing was most of the time of a full expansion
+
+Existing rows are never changed or removed; a holiday added after its day
+was expanded has to be cleared from doctor_availability separately, and
+changing a template's hours only affects days not expanded yet. The periodic
+job (`flask run-jobs`) extends the horizon once a day.
+"""
+import time as timer
+from datetime import date, datetime, timedelta
+from models import db, Doctor, DoctorAvailability, ScheduleTemplate, ScheduleException
+from jobs import periodic
+from slots import slot_index, APPOINTMENT_MINUTES
+
+# Days ahead, from today, that expand_schedules() keeps materialized
+SCHEDULE_HORIZON_DAYS = 60
+SCHEDULE_EXPAND_INTERVAL = 24 * 60 * 60
+# Doctors whose rows are diffed and inserted together, one transaction each
+SCHEDULE_DOCTOR_BATCH = 200
+WEEKDAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# Rows are plain tuples; rows that exist by now are skipped by unique_doctor_slot
+_INSERT_AVAILABILITY = (
+    'INSERT INTO doctor_availability (doctor_id, date, start_time, end_time, is_available) '
+    'VALUES (?, ?, ?, ?, 1) ON CONFLICT (doctor_id, date, start_time) DO NOTHING'
+)
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+def parse_weekdays(spec):
+    """'mon-fri', 'mon,wed,fri' or 'sat-sun' -> ISO weekday digits ('12345')"""
+    days = set()
+    for part in spec.lower().replace(' ', '').split(','):
+        first, _, last = part.partition('-')
+        if first not in WEEKDAY_NAMES or (last and last not in WEEKDAY_NAMES):
+            raise ScheduleError(f'Invalid weekdays {spec!r}; use names like mon-fri or mon,wed,fri')
+        start = WEEKDAY_NAMES.index(first)
+        end = WEEKDAY_NAMES.index(last) if last else start
+        if end < start:
+            raise ScheduleError(f'Invalid weekday range {part!r}')
+        days.update(range(start + 1, end + 2))
+    return ''.join(str(day) for day in sorted(days))
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def _time(minutes):
+    return datetime.min.replace(hour=minutes // 60, minute=minutes % 60).time()
+
+
+def slot_grid(start_time, end_time, slot_minutes):
+    """[(start, end)] availability rows for one day of a template"""
+    if not slot_minutes:
+        return [(start_time, end_time)]
+    start, end = _minutes(start_time), _minutes(end_time)
+    return [(_time(t), _time(t + slot_minutes)) for t in range(start, end - slot_minutes + 1, slot_minutes)]
+
+
+def add_template(doctor_id, weekdays, start_time, end_time, slot_minutes=APPOINTMENT_MINUTES, valid_from=None,
+                 valid_until=None):
+    """Create a template in the current session; raises ScheduleError when invalid"""
+    valid_from = valid_from or date.today()
+    if not db.session.get(Doctor, doctor_id):
+        raise ScheduleError(f'No doctor with id {doctor_id}')
+    if end_time <= start_time:
+        raise ScheduleError('end time must be after start time')
+    if slot_minutes is not None and not 5 <= slot_minutes <= _minutes(end_time) - _minutes(start_time):
+        raise ScheduleError('slot length must be at least 5 minutes and fit in the window')
+    if valid_until and valid_until < valid_from:
+        raise ScheduleError('valid until must not be before valid from')
+
+    # Overlapping windows would expand into overlapping availability
+    for other in ScheduleTemplate.query.filter_by(doctor_id=doctor_id, is_active=True):
+        if not set(other.weekdays) & set(weekdays):
+            continue
+        if (other.valid_until or date.max) < valid_from or (valid_until or date.max) < other.valid_from:
+            continue
+        if other.start_time < end_time and start_time < other.end_time:
+            raise ScheduleError(f'Overlaps schedule {other.id} ({other.start_time:%H:%M}-{other.end_time:%H:%M})')
+
+    template = ScheduleTemplate(doctor_id=doctor_id, weekdays=weekdays, start_time=start_time, end_time=end_time,
+                                slot_minutes=slot_minutes, valid_from=valid_from, valid_until=valid_until)
+    db.session.add(template)
+    return template
+
+
+def add_exception(day, doctor_id=None, reason=None):
+    """Mark a day off for one doctor, or for every doctor when doctor_id is None"""
+    exception = ScheduleException(date=day, doctor_id=doctor_id, reason=reason)
+    db.session.add(exception)
+    return exception
+
+
+def expand_schedules(horizon_days=SCHEDULE_HORIZON_DAYS, start_day=None, doctor_ids=None,
+                     batch_size=SCHEDULE_DOCTOR_BATCH):
+    """Insert the availability rows active templates call for in the horizon.
+
+    Returns a summary with the number of doctors, candidate rows and rows
+    inserted.
+    """
+    began = timer.perf_counter()
+    first = start_day or date.today()
+    last = first + timedelta(days=horizon_days - 1)
+    days = [first + timedelta(days=n) for n in range(horizon_days)]
+    days_by_weekday = {str(weekday): [day for day in days if day.isoweekday() == weekday] for weekday in range(1, 8)}
+
+    query = db.session.query(
+        ScheduleTemplate.id,
+        ScheduleTemplate.doctor_id,
+        ScheduleTemplate.weekdays,
+        ScheduleTemplate.start_time,
+        ScheduleTemplate.end_time,
+        ScheduleTemplate.slot_minutes,
+        ScheduleTemplate.valid_from,
+        ScheduleTemplate.valid_until,
+        ScheduleTemplate.expanded_until
+    ).join(Doctor, ScheduleTemplate.doctor_id == Doctor.id).filter(
+        ScheduleTemplate.is_active == True,
+        Doctor.is_active == True,
+        ScheduleTemplate.valid_from <= last,
+        db.or_(ScheduleTemplate.valid_until == None, ScheduleTemplate.valid_until >= first)
+    )
+    if doctor_ids is not None:
+        query = query.filter(ScheduleTemplate.doctor_id.in_(doctor_ids))
+    templates = {}
+    for row in query:
+        templates.setdefault(row.doctor_id, []).append(row)
+
+    holidays = set()
+    days_off = {}
+    for doctor_id, day in db.session.query(ScheduleException.doctor_id, ScheduleException.date).filter(
+        ScheduleException.date.between(first, last)
+    ):
+        if doctor_id is None:
+            holidays.add(day)
+        else:
+            days_off.setdefault(doctor_id, set()).add(day)
+
+    # Dates and times are formatted once, the way SQLAlchemy stores them, instead of per row
+    dialect = db.engine.dialect
+    columns = DoctorAvailability.__table__.c
+    stored_date = columns.date.type.dialect_impl(dialect).bind_processor(dialect)
+    stored_time = columns.start_time.type.dialect_impl(dialect).bind_processor(dialect)
+    stored_days = {day: stored_date(day) for day in days}
+    grids = {}
+    summary = {'doctors': len(templates), 'candidates': 0, 'inserted': 0, 'seconds': 0.0}
+    changed = []
+    doctors = sorted(templates)
+    for start in range(0, len(doctors), batch_size):
+        batch = doctors[start:start + batch_size]
+        # Each template resumes after the last day an earlier run expanded
+        resume = {}
+        for doctor_id in batch:
+            for template in templates[doctor_id]:
+                after = template.expanded_until + timedelta(days=1) if template.expanded_until else first
+                resume[template.id] = max(first, template.valid_from, after)
+        batch_first = min(resume.values())
+        existing = set(map(tuple, db.session.query(
+            DoctorAvailability.doctor_id,
+            db.type_coerce(DoctorAvailability.date, db.String),
+            db.type_coerce(DoctorAvailability.start_time, db.String)
+        ).filter(
+            DoctorAvailability.doctor_id.in_(batch),
+            DoctorAvailability.date.between(batch_first, last)
+        )))
+
+        rows = []
+        for doctor_id in batch:
+            skip = holidays | days_off.get(doctor_id, set())
+            before = len(rows)
+            for template in templates[doctor_id]:
+                key = (template.start_time, template.end_time, template.slot_minutes)
+                grid = grids.get(key)
+                if grid is None:
+                    grid = grids[key] = [(stored_time(start), stored_time(end)) for start, end in slot_grid(*key)]
+                since, until = resume[template.id], template.valid_until or last
+                for weekday in template.weekdays:
+                    for day in days_by_weekday.get(weekday, ()):
+                        if day in skip or not since <= day <= until:
+                            continue
+                        summary['candidates'] += len(grid)
+                        stored_day = stored_days[day]
+                        for slot_start, slot_end in grid:
+                            if (doctor_id, stored_day, slot_start) in existing:
+                                continue
+                            existing.add((doctor_id, stored_day, slot_start))
+                            rows.append((doctor_id, stored_day, slot_start, slot_end))
+            if len(rows) > before:
+                changed.append(doctor_id)
+
+        if rows:
+            result = db.session.connection().exec_driver_sql(_INSERT_AVAILABILITY, rows)
+            summary['inserted'] += result.rowcount
+        ScheduleTemplate.query.filter(
+            ScheduleTemplate.id.in_(resume),
+            db.or_(ScheduleTemplate.expanded_until == None, ScheduleTemplate.expanded_until < last)
+        ).update({'expanded_until': last}, synchronize_session=False)
+        db.session.commit()
+
+    # Cached free slots of this process; other workers pick the rows up within SLOT_INDEX_TTL
+    slot_index.invalidate(changed)
+    summary['seconds'] = timer.perf_counter() - began
+    return summary
+
+
+@periodic(SCHEDULE_EXPAND_INTERVAL)
+def expand_schedules_job():
+    summary = expand_schedules()
+    return summary if summary['inserted'] else None
@@ -0,0 +1,178 @@
+"""In-place schema upgrades and query-plan checks for the SQLite database.
+
+db.create_all() only creates missing tables, so databases created before an
+index was added to models.py never get it. upgrade_schema() adds whatever
+tables and indexes are missing without touching existing data, and
+explain_hot_queries() runs EXPLAIN QUERY PLAN over the queries the routes
+depend on to confirm none of them falls back to a full table scan.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+from search import create_search_indexes, treatment_history, treatment_search
+from queries import (history_sources, doctor_list, doctor_search, todays_appointments, upcoming_appointments,
+                     patient_upcoming_appointments, recent_appointments, SEARCH_PAGE_SIZE, DOCTOR_PAGE_SIZE,
+                     HISTORY_PAGE_SIZE, TREATMENT_SEARCH_PAGE_SIZE)
+from pagination import keyset_query, encode_cursor
+from profiles import user_query
+from stats import daily_count_queries
+from events import new_events_query, channel_events_query
+from reference import create_reference_triggers
+from archive import ARCHIVE_TABLES
+
+
+class SchemaUpgradeError(Exception):
+    pass
+
+
+def _rebuild_with_autoincrement(conn, table):
+    """Recreate `table` as an AUTOINCREMENT table, keeping its rows and ids"""
+    rebuilt = f'{table.name}__rebuild'
+    create = str(CreateTable(table).compile(dialect=db.engine.dialect)).strip()
+    conn.exec_driver_sql(create.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1))
+    columns = ', '.join(column.name for column in table.columns)
+    conn.exec_driver_sql(f'INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {table.name}')
+    # Indexes and triggers go with the old table; the rest of upgrade_schema() recreates them
+    conn.exec_driver_sql(f'DROP TABLE {table.name}')
+    conn.exec_driver_sql(f'ALTER TABLE {rebuilt} RENAME TO {table.name}')
+
+
+def _start_ids_above_archive(conn, table):
+    """Make the next id of `table` larger than any id already moved to its archive"""
+    archive = ARCHIVE_TABLES.get(table.name)
+    if archive is None:
+        return
+    archived = conn.exec_driver_sql(f'SELECT max(id) FROM {archive.name}').scalar() or 0
+    current = conn.exec_driver_sql('SELECT seq FROM sqlite_sequence WHERE name = ?', (table.name,)).scalar()
+    if current is None:
+        conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table.name, archived))
+    elif current < archived:
+        conn.exec_driver_sql('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (archived, table.name))
+
+
+def upgrade_autoincrement():
+    """Rebuild tables that models.py declares AUTOINCREMENT but were created without it; returns their names"""
+    rebuilt = []
+    with db.engine.connect() as conn:
+        # Rename without rewriting the views that name the table (treatment_search_content)
+        conn.exec_driver_sql('PRAGMA legacy_alter_table = ON')
+        conn.commit()
+        try:
+            with conn.begin():
+                # pysqlite opens no transaction for DDL: without this a failed
+                # rebuild could leave a table dropped
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+                for table in db.metadata.sorted_tables:
+                    if not table.kwargs.get('sqlite_autoincrement'):
+                        continue
+                    sql = conn.exec_driver_sql(
+                        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+                    ).scalar()
+                    if 'AUTOINCREMENT' not in sql.upper():
+                        _rebuild_with_autoincrement(conn, table)
+                        rebuilt.append(table.name)
+                    _start_ids_above_archive(conn, table)
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql('PRAGMA legacy_alter_table = OFF')
+            conn.commit()
+    return rebuilt
+
+
+def upgrade_schema():
+    """Create missing tables, indexes, search indexes and triggers; returns the names of those added"""
+    db.create_all()
+
+    added = [f'{name} (rebuilt with AUTOINCREMENT)' for name in upgrade_autoincrement()]
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind=db.engine)
+                except IntegrityError as e:
+                    # A unique index over rows that already hold duplicates
+                    raise SchemaUpgradeError(
+                        f'Cannot create {index.name}: existing rows violate it ({e.orig})'
+                    ) from e
+                added.append(index.name)
+    added.extend(create_search_indexes())
+    create_reference_triggers()
+    return added
+
+
+def hot_queries():
+    """The SELECTs behind each route, built by the helpers the routes call, with representative parameters"""
+    today = date.today()
+    # A cursor deep into each keyset list, so the explained plans include the seek
+    history_cursor = encode_cursor([today, time(9, 0), 100])
+    history, archived = history_sources(1, include_archived=True)
+    doctors, doctor_columns = doctor_list()
+    by_date, by_date_columns = doctor_search('', today)
+    by_text, by_text_columns = doctor_search('card')
+    treatments = treatment_history('paracetamol', doctor_id=1)
+    counts = daily_count_queries(today, today)
+
+    return [
+        ('load_user', user_query(1).statement),
+        ('login', User.query.filter_by(username='admin').statement),
+        ('forgot_password', User.query.filter_by(email='admin@hospital.com').statement),
+        ('doctor_dashboard today', todays_appointments(1, today).statement),
+        ('doctor_dashboard upcoming', upcoming_appointments(1, today, today + timedelta(days=7)).statement),
+        ('patient_dashboard upcoming', patient_upcoming_appointments(1).statement),
+        ('patient_dashboard history page',
+         keyset_query(*history, history_cursor, HISTORY_PAGE_SIZE, descending=True).statement),
+        ('patient_dashboard archived history page',
+         keyset_query(*archived, history_cursor, HISTORY_PAGE_SIZE, descending=True).statement),
+        ('admin_doctors page',
+         keyset_query(doctors, doctor_columns, encode_cursor([20]), DOCTOR_PAGE_SIZE).statement),
+        ('admin_dashboard recent', recent_appointments().statement),
+        *[(f"reconcile-stats {name.split(':')[0]}", query.statement) for name, query in counts.items()],
+        ('search_doctors availability',
+         keyset_query(by_date, by_date_columns, limit=SEARCH_PAGE_SIZE).statement),
+        ('search_doctors full text',
+         keyset_query(by_text, by_text_columns, limit=SEARCH_PAGE_SIZE).statement),
+        ('treatment search (doctor scope)',
+         keyset_query(treatments, [treatment_search.c.rowid], limit=TREATMENT_SEARCH_PAGE_SIZE,
+                      descending=True).statement),
+        ('event bus poll', new_events_query(0)),
+        ('event stream replay', channel_events_query('doctor:1', 0)),
+    ]
+
+
+def _bind_value(value):
+    # EXPLAIN only needs values of the right shape, not SQLAlchemy's type processing
+    if isinstance(value, (date, time, datetime)):
+        return value.isoformat()
+    return value
+
+
+def explain(statement):
+    """EXPLAIN QUERY PLAN rows (the detail column) for a SQLAlchemy statement"""
+    compiled = statement.compile(dialect=db.engine.dialect,
+                                 compile_kwargs={'render_postcompile': True})
+    params = tuple(_bind_value(compiled.params[name]) for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + compiled.string, params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def is_table_scan(detail):
+    """True for plan steps that read a whole table instead of using an index"""
+    # FTS5 MATCH lookups show up as "SCAN <table> VIRTUAL TABLE INDEX n:M..."
+    return detail.startswith('SCAN ') and 'USING' not in detail and 'VIRTUAL TABLE INDEX' not in detail
+
+
+def explain_hot_queries():
+    """[(name, plan, uses_index)] for every query returned by hot_queries()"""
+    report = []
+    for name, statement in hot_queries():
+        plan = explain(statement)
+        # Scanning a subquery's own (already limited) result is not a table scan
+        materialized = {step.split()[1] for step in plan if step.startswith('MATERIALIZE ')}
+        scans = [step for step in plan if is_table_scan(step) and step.split()[1] not in materialized]
+        report.append((name, plan, not scans))
+    return report
@@ -0,0 +1,301 @@
+"""Full-text search with SQLite FTS5 over the doctor directory and treatment history.
+
+Both indexes are kept in step by triggers; create_search_indexes() replaces changed definitions on upgrade-db.
+"""
+import re
+from markupsafe import escape
+from sqlalchemy.orm import aliased
+from models import db, User, Doctor, Patient, Appointment, Treatment, ArchivedAppointment, ArchivedTreatment
+
+DOCTOR_SEARCH_TABLE = 'doctor_search'
+TREATMENT_SEARCH_TABLE = 'treatment_search'
+TREATMENT_SEARCH_CONTENT = 'treatment_search_content'
+# Words of a query beyond this are ignored
+SEARCH_MAX_TERMS = 8
+# bm25 weights for name, specialization, department, description
+SEARCH_WEIGHTS = (4.0, 3.0, 2.0, 1.0)
+# Words of context around the matched terms in a treatment snippet
+SNIPPET_WORDS = 16
+# Snippet highlight markers, swapped for <mark> after the text is HTML-escaped
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+doctor_search = db.table(DOCTOR_SEARCH_TABLE, db.column('rowid', db.Integer))
+treatment_search = db.table(
+    TREATMENT_SEARCH_TABLE,
+    db.column('rowid', db.Integer),
+    db.column('diagnosis', db.Text),
+    db.column('prescription', db.Text),
+    db.column('treatment_date', db.DateTime),
+    db.column('appointment_id', db.Integer),
+    db.column('appointment_date', db.Date),
+    db.column('patient_id', db.Integer),
+    db.column('doctor_id', db.Integer),
+)
+
+_CREATE_DOCTOR_SEARCH = f"""
+CREATE VIRTUAL TABLE {DOCTOR_SEARCH_TABLE} USING fts5(
+    name, specialization, department, description,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+)
+"""
+
+_DOCTOR_ROWS = """
+SELECT doctors.id, users.username, doctors.specialization, departments.name, departments.description
+FROM doctors
+JOIN users ON users.id = doctors.user_id
+LEFT JOIN departments ON departments.id = doctors.department_id
+"""
+
+_DOCTOR_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {DOCTOR_SEARCH_TABLE}_doctor_insert AFTER INSERT ON doctors BEGIN
+        INSERT INTO {DOCTOR_SEARCH_TABLE} (rowid, name, specialization, department, description)
+        SELECT new.id, users.username, new.specialization, departments.name, departments.description
+        FROM users LEFT JOIN departments ON departments.id = new.department_id
+        WHERE users.id = new.user_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {DOCTOR_SEARCH_TABLE}_doctor_update
+    AFTER UPDATE OF user_id, department_id, specialization ON doctors BEGIN
+        DELETE FROM {DOCTOR_SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {DOCTOR_SEARCH_TABLE} (rowid, name, specialization, department, description)
+        SELECT new.id, users.username, new.specialization, departments.name, departments.description
+        FROM users LEFT JOIN departments ON departments.id = new.department_id
+        WHERE users.id = new.user_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {DOCTOR_SEARCH_TABLE}_doctor_delete AFTER DELETE ON doctors BEGIN
+        DELETE FROM {DOCTOR_SEARCH_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {DOCTOR_SEARCH_TABLE}_user_update AFTER UPDATE OF username ON users BEGIN
+        UPDATE {DOCTOR_SEARCH_TABLE} SET name = new.username
+        WHERE rowid IN (SELECT id FROM doctors WHERE user_id = new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {DOCTOR_SEARCH_TABLE}_department_update
+    AFTER UPDATE OF name, description ON departments BEGIN
+        UPDATE {DOCTOR_SEARCH_TABLE} SET department = new.name, description = new.description
+        WHERE rowid IN (SELECT id FROM doctors WHERE department_id = new.id);
+    END
+    """,
+]
+
+
+_CREATE_TREATMENT_CONTENT = f"""
+CREATE VIEW IF NOT EXISTS {TREATMENT_SEARCH_CONTENT} AS
+SELECT treatments.id, treatments.diagnosis, treatments.prescription, treatments.notes,
+       treatments.treatment_date, appointments.id AS appointment_id, appointments.appointment_date,
+       appointments.patient_id, appointments.doctor_id
+FROM treatments JOIN appointments ON appointments.id = treatments.appointment_id
+UNION ALL
+SELECT archived_treatments.id, archived_treatments.diagnosis, archived_treatments.prescription,
+       archived_treatments.notes, archived_treatments.treatment_date, archived_appointments.id,
+       archived_appointments.appointment_date, archived_appointments.patient_id, archived_appointments.doctor_id
+FROM archived_treatments JOIN archived_appointments ON archived_appointments.id = archived_treatments.appointment_id
+"""
+
+_CREATE_TREATMENT_SEARCH = f"""
+CREATE VIRTUAL TABLE {TREATMENT_SEARCH_TABLE} USING fts5(
+    diagnosis, prescription, notes,
+    treatment_date UNINDEXED, appointment_id UNINDEXED, appointment_date UNINDEXED,
+    patient_id UNINDEXED, doctor_id UNINDEXED,
+    content = '{TREATMENT_SEARCH_CONTENT}', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2'
+)
+"""
+
+_TREATMENT_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TREATMENT_SEARCH_TABLE}_insert AFTER INSERT ON treatments BEGIN
+        INSERT INTO {TREATMENT_SEARCH_TABLE} (rowid, diagnosis, prescription, notes)
+        VALUES (new.id, new.diagnosis, new.prescription, new.notes);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TREATMENT_SEARCH_TABLE}_update
+    AFTER UPDATE OF diagnosis, prescription, notes ON treatments BEGIN
+        INSERT INTO {TREATMENT_SEARCH_TABLE} ({TREATMENT_SEARCH_TABLE}, rowid, diagnosis, prescription, notes)
+        VALUES ('delete', old.id, old.diagnosis, old.prescription, old.notes);
+        INSERT INTO {TREATMENT_SEARCH_TABLE} (rowid, diagnosis, prescription, notes)
+        VALUES (new.id, new.diagnosis, new.prescription, new.notes);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TREATMENT_SEARCH_TABLE}_delete AFTER DELETE ON treatments
+    WHEN NOT EXISTS (SELECT 1 FROM archived_treatments WHERE id = old.id) BEGIN
+        INSERT INTO {TREATMENT_SEARCH_TABLE} ({TREATMENT_SEARCH_TABLE}, rowid, diagnosis, prescription, notes)
+        VALUES ('delete', old.id, old.diagnosis, old.prescription, old.notes);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TREATMENT_SEARCH_TABLE}_archive_delete AFTER DELETE ON archived_treatments BEGIN
+        INSERT INTO {TREATMENT_SEARCH_TABLE} ({TREATMENT_SEARCH_TABLE}, rowid, diagnosis, prescription, notes)
+        VALUES ('delete', old.id, old.diagnosis, old.prescription, old.notes);
+    END
+    """,
+]
+
+# name -> (CREATE statements for the index, statements that fill it from the source tables, triggers)
+SEARCH_INDEXES = {
+    DOCTOR_SEARCH_TABLE: (
+        [_CREATE_DOCTOR_SEARCH],
+        [f'DELETE FROM {DOCTOR_SEARCH_TABLE}',
+         f'INSERT INTO {DOCTOR_SEARCH_TABLE} (rowid, name, specialization, department, description)'
+         + _DOCTOR_ROWS],
+        _DOCTOR_SEARCH_TRIGGERS,
+    ),
+    TREATMENT_SEARCH_TABLE: (
+        [_CREATE_TREATMENT_CONTENT, _CREATE_TREATMENT_SEARCH],
+        [f"INSERT INTO {TREATMENT_SEARCH_TABLE} ({TREATMENT_SEARCH_TABLE}) VALUES ('rebuild')"],
+        _TREATMENT_SEARCH_TRIGGERS,
+    ),
+}
+
+
+_DEFINITION = re.compile(r'CREATE (VIRTUAL TABLE|VIEW|TRIGGER) (?:IF NOT EXISTS )?(\w+)')
+
+
+def _normalized(sql):
+    # sqlite_master keeps the statement as written, minus IF NOT EXISTS
+    return ' '.join(sql.replace('IF NOT EXISTS ', '').split())
+
+
+def _create_or_replace(conn, statement):
+    """Run a CREATE statement unless sqlite_master already holds the same definition; True if it ran
+
+    An object of the same name with a different definition is dropped first.
+    """
+    kind, name = _DEFINITION.search(statement).groups()
+    current = conn.exec_driver_sql('SELECT sql FROM sqlite_master WHERE name = ?', (name,)).scalar()
+    if current is not None and _normalized(current) == _normalized(statement):
+        return False
+    if current is not None:
+        conn.exec_driver_sql(f"DROP {'TABLE' if kind == 'VIRTUAL TABLE' else kind} {name}")
+    conn.exec_driver_sql(statement)
+    return True
+
+
+def create_search_indexes():
+    """Create missing or changed FTS tables (filled from the source tables) and their triggers.
+
+    Returns the names of the indexes (re)built.
+    """
+    created = []
+    with db.engine.begin() as conn:
+        for name, (creates, fill, triggers) in SEARCH_INDEXES.items():
+            changed = [_create_or_replace(conn, create) for create in creates]
+            if any(changed):
+                for statement in fill:
+                    conn.exec_driver_sql(statement)
+                created.append(name)
+            for trigger in triggers:
+                _create_or_replace(conn, trigger)
+    return created
+
+
+def rebuild_search_indexes():
+    """Refill every index from the source tables and merge its segments; returns {name: rows indexed}"""
+    counts = {}
+    with db.engine.begin() as conn:
+        for name, (_, fill, _) in SEARCH_INDEXES.items():
+            for statement in fill:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"INSERT INTO {name} ({name}) VALUES ('optimize')")
+            counts[name] = conn.exec_driver_sql(f'SELECT count(*) FROM {name}').scalar()
+    return counts
+
+
+def match_expression(text, prefix=True):
+    """FTS5 query for free text: every word quoted, as a prefix unless `prefix` is False; None without words"""
+    terms = re.findall(r'[^\W_]+', text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    star = '*' if prefix else ''
+    return ' '.join(f'"{term}"{star}' for term in terms)
+
+
+def ranked_doctors(text):
+    """Subquery of (doctor_id, rank) for the doctors matching `text`; None for empty text
+
+    Lower rank is a better match.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return None
+    rank = db.func.bm25(db.literal_column(DOCTOR_SEARCH_TABLE), *SEARCH_WEIGHTS, type_=db.Float)
+    return db.select(
+        doctor_search.c.rowid.label('doctor_id'),
+        rank.label('rank')
+    ).where(
+        db.literal_column(DOCTOR_SEARCH_TABLE).op('MATCH')(expression)
+    ).subquery('ranked')
+
+
+PatientUser = aliased(User, name='patient_user')
+DoctorUser = aliased(User, name='doctor_user')
+
+
+def highlight(snippet):
+    """HTML for a snippet: the text escaped, the matched terms in <mark>"""
+    return str(escape(snippet)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def treatment_history(text, doctor_id=None, patient_id=None, start=None, end=None):
+    """Query for treatments matching `text`, for keyset_page over treatment_search.c.rowid descending.
+
+    Archived treatments are included. With `doctor_id` only treatments of
+    patients that doctor has had an appointment with are included.
+    `start`/`end` bound the treatment date. Returns None for empty text.
+    """
+    expression = match_expression(text, prefix=False)
+    if expression is None:
+        return None
+    fts = db.literal_column(TREATMENT_SEARCH_TABLE)
+    match = treatment_search.c
+    query = db.session.query(
+        match.rowid,
+        match.treatment_date,
+        match.diagnosis,
+        match.prescription,
+        db.func.snippet(fts, -1, _MARK_START, _MARK_END, '…', SNIPPET_WORDS).label('snippet'),
+        match.appointment_id,
+        match.appointment_date,
+        match.patient_id,
+        PatientUser.username.label('patient'),
+        DoctorUser.username.label('doctor')
+    ).select_from(treatment_search).join(
+        Patient, match.patient_id == Patient.id
+    ).join(
+        PatientUser, Patient.user_id == PatientUser.id
+    ).join(
+        Doctor, match.doctor_id == Doctor.id
+    ).join(
+        DoctorUser, Doctor.user_id == DoctorUser.id
+    ).filter(fts.op('MATCH')(expression))
+
+    if doctor_id is not None:
+        # The doctor's own patients, evaluated once as a set by SQLite
+        query = query.filter(match.patient_id.in_(
+            db.select(Appointment.patient_id).where(Appointment.doctor_id == doctor_id).union(
+                db.select(ArchivedAppointment.patient_id).where(ArchivedAppointment.doctor_id == doctor_id))
+        ))
+    if patient_id is not None:
+        # As a rowid set the index is probed per treatment instead of scanning every match
+        query = query.filter(match.rowid.in_(
+            db.select(Treatment.id).join(Appointment, Treatment.appointment_id == Appointment.id)
+            .where(Appointment.patient_id == patient_id).union_all(
+                db.select(ArchivedTreatment.id)
+                .join(ArchivedAppointment, ArchivedTreatment.appointment_id == ArchivedAppointment.id)
+                .where(ArchivedAppointment.patient_id == patient_id))
+        ))
+    if start is not None:
+        query = query.filter(match.treatment_date >= start)
+    if end is not None:
+        query = query.filter(match.treatment_date < end)
+    return query
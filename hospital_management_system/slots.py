@@ -0,0 +1,243 @@
+"""In-memory free-slot index.
+
+For each doctor we keep the availability windows and the start times of the
+appointments that occupy a slot, per date, as sorted lists. Free slots are
+the windows minus the bookings, found with bisect instead of re-reading the
+appointments table. book/cancel/complete update the index in place; a
+doctor's entry is (re)loaded from the database on first use and after
+SLOT_INDEX_TTL seconds, which bounds how stale it can get from writes made by
+other worker processes. The booking itself is still guarded by the database
+(see booking.py), so a stale entry can only offer a slot that is then
+rejected as taken.
+"""
+import threading
+import time as timer
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from models import db, Appointment, DoctorAvailability
+
+# How long a booked appointment blocks the doctor's calendar
+APPOINTMENT_MINUTES = 15
+# Seconds before a doctor's entry is reloaded to pick up other workers' writes
+SLOT_INDEX_TTL = 60
+# Appointment statuses that occupy a slot
+OCCUPYING_STATUSES = ('Booked', 'Completed')
+# Widest date range a single free-slot query may cover
+MAX_RANGE_DAYS = 62
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def _merged(windows):
+    """Sorted windows with touching or overlapping ones joined"""
+    # Schedules expanded into 15 minute rows (see schedules.py) are one window
+    # for longer appointment durations
+    merged = []
+    for start, end in windows:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+_CLOCK = [f'{m // 60:02d}:{m % 60:02d}' for m in range(24 * 60)]
+
+
+def parse_slot_query(args):
+    """Read from/to/duration query parameters; raises ValueError when invalid"""
+    today = date.today()
+    start_day = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else today
+    end_day = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else start_day + timedelta(days=6)
+    duration = int(args.get('duration', APPOINTMENT_MINUTES))
+
+    if end_day < start_day:
+        raise ValueError("'to' must not be before 'from'")
+    if (end_day - start_day).days >= MAX_RANGE_DAYS:
+        raise ValueError(f'Date range is limited to {MAX_RANGE_DAYS} days')
+    if not 5 <= duration <= 240:
+        raise ValueError('duration must be between 5 and 240 minutes')
+    return max(start_day, today), end_day, duration
+
+
+class DoctorSchedule:
+    """Availability windows and occupied start times for one doctor.
+
+    Not thread-safe: once a schedule is in the SlotIndex it is only read or
+    changed under the index's lock.
+    """
+
+    def __init__(self):
+        self.windows = {}   # date -> sorted [(start_minute, end_minute)]
+        self.booked = {}    # date -> sorted [start_minute]
+        self.loaded_at = timer.monotonic()
+        # (date, duration) -> free start minutes, dropped when that date changes
+        self._free = {}
+
+    def _day_changed(self, day):
+        for key in [key for key in self._free if key[0] == day]:
+            del self._free[key]
+
+    def add_window(self, day, start, end):
+        insort(self.windows.setdefault(day, []), (_minutes(start), _minutes(end)))
+        self._day_changed(day)
+
+    def _free_minutes(self, day, duration):
+        key = (day, duration)
+        free = self._free.get(key)
+        if free is None:
+            booked = self.booked.get(day, [])
+            free = []
+            for window_start, window_end in _merged(self.windows.get(day, ())):
+                t = window_start
+                # Walk candidates and bookings together; a booking at b
+                # blocks [b, b + APPOINTMENT_MINUTES)
+                i = bisect_right(booked, t - APPOINTMENT_MINUTES)
+                while t + duration <= window_end:
+                    while i < len(booked) and booked[i] <= t - APPOINTMENT_MINUTES:
+                        i += 1
+                    if i == len(booked) or booked[i] >= t + duration:
+                        free.append(t)
+                    t += duration
+            self._free[key] = free
+        return free
+
+    def occupy(self, day, start):
+        booked = self.booked.setdefault(day, [])
+        minute = _minutes(start)
+        i = bisect_left(booked, minute)
+        if i == len(booked) or booked[i] != minute:
+            booked.insert(i, minute)
+            self._day_changed(day)
+
+    def release(self, day, start):
+        booked = self.booked.get(day, [])
+        minute = _minutes(start)
+        i = bisect_left(booked, minute)
+        if i < len(booked) and booked[i] == minute:
+            del booked[i]
+            self._day_changed(day)
+
+    def free_slots(self, start_day, end_day, duration, earliest=None):
+        """{'YYYY-MM-DD': ['HH:MM', ...]} of open slots between the two dates"""
+        result = {}
+        day = start_day
+        while day <= end_day:
+            if day in self.windows:
+                free = self._free_minutes(day, duration)
+                if earliest and earliest[0] == day:
+                    free = [t for t in free if t >= earliest[1]]
+                if free:
+                    result[day.isoformat()] = [_CLOCK[t] for t in free]
+            day += timedelta(days=1)
+        return result
+
+
+class SlotIndex:
+    def __init__(self):
+        self._schedules = {}
+        self._lock = threading.Lock()
+        # Bumped by every change to a doctor (and _epoch by invalidating all of
+        # them), so a schedule loaded while one happened is not cached
+        self._generations = {}
+        self._epoch = 0
+
+    def _version(self, doctor_id):
+        return self._epoch, self._generations.get(doctor_id, 0)
+
+    def _changed(self, doctor_id):
+        self._generations[doctor_id] = self._generations.get(doctor_id, 0) + 1
+
+    def _load(self, doctor_ids):
+        """Bulk-load schedules for doctors from today onwards (two queries)"""
+        today = date.today()
+        schedules = {doctor_id: DoctorSchedule() for doctor_id in doctor_ids}
+
+        windows = db.session.query(
+            DoctorAvailability.doctor_id,
+            DoctorAvailability.date,
+            DoctorAvailability.start_time,
+            DoctorAvailability.end_time
+        ).filter(
+            DoctorAvailability.doctor_id.in_(doctor_ids),
+            DoctorAvailability.date >= today,
+            DoctorAvailability.is_available == True
+        )
+        for doctor_id, day, start, end in windows:
+            schedules[doctor_id].add_window(day, start, end)
+
+        bookings = db.session.query(
+            Appointment.doctor_id,
+            Appointment.appointment_date,
+            Appointment.appointment_time
+        ).filter(
+            Appointment.doctor_id.in_(doctor_ids),
+            Appointment.appointment_date >= today,
+            Appointment.status.in_(OCCUPYING_STATUSES)
+        )
+        for doctor_id, day, start in bookings:
+            schedules[doctor_id].occupy(day, start)
+
+        return schedules
+
+    def schedules(self, doctor_ids):
+        """Schedules for the given doctors, loading missing or expired ones"""
+        now = timer.monotonic()
+        with self._lock:
+            versions = {
+                doctor_id: self._version(doctor_id) for doctor_id in doctor_ids
+                if doctor_id not in self._schedules
+                or now - self._schedules[doctor_id].loaded_at > SLOT_INDEX_TTL
+            }
+        loaded = self._load(list(versions)) if versions else {}
+        with self._lock:
+            for doctor_id, schedule in loaded.items():
+                # A booking or cancellation recorded during the load may be
+                # missing from it: serve it to this request only
+                if self._version(doctor_id) == versions[doctor_id]:
+                    self._schedules[doctor_id] = schedule
+            return {doctor_id: loaded.get(doctor_id) or self._schedules[doctor_id] for doctor_id in doctor_ids}
+
+    def free_slots(self, doctor_ids, start_day, end_day, duration=APPOINTMENT_MINUTES):
+        """{doctor_id: {'YYYY-MM-DD': ['HH:MM', ...]}}"""
+        now = datetime.now()
+        earliest = (now.date(), now.hour * 60 + now.minute)
+        schedules = self.schedules(doctor_ids)
+        # Reading free slots fills the schedule's cache, which occupy/release change
+        with self._lock:
+            return {
+                doctor_id: schedule.free_slots(start_day, end_day, duration, earliest)
+                for doctor_id, schedule in schedules.items()
+            }
+
+    def occupy(self, doctor_id, day, start):
+        """Record a booking; no-op for doctors not loaded yet"""
+        with self._lock:
+            self._changed(doctor_id)
+            schedule = self._schedules.get(doctor_id)
+            if schedule:
+                schedule.occupy(day, start)
+
+    def release(self, doctor_id, day, start):
+        """Record a cancellation; no-op for doctors not loaded yet"""
+        with self._lock:
+            self._changed(doctor_id)
+            schedule = self._schedules.get(doctor_id)
+            if schedule:
+                schedule.release(day, start)
+
+    def invalidate(self, doctor_ids=None):
+        """Forget cached schedules (all of them when doctor_ids is None)"""
+        with self._lock:
+            if doctor_ids is None:
+                self._schedules.clear()
+                self._epoch += 1
+            else:
+                for doctor_id in doctor_ids:
+                    self._schedules.pop(doctor_id, None)
+                    self._changed(doctor_id)
+
+
+slot_index = SlotIndex()
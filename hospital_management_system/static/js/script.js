@@ -7,6 +7,31 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Type-ahead: search once typing pauses, from the second character on
+    const searchText = document.getElementById('searchText');
+    if (searchText) {
+        let typingTimer;
+        searchText.addEventListener('input', function() {
+            clearTimeout(typingTimer);
+            if (searchText.value.trim().length !== 1) {
+                typingTimer = setTimeout(() => searchDoctors(), 200);
+            }
+        });
+    }
+
+    const bookingDate = document.getElementById('bookingDate');
+    if (bookingDate) {
+        bookingDate.addEventListener('change', loadFreeSlots);
+    }
+
+    const treatmentSearchForm = document.getElementById('treatmentSearchForm');
+    if (treatmentSearchForm) {
+        treatmentSearchForm.addEventListener('submit', function(e) {
+            e.preventDefault();
+            searchTreatments();
+        });
+    }
+
     const addDoctorForm = document.getElementById('addDoctorForm');
     if (addDoctorForm) {
         addDoctorForm.addEventListener('submit', function(e) {
@@ -15,6 +40,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Appointment rows carry the URL of their details; the shared modal is filled on click
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('[data-appointment-details]');
+        if (button) {
+            showAppointmentDetails(button.dataset.appointmentDetails);
+        }
+    });
+
+    const liveEvents = document.querySelector('[data-live-events]');
+    if (liveEvents) {
+        startLiveUpdates(liveEvents);
+    }
+
     setTimeout(() => {
         const alerts = document.querySelectorAll('.alert');
         alerts.forEach(alert => {
@@ -24,17 +62,34 @@ document.addEventListener('DOMContentLoaded', function() {
     }, 5000);
 });
 
-function searchDoctors() {
+let latestSearch = 0;
+
+function searchDoctors(after) {
+    const searchText = document.getElementById('searchText');
     const specialization = document.getElementById('specialization').value;
     const date = document.getElementById('appointmentDate').value;
     const resultsDiv = document.getElementById('doctorResults');
+    const searchId = ++latestSearch;
     
-    resultsDiv.innerHTML = '<div class="text-center"><div class="spinner-border" role="status"></div></div>';
+    const params = new URLSearchParams({
+        q: searchText ? searchText.value : '',
+        specialization: specialization,
+        date: date
+    });
+    if (after) {
+        params.append('after', after);
+    } else {
+        resultsDiv.innerHTML = '<div class="text-center"><div class="spinner-border" role="status"></div></div>';
+    }
     
-    fetch(`/search_doctors?specialization=${specialization}&date=${date}`)
+    fetch(`/search_doctors?${params}`)
         .then(response => response.json())
-        .then(doctors => {
-            displayDoctors(doctors);
+        .then(data => {
+            // Drop responses to searches the user has already typed past
+            if (searchId !== latestSearch) {
+                return;
+            }
+            displayDoctors(data.doctors, data.next_cursor, Boolean(after));
         })
         .catch(error => {
             console.error('Error:', error);
@@ -42,14 +97,14 @@ function searchDoctors() {
         });
 }
 
-function displayDoctors(doctors) {
+function displayDoctors(doctors, nextCursor, append) {
     const resultsDiv = document.getElementById('doctorResults');
-    if (doctors.length === 0) {
+    if (doctors.length === 0 && !append) {
         resultsDiv.innerHTML = '<div class="alert alert-info">No doctors found matching your criteria.</div>';
         return;
     }
 
-    let html = '<div class="row">';
+    let html = '';
     doctors.forEach(doctor => {
         html += `
             <div class="col-md-6 mb-3">
@@ -70,18 +125,82 @@ function displayDoctors(doctors) {
             </div>
         `;
     });
-    html += '</div>';
     
-    resultsDiv.innerHTML = html;
+    if (!append) {
+        resultsDiv.innerHTML = '<div class="row" id="doctorResultsRow"></div><div id="doctorResultsMore" class="text-center"></div>';
+    }
+    document.getElementById('doctorResultsRow').insertAdjacentHTML('beforeend', html);
+    
+    const moreDiv = document.getElementById('doctorResultsMore');
+    moreDiv.innerHTML = nextCursor
+        ? `<button class="btn btn-outline-primary btn-sm" onclick="searchDoctors('${nextCursor}')">Load more</button>`
+        : '';
+}
+
+function loadMore(button) {
+    // Fetch the next keyset page of a server-rendered list and append it
+    const params = new URLSearchParams({ after: button.dataset.cursor });
+    button.disabled = true;
+    
+    fetch(`${button.dataset.url}?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            document.getElementById(button.dataset.target).insertAdjacentHTML('beforeend', data.html);
+            if (data.next_cursor) {
+                button.dataset.cursor = data.next_cursor;
+                button.disabled = false;
+            } else {
+                button.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            button.disabled = false;
+        });
 }
 
 function showBookingModal(doctorId, doctorName) {
     const modal = new bootstrap.Modal(document.getElementById('bookingModal'));
     document.getElementById('bookingDoctorId').value = doctorId;
     document.getElementById('bookingDoctorName').textContent = doctorName;
+    document.getElementById('bookingFreeSlots').innerHTML = '';
+    loadFreeSlots();
     modal.show();
 }
 
+function loadFreeSlots() {
+    const doctorId = document.getElementById('bookingDoctorId').value;
+    const date = document.getElementById('bookingDate').value;
+    const slotsDiv = document.getElementById('bookingFreeSlots');
+    if (!doctorId || !date) {
+        return;
+    }
+
+    fetch(`/doctors/${doctorId}/free_slots?from=${date}&to=${date}`)
+        .then(response => response.json())
+        .then(data => {
+            const times = (data.slots && data.slots[date]) || [];
+            if (times.length === 0) {
+                slotsDiv.innerHTML = '<small class="text-muted">No free slots on this date.</small>';
+                return;
+            }
+            slotsDiv.innerHTML = times.map(t =>
+                `<button type="button" class="btn btn-outline-secondary btn-sm me-1 mb-1" onclick="pickSlot('${t}')">${t}</button>`
+            ).join('');
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            slotsDiv.innerHTML = '';
+        });
+}
+
+function pickSlot(time) {
+    document.getElementById('bookingTime').value = time;
+}
+
 function bookAppointment() {
     const doctorId = document.getElementById('bookingDoctorId').value;
     const date = document.getElementById('bookingDate').value;
@@ -139,4 +258,195 @@ function addDoctor() {
         console.error('Error:', error);
         alert('Error adding doctor');
     });
-}
\ No newline at end of file
+}
+
+function showAppointmentDetails(url) {
+    const content = document.getElementById('appointmentModalContent');
+    content.dataset.url = url;
+    content.innerHTML = '<div class="modal-body text-center"><div class="spinner-border" role="status"></div></div>';
+    bootstrap.Modal.getOrCreateInstance(document.getElementById('appointmentModal')).show();
+    
+    fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                return response.json().then(data => { throw new Error(data.error); });
+            }
+            return response.text();
+        })
+        .then(html => {
+            // Ignore a slow response once another appointment has been opened
+            if (content.dataset.url === url) {
+                content.innerHTML = html;
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            content.innerHTML = `<div class="modal-body"><div class="alert alert-danger mb-0">${escapeHtml(error.message || 'Error loading appointment')}</div></div>`;
+        });
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
+function searchTreatments(after) {
+    const form = document.getElementById('treatmentSearchForm');
+    const resultsDiv = document.getElementById('treatmentResults');
+    const params = new URLSearchParams();
+    new FormData(form).forEach((value, key) => {
+        if (value) {
+            params.append(key, value);
+        }
+    });
+    if (after) {
+        params.append('after', after);
+    } else {
+        resultsDiv.innerHTML = '<div class="text-center"><div class="spinner-border" role="status"></div></div>';
+    }
+    
+    fetch(`/treatments/search?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                resultsDiv.innerHTML = `<div class="alert alert-warning">${escapeHtml(data.error)}</div>`;
+                return;
+            }
+            displayTreatments(data.treatments, data.next_cursor, Boolean(after));
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            resultsDiv.innerHTML = '<div class="alert alert-danger">Error searching treatments</div>';
+        });
+}
+
+function displayTreatments(treatments, nextCursor, append) {
+    const resultsDiv = document.getElementById('treatmentResults');
+    if (treatments.length === 0 && !append) {
+        resultsDiv.innerHTML = '<div class="alert alert-info">No treatments match your search.</div>';
+        return;
+    }
+
+    // The snippet is HTML from the server: escaped text with matches in <mark>
+    let html = '';
+    treatments.forEach(treatment => {
+        html += `
+            <div class="list-group-item">
+                <div class="d-flex justify-content-between">
+                    <strong>${escapeHtml(treatment.patient)}
+                        <small class="text-muted">(patient #${treatment.patient_id})</small>
+                    </strong>
+                    <small class="text-muted">${treatment.appointment_date} &middot; Dr. ${escapeHtml(treatment.doctor)}</small>
+                </div>
+                <p class="mb-0">${treatment.snippet}</p>
+            </div>
+        `;
+    });
+
+    if (!append) {
+        resultsDiv.innerHTML = '<div class="list-group" id="treatmentResultsList"></div><div id="treatmentResultsMore" class="text-center mt-3"></div>';
+    }
+    document.getElementById('treatmentResultsList').insertAdjacentHTML('beforeend', html);
+
+    const moreDiv = document.getElementById('treatmentResultsMore');
+    moreDiv.innerHTML = nextCursor
+        ? `<button class="btn btn-outline-primary btn-sm" onclick="searchTreatments('${nextCursor}')">Load more</button>`
+        : '';
+}
+
+const STATUS_BADGES = { Booked: 'bg-primary', Completed: 'bg-success', Cancelled: 'bg-danger' };
+
+function startLiveUpdates(container) {
+    // Appointment changes since the page was rendered (see events.py): polled
+    // by default, or streamed when the server has server-sent events on
+    let after = Number(container.dataset.liveAfter);
+    if (container.dataset.liveSse === '1' && window.EventSource) {
+        // The browser reconnects by itself and resumes after the last event it received
+        const source = new EventSource(`${container.dataset.liveEvents}?after=${after}`);
+        source.addEventListener('appointment', e => applyAppointmentChange(container, JSON.parse(e.data)));
+        // Missed too much while disconnected to catch up from deltas
+        source.addEventListener('reload', () => location.reload());
+        return;
+    }
+
+    const poll = () => {
+        // Background tabs skip their turn and catch up when shown again
+        if (document.hidden) {
+            return;
+        }
+        fetch(`${container.dataset.liveEvents}?after=${after}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.reload) {
+                    location.reload();
+                    return;
+                }
+                (data.events || []).forEach(event => {
+                    if (event.id > after) {
+                        after = event.id;
+                        applyAppointmentChange(container, event.data);
+                    }
+                });
+            })
+            .catch(error => console.error('Error:', error));
+    };
+    setInterval(poll, Number(container.dataset.livePoll) * 1000);
+    document.addEventListener('visibilitychange', poll);
+}
+
+function applyAppointmentChange(container, change) {
+    const today = container.dataset.today;
+    const weekEnd = container.dataset.weekEnd;
+    const deltas = {};
+    const bump = (name, delta) => { deltas[name] = (deltas[name] || 0) + delta; };
+
+    if (change.previous === null) {
+        bump('appointments', 1);
+        if (change.date === today) {
+            bump('today', 1);
+        }
+    }
+    if (change.date === today) {
+        bump(`today-${change.status}`, 1);
+        if (change.previous) {
+            bump(`today-${change.previous}`, -1);
+        }
+    }
+    if (weekEnd && change.date >= today && change.date <= weekEnd) {
+        bump('upcoming', (change.status === 'Booked') - (change.previous === 'Booked'));
+    }
+    Object.entries(deltas).forEach(([name, delta]) => {
+        document.querySelectorAll(`[data-live-counter="${name}"]`).forEach(counter => {
+            counter.textContent = (parseInt(counter.textContent, 10) || 0) + delta;
+        });
+    });
+
+    document.querySelectorAll(`[data-appointment-id="${change.id}"]`).forEach(row => {
+        if (change.status !== 'Booked' && row.hasAttribute('data-booked-list')) {
+            row.remove();
+            return;
+        }
+        row.querySelectorAll('[data-status-badge]').forEach(badge => {
+            badge.classList.remove(...Object.values(STATUS_BADGES));
+            badge.classList.add(STATUS_BADGES[change.status]);
+            badge.textContent = change.status;
+        });
+        if (change.status !== 'Booked') {
+            row.querySelectorAll('[data-booked-only]').forEach(element => element.remove());
+        }
+    });
+
+    if (change.previous === null) {
+        const doctor = 'showDoctor' in container.dataset ? ` with Dr. ${escapeHtml(change.doctor)}` : '';
+        container.insertAdjacentHTML('beforeend', `
+            <div class="alert alert-info alert-dismissible fade show py-2">
+                <i class="fas fa-calendar-plus me-1"></i>
+                New booking: <strong>${escapeHtml(change.patient)}</strong>${doctor}
+                on ${change.date} at ${change.time}.
+                <a href="${location.pathname}" class="alert-link">Refresh</a>
+                <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
+            </div>
+        `);
+    }
+}
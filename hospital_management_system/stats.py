@@ -0,0 +1,183 @@
+"""Incrementally maintained counters for the admin dashboard.
+
+Each write that changes a dashboard number also bumps a row in
+stat_counters inside the same transaction, so the dashboard reads a handful
+of primary-key rows instead of running COUNT(*) over growing tables.
+reconcile_counters() recomputes the counters from the source tables and is
+run periodically (see jobs.py) to correct any drift.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert
+from models import db, User, Doctor, Patient, Department, Appointment, ArchivedAppointment, StatCounter
+from jobs import periodic
+
+# Run reconcile_counters() this often from `flask run-jobs`
+STATS_RECONCILE_INTERVAL = 15 * 60
+# Per-day counters older than this are deleted when reconciling
+DAILY_COUNTER_RETENTION_DAYS = 30
+
+TOTALS = ('doctors', 'patients', 'appointments', 'departments')
+DAILY = ('new_patients', 'appointments', 'completed_appointments')
+
+
+def daily_key(name, day):
+    return f'{name}:{day.isoformat()}'
+
+
+def bump(*names, delta=1):
+    """Add `delta` to each counter in the current session's transaction"""
+    for name in names:
+        statement = insert(StatCounter).values(name=name, value=delta, updated_at=datetime.utcnow())
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[StatCounter.name],
+            set_={'value': StatCounter.value + delta, 'updated_at': statement.excluded.updated_at}
+        ))
+
+
+def patient_registered(created_at):
+    # Registration days follow users.created_at, which is stored in UTC
+    bump('patients', daily_key('new_patients', created_at.date()))
+
+
+def doctor_added():
+    bump('doctors')
+
+
+def appointment_booked(appointment_date):
+    bump('appointments', daily_key('appointments', appointment_date))
+
+
+def appointment_completed(appointment_date, delta=1):
+    bump(daily_key('completed_appointments', appointment_date), delta=delta)
+
+
+def daily_count_queries(day, registration_day):
+    """{counter name: query} for the per-day counters; reconcile_counters() counts their rows"""
+    start = datetime.combine(registration_day, datetime.min.time())
+    return {
+        daily_key('new_patients', registration_day): Patient.query.join(User, Patient.user_id == User.id).filter(
+            User.created_at >= start,
+            User.created_at < start + timedelta(days=1)
+        ),
+        daily_key('appointments', day): Appointment.query.filter_by(appointment_date=day),
+        daily_key('completed_appointments', day): Appointment.query.filter_by(
+            appointment_date=day,
+            status='Completed'
+        ),
+    }
+
+
+def _actual_counts(day, registration_day):
+    counts = {
+        'doctors': Doctor.query.filter_by(is_active=True).count(),
+        'patients': Patient.query.filter_by(is_active=True).count(),
+        # Archiving moves appointments without changing how many were ever booked
+        'appointments': Appointment.query.count() + ArchivedAppointment.query.count(),
+        'departments': Department.query.count(),
+    }
+    for name, query in daily_count_queries(day, registration_day).items():
+        counts[name] = query.count()
+    return counts
+
+
+def _upsert_grouped(name, day, value, where):
+    """Upsert the counter `name`:<day> = value for every group of a GROUP BY `day` query"""
+    day = db.type_coerce(day, db.String)
+    grouped = db.select(
+        db.literal(f'{name}:') + day, value, db.literal(datetime.utcnow(), db.DateTime)
+    ).where(*where).group_by(day)
+    statement = insert(StatCounter).from_select(['name', 'value', 'updated_at'], grouped)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[StatCounter.name],
+        set_={'value': statement.excluded.value, 'updated_at': statement.excluded.updated_at}
+    ))
+
+
+def seed_daily_counters(since):
+    """Write the per-day counters of every day from `since` on, including future bookings.
+
+    The dashboard only reconciles the current day, so without this a day
+    booked before the counters existed would show only the bookings made
+    since.
+    """
+    _upsert_grouped('appointments', Appointment.appointment_date, db.func.count(Appointment.id),
+                    [Appointment.appointment_date >= since])
+    _upsert_grouped('completed_appointments', Appointment.appointment_date, db.func.count(Appointment.id),
+                    [Appointment.appointment_date >= since, Appointment.status == 'Completed'])
+    registered = db.func.date(User.created_at)
+    _upsert_grouped('new_patients', registered, db.func.count(Patient.id),
+                    [Patient.user_id == User.id, User.created_at >= datetime.combine(since, datetime.min.time())])
+
+
+def reconcile_daily_counters(day, registration_day):
+    """Overwrite one day's counters with real counts, for a day that has none yet"""
+    for name, query in daily_count_queries(day, registration_day).items():
+        db.session.merge(StatCounter(name=name, value=query.count(), updated_at=datetime.utcnow()))
+    db.session.commit()
+
+
+def reconcile_counters(day=None, registration_day=None):
+    """Overwrite the totals and today's counters with real counts.
+
+    When the counters are first created every per-day counter is seeded too.
+    Returns {name: (counted, actual)} for every counter that had drifted.
+    """
+    day = day or date.today()
+    registration_day = registration_day or datetime.utcnow().date()
+    stored = dict(db.session.query(StatCounter.name, StatCounter.value))
+    if not any(name in stored for name in TOTALS):
+        seed_daily_counters(min(day, registration_day) - timedelta(days=DAILY_COUNTER_RETENTION_DAYS))
+    drift = {}
+    for name, actual in _actual_counts(day, registration_day).items():
+        if stored.get(name) != actual:
+            drift[name] = (stored.get(name), actual)
+        db.session.merge(StatCounter(name=name, value=actual, updated_at=datetime.utcnow()))
+
+    cutoff = day - timedelta(days=DAILY_COUNTER_RETENTION_DAYS)
+    for name in DAILY:
+        StatCounter.query.filter(
+            StatCounter.name.like(f'{name}:%'),
+            StatCounter.name < daily_key(name, cutoff)
+        ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return drift
+
+
+@periodic(STATS_RECONCILE_INTERVAL)
+def reconcile_stats_job():
+    drift = reconcile_counters()
+    return {'drifted': drift} if drift else None
+
+
+def counter_value(name):
+    """Current value of one counter, 0 if it has never been set"""
+    return db.session.query(StatCounter.value).filter_by(name=name).scalar() or 0
+
+
+def dashboard_counters():
+    """(stats, today_stats) for the admin dashboard in a single query"""
+    day = date.today()
+    registration_day = datetime.utcnow().date()
+    daily = {name: daily_key(name, day) for name in DAILY}
+    daily['new_patients'] = daily_key('new_patients', registration_day)
+    names = list(TOTALS) + list(daily.values())
+
+    values = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(names)))
+    missing = [name for name in names if name not in values]
+    if missing:
+        if any(name in TOTALS for name in missing):
+            # Fresh or reset database: build the counters once from the tables
+            reconcile_counters(day, registration_day)
+        else:
+            # The first dashboard of a day nothing had been counted for yet
+            reconcile_daily_counters(day, registration_day)
+        values = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(names)))
+
+    stats = {name: values.get(name, 0) for name in TOTALS}
+    today_stats = {
+        'new_patients': values.get(daily['new_patients'], 0),
+        'todays_appointments': values.get(daily['appointments'], 0),
+        'completed_appointments': values.get(daily['completed_appointments'], 0),
+    }
+    return stats, today_stats
@@ -0,0 +1,41 @@
+"""Shared fixtures: the app on a scratch SQLite file holding a small generated dataset."""
+import os
+import sys
+import tempfile
+
+# app.py reads DATABASE_URL when it is imported
+_DB_DIR = tempfile.mkdtemp(prefix='hospital-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DB_DIR, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from app import app as flask_app, create_tables
+from datagen import generate_dataset, GENERATED_PASSWORD
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(
+        TESTING=True,
+        # Cheap hashes, computed in the calling thread
+        HASH_POOL='inline',
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+        MAIL_BACKEND='console',
+    )
+    create_tables()
+    with flask_app.app_context():
+        generate_dataset(patients=40, doctors=6, appointments=400, past_days=30, future_days=14)
+    yield flask_app
+
+
+@pytest.fixture
+def login(app):
+    """login(username) -> a test client signed in as that user"""
+    def login(username, password=GENERATED_PASSWORD):
+        client = app.test_client()
+        if username == 'admin':
+            password = 'admin123'
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302, f'login as {username} failed'
+        return client
+    return login
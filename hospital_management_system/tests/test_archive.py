@@ -0,0 +1,39 @@
+"""Archiving keeps ids unique across live and archived rows and archived rows searchable."""
+from datetime import date, datetime, time, timedelta
+from models import db, Doctor, Patient, Appointment, ArchivedAppointment, Treatment
+from archive import archive_closed_appointments
+from booking import reserve_slot
+from exporter import export_rows
+from search import treatment_history
+
+VISIT_DAY = date(2000, 1, 3)
+
+
+def test_archived_ids_are_not_reused(app):
+    with app.app_context():
+        doctor_id = db.session.query(Doctor.id).order_by(Doctor.id).limit(1).scalar()
+        patient_id = db.session.query(Patient.id).order_by(Patient.id).limit(1).scalar()
+        # The newest appointment, so without AUTOINCREMENT the next insert would take its id
+        appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, appointment_date=VISIT_DAY,
+                                  appointment_time=time(9, 0), status='Completed')
+        db.session.add(appointment)
+        db.session.flush()
+        db.session.add(Treatment(appointment_id=appointment.id, diagnosis='zygomycosis',
+                                 prescription='rest', treatment_date=datetime(2000, 1, 3, 9, 10)))
+        db.session.commit()
+        archived_id = appointment.id
+
+        # Only rows before the day after the visit are old enough
+        summary = archive_closed_appointments(older_than_days=(date.today() - VISIT_DAY).days - 1)
+        assert summary['appointments'] == 1
+        assert db.session.get(Appointment, archived_id) is None
+
+        new_id = reserve_slot(db.session, patient_id, doctor_id, date.today() + timedelta(days=90), time(9, 0))
+        db.session.commit()
+        assert new_id > db.session.query(db.func.max(ArchivedAppointment.id)).scalar()
+
+        found = treatment_history('zygomycosis').all()
+        assert [row.appointment_id for row in found] == [archived_id]
+
+        exported = [row for batch in export_rows({'from': VISIT_DAY, 'to': VISIT_DAY}) for row in batch]
+        assert [row.appointment_id for row in exported] == [archived_id]
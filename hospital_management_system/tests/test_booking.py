@@ -0,0 +1,43 @@
+"""reserve_slot() under concurrency: one slot, many simultaneous bookings."""
+import threading
+from datetime import date, time, timedelta
+from booking import reserve_slot, SlotTaken
+from models import db, Doctor, Patient, Appointment
+
+RACERS = 8
+
+
+def test_concurrent_reservations_book_a_slot_once(app):
+    with app.app_context():
+        doctor_id = db.session.query(Doctor.id).order_by(Doctor.id).limit(1).scalar()
+        patient_ids = db.session.execute(db.select(Patient.id).order_by(Patient.id).limit(RACERS)).scalars().all()
+        engine = db.engine
+    # Past the generated bookings, so the slot starts free
+    slot_date = date.today() + timedelta(days=60)
+    slot_time = time(10, 0)
+
+    start = threading.Barrier(len(patient_ids))
+    outcomes = []
+
+    def book(patient_id):
+        with engine.connect() as conn:
+            start.wait()
+            try:
+                reserve_slot(conn, patient_id, doctor_id, slot_date, slot_time)
+                conn.commit()
+                outcomes.append('booked')
+            except SlotTaken:
+                conn.rollback()
+                outcomes.append('taken')
+
+    threads = [threading.Thread(target=book, args=(patient_id,)) for patient_id in patient_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ['booked'] + ['taken'] * (len(patient_ids) - 1)
+    with app.app_context():
+        booked = Appointment.query.filter_by(doctor_id=doctor_id, appointment_date=slot_date,
+                                             appointment_time=slot_time, status='Booked').count()
+    assert booked == 1
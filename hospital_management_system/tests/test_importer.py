@@ -0,0 +1,26 @@
+"""Bulk imports count their accounts in the registration rollup, in the same transaction."""
+import csv
+from datetime import datetime
+from models import db, RegistrationDailyRollup
+from importer import import_file
+
+
+def _registered_today(role):
+    return db.session.query(RegistrationDailyRollup.count).filter_by(
+        day=datetime.utcnow().date(), role=role
+    ).scalar() or 0
+
+
+def test_imported_patients_reach_the_registration_rollup(app, tmp_path):
+    path = tmp_path / 'patients.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'email', 'phone'])
+        for n in range(7):
+            writer.writerow([f'imported_{n}', f'imported_{n}@example.com', '555'])
+
+    with app.app_context():
+        before = _registered_today('patient')
+        summary = import_file(str(path), 'patients', chunk_size=3)
+        assert summary['inserted'] == 7
+        assert _registered_today('patient') == before + 7
@@ -0,0 +1,124 @@
+"""Outbox delivery against a local SMTP stand-in: claim, send, retry with backoff, dead-letter."""
+import socketserver
+import threading
+from datetime import datetime, timedelta
+import pytest
+from models import db, OutboxMessage
+from outbox import (enqueue_email, deliver_pending, sweep_sent, smtp_connection, _claim_batch,
+                    OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_CLAIM_SECONDS)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts every message, or refuses them while server.fail is set"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost stand-in')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'MAIL' and self.server.fail:
+                self.reply('451 try again later')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                lines = []
+                while (data := self.rfile.readline().decode()) not in ('.\r\n', ''):
+                    lines.append(data)
+                self.server.messages.append(''.join(lines))
+                self.reply('250 queued')
+            else:
+                self.reply('250 ok')
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.messages = []
+        self.fail = False
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    server = SmtpServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for name, value in {'MAIL_BACKEND': 'smtp', 'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': server.server_address[1],
+                        'MAIL_USE_TLS': False, 'MAIL_USERNAME': '',
+                        'MAIL_DEFAULT_SENDER': 'hospital@example.com'}.items():
+        monkeypatch.setitem(app.config, name, value)
+    with app.app_context():
+        OutboxMessage.query.delete()
+        db.session.commit()
+        yield server
+        smtp_connection.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_delivers_queued_message(smtp):
+    enqueue_email('patient@example.com', 'Appointment Confirmed', 'See you soon.')
+    db.session.commit()
+
+    assert deliver_pending() == {'sent': 1, 'retried': 0, 'dead': 0}
+    assert len(smtp.messages) == 1
+    assert 'Subject: Appointment Confirmed' in smtp.messages[0]
+    message = OutboxMessage.query.one()
+    assert message.status == 'sent' and message.sent_at is not None and message.attempts == 1
+
+
+def test_failures_back_off_then_dead_letter(smtp):
+    smtp.fail = True
+    message = enqueue_email('patient@example.com', 'Appointment Cancelled', 'Sorry.')
+    db.session.commit()
+
+    delays = []
+    for attempt in range(1, OUTBOX_MAX_ATTEMPTS + 1):
+        began = datetime.utcnow()
+        summary = deliver_pending()
+        db.session.refresh(message)
+        assert message.attempts == attempt
+        if attempt < OUTBOX_MAX_ATTEMPTS:
+            assert summary == {'sent': 0, 'retried': 1, 'dead': 0}
+            assert message.status == 'pending' and message.last_error
+            delays.append(round((message.next_attempt_at - began).total_seconds() / OUTBOX_RETRY_BASE))
+            # Not due yet: a second run leaves it alone
+            assert deliver_pending() == {'sent': 0, 'retried': 0, 'dead': 0}
+            message.next_attempt_at = datetime.utcnow()
+            db.session.commit()
+        else:
+            assert summary == {'sent': 0, 'retried': 0, 'dead': 1}
+            assert message.status == 'dead'
+    assert delays == [2 ** n for n in range(OUTBOX_MAX_ATTEMPTS - 1)]
+    assert smtp.messages == []
+
+
+def test_claimed_batch_is_leased(smtp):
+    for n in range(3):
+        enqueue_email(f'patient{n}@example.com', 'Reminder', 'Tomorrow at 9.')
+    db.session.commit()
+
+    now = datetime.utcnow()
+    assert len(_claim_batch(now, 10)) == 3
+    # Another sender finds nothing while the lease holds, and all of it once it lapses
+    assert _claim_batch(now, 10) == []
+    assert len(_claim_batch(now + timedelta(seconds=OUTBOX_CLAIM_SECONDS + 1), 10)) == 3
+
+
+def test_sweep_removes_only_old_sent_messages(smtp):
+    long_ago = datetime.utcnow() - timedelta(days=365)
+    db.session.add_all([
+        OutboxMessage(recipient='a@example.com', subject='old', body='x', status='sent', sent_at=long_ago),
+        OutboxMessage(recipient='b@example.com', subject='new', body='x', status='sent', sent_at=datetime.utcnow()),
+        OutboxMessage(recipient='c@example.com', subject='dead', body='x', status='dead', created_at=long_ago),
+    ])
+    db.session.commit()
+
+    assert sweep_sent() == 1
+    assert sorted(message.subject for message in OutboxMessage.query) == ['dead', 'new']
@@ -0,0 +1,55 @@
+"""Keyset paging: ties on the sort key, live and archived rows merged, and bad cursors."""
+from datetime import date, time
+import pytest
+from models import db, User, Doctor, Patient, Appointment
+from archive import archive_closed_appointments
+from pagination import encode_cursor
+from queries import history_page
+
+ARCHIVED_DAY = date(2001, 1, 1)
+LIVE_DAY = date(2001, 6, 1)
+
+
+def test_history_pages_have_no_gaps_or_duplicates(app):
+    with app.app_context():
+        user = User(username='paging_patient', email='paging@example.com', password='x', role='patient')
+        db.session.add(user)
+        db.session.flush()
+        patient = Patient(user_id=user.id)
+        db.session.add(patient)
+        db.session.flush()
+        doctor_id = db.session.query(Doctor.id).order_by(Doctor.id).limit(1).scalar()
+        # Every row of a day shares its sort key up to the id
+        for day, count in ((ARCHIVED_DAY, 9), (LIVE_DAY, 12)):
+            db.session.add_all([
+                Appointment(patient_id=patient.id, doctor_id=doctor_id, appointment_date=day,
+                            appointment_time=time(9, 0), status='Completed')
+                for _ in range(count)
+            ])
+        db.session.commit()
+        archive_closed_appointments(older_than_days=(date.today() - ARCHIVED_DAY).days - 1)
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = history_page(patient.id, cursor, include_archived=True)
+            seen.extend((row.appointment_date, row.id) for row in rows)
+            pages += 1
+            if cursor is None:
+                break
+        assert pages == 3
+        assert len(seen) == len(set(seen)) == 21
+        assert seen == sorted(seen, reverse=True)
+        assert [day for day, _ in seen].count(ARCHIVED_DAY) == 9
+
+
+@pytest.mark.parametrize('user, path, cursor', [
+    ('gen_patient_0', '/patient/appointments/history', 'not a cursor'),
+    ('gen_patient_0', '/patient/appointments/history', encode_cursor([1])),
+    ('gen_patient_0', '/patient/appointments/history', encode_cursor(['someday', '09:00', 1])),
+    ('admin', '/admin/doctors/page', 'not a cursor'),
+    ('admin', '/admin/doctors/page', encode_cursor(['one'])),
+    ('admin', '/admin/doctors/page', encode_cursor([1, 2])),
+])
+def test_malformed_cursor_is_a_400(login, user, path, cursor):
+    response = login(user).get(path, query_string={'after': cursor})
+    assert response.status_code == 400
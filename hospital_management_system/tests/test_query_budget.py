@@ -0,0 +1,60 @@
+"""Every @query_budget view stays within its budget on a seeded database.
+
+The app runs with TESTING on, so a view that goes over its budget raises
+QueryBudgetExceeded instead of logging a warning.
+"""
+from datetime import date
+import pytest
+from models import db, User, Patient, Appointment
+from query_budget import QueryBudgetExceeded
+
+
+def _patient_with_history(app):
+    with app.app_context():
+        appointment = Appointment.query.filter(Appointment.status.in_(['Completed', 'Cancelled'])).first()
+        username = db.session.query(User.username).join(Patient, Patient.user_id == User.id).filter(
+            Patient.id == appointment.patient_id
+        ).scalar()
+        return username, appointment.id
+
+
+def _budgeted_requests(app):
+    """(endpoint, username, url) for every view that declares a query budget"""
+    patient, appointment_id = _patient_with_history(app)
+    today = date.today().isoformat()
+    return [
+        ('admin_dashboard', 'admin', '/admin/dashboard'),
+        ('admin_events', 'admin', '/events/admin?after=0'),
+        ('admin_doctors', 'admin', '/admin/doctors'),
+        ('admin_doctors_page', 'admin', '/admin/doctors/page'),
+        ('admin_analytics', 'admin', '/admin/analytics'),
+        ('admin_profiling', 'admin', '/admin/profiling'),
+        ('doctor_dashboard', 'gen_doctor_0', '/doctor/dashboard'),
+        ('doctor_events', 'gen_doctor_0', '/events/doctor?after=0'),
+        ('search_treatments', 'gen_doctor_0', '/treatments/search?q=infection'),
+        ('patient_dashboard', patient, '/patient/dashboard'),
+        ('patient_history_page', patient, '/patient/appointments/history'),
+        ('appointment_details', patient, f'/appointments/{appointment_id}/details'),
+        ('search_doctors', patient, '/search_doctors?q=card'),
+        ('search_doctors', patient, f'/search_doctors?q=card&date={today}'),
+    ]
+
+
+def test_every_budgeted_view_is_covered(app):
+    budgeted = {endpoint for endpoint, view in app.view_functions.items() if hasattr(view, '_query_budget')}
+    assert budgeted == {endpoint for endpoint, _, _ in _budgeted_requests(app)}
+
+
+def test_views_stay_within_budget(app, login):
+    clients = {}
+    for endpoint, username, url in _budgeted_requests(app):
+        client = clients.get(username) or clients.setdefault(username, login(username))
+        response = client.get(url)
+        assert response.status_code == 200, f'{endpoint}: {response.status_code}'
+
+
+def test_exceeding_a_budget_fails(app, login, monkeypatch):
+    client = login('admin')
+    monkeypatch.setattr(app.view_functions['admin_dashboard'], '_query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded, match='admin_dashboard ran'):
+        client.get('/admin/dashboard')
@@ -0,0 +1,8 @@
+"""explain-queries on the test database: no route query falls back to a table scan."""
+from schema import explain_hot_queries
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        scans = [(name, plan) for name, plan, uses_index in explain_hot_queries() if not uses_index]
+    assert scans == []
@@ -0,0 +1,66 @@
+"""The free-slot algorithm and the index's handling of bookings made while it loads."""
+from datetime import date, time
+from slots import DoctorSchedule, SlotIndex
+
+DAY = date(2030, 1, 7)
+
+
+def _schedule(windows, booked=()):
+    schedule = DoctorSchedule()
+    for start, end in windows:
+        schedule.add_window(DAY, start, end)
+    for start in booked:
+        schedule.occupy(DAY, start)
+    return schedule
+
+
+def _clock(minutes):
+    return [f'{m // 60:02d}:{m % 60:02d}' for m in minutes]
+
+
+def test_window_is_cut_into_slots_that_fit():
+    schedule = _schedule([(time(9, 0), time(10, 10))])
+    assert _clock(schedule._free_minutes(DAY, 15)) == ['09:00', '09:15', '09:30', '09:45']
+    assert _clock(schedule._free_minutes(DAY, 30)) == ['09:00', '09:30']
+    assert schedule._free_minutes(DAY, 90) == []
+
+
+def test_touching_windows_merge_and_gaps_do_not():
+    # 15 minute availability rows, as expanded schedules store them, then a lunch break
+    schedule = _schedule([(time(9, 0), time(9, 15)), (time(9, 15), time(9, 30)), (time(10, 0), time(10, 30))])
+    assert _clock(schedule._free_minutes(DAY, 30)) == ['09:00', '10:00']
+
+
+def test_bookings_at_the_window_edges():
+    schedule = _schedule([(time(9, 0), time(10, 0))], booked=[time(9, 0), time(9, 45)])
+    assert _clock(schedule._free_minutes(DAY, 15)) == ['09:15', '09:30']
+
+
+def test_bookings_outside_the_window_only_block_what_they_overlap():
+    # 08:50 runs until 09:05; 10:00 starts as the window ends
+    schedule = _schedule([(time(9, 0), time(10, 0))], booked=[time(8, 50), time(10, 0)])
+    assert _clock(schedule._free_minutes(DAY, 15)) == ['09:15', '09:30', '09:45']
+
+
+def test_days_off_and_releases():
+    schedule = _schedule([(time(9, 0), time(9, 30))], booked=[time(9, 0)])
+    assert schedule._free_minutes(date(2030, 1, 8), 15) == []
+    assert _clock(schedule._free_minutes(DAY, 15)) == ['09:15']
+    schedule.release(DAY, time(9, 0))
+    assert _clock(schedule._free_minutes(DAY, 15)) == ['09:00', '09:15']
+
+
+def test_booking_recorded_during_a_load_is_not_lost():
+    index = SlotIndex()
+
+    def load(doctor_ids):
+        # The database was read before this booking committed
+        index.occupy(1, DAY, time(9, 0))
+        return {doctor_id: _schedule([(time(9, 0), time(9, 30))]) for doctor_id in doctor_ids}
+
+    index._load = load
+    index.schedules([1])
+
+    index._load = lambda doctor_ids: {doctor_id: _schedule([(time(9, 0), time(9, 30))], booked=[time(9, 0)])
+                                      for doctor_id in doctor_ids}
+    assert _clock(index.schedules([1])[1]._free_minutes(DAY, 15)) == ['09:15']
@@ -0,0 +1,32 @@
+"""Dashboard counters built from the tables: per-day seeding and a day first seen by the dashboard."""
+from datetime import date, datetime, timedelta
+from models import db, Appointment, StatCounter
+from stats import dashboard_counters, daily_key
+
+
+def _booked_on(day):
+    return Appointment.query.filter_by(appointment_date=day).count()
+
+
+def test_first_reconcile_seeds_future_days(app):
+    with app.app_context():
+        StatCounter.query.delete()
+        db.session.commit()
+        dashboard_counters()
+        future = [date.today() + timedelta(days=n) for n in range(1, 15)]
+        stored = dict(db.session.query(StatCounter.name, StatCounter.value))
+        for day in future:
+            if _booked_on(day):
+                assert stored[daily_key('appointments', day)] == _booked_on(day)
+
+
+def test_dashboard_reconciles_a_day_without_counters(app):
+    with app.app_context():
+        today = date.today()
+        names = [daily_key('appointments', today), daily_key('completed_appointments', today),
+                 daily_key('new_patients', datetime.utcnow().date())]
+        StatCounter.query.filter(StatCounter.name.in_(names)).delete(synchronize_session=False)
+        db.session.commit()
+        _, today_stats = dashboard_counters()
+        assert today_stats['todays_appointments'] == _booked_on(today)
+        assert db.session.query(StatCounter.name).filter(StatCounter.name.in_(names)).count() == 3
@@ -0,0 +1,67 @@
+"""Password reset tokens stored in the database.
+
+Tokens live in the password_reset_tokens table so a link issued by one
+worker works on every other. Only a SHA-256 digest is stored (the token
+itself is 256 random bits, so no salt is needed) and looked up through a
+unique index. consume_reset_token() deletes the row and returns its user in
+one statement, so a link can be used exactly once even under concurrent
+requests. Expired rows are bulk-deleted by a periodic job.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from models import db, PasswordResetToken
+from jobs import periodic
+
+RESET_TOKEN_TTL = timedelta(hours=1)
+# Run sweep_expired_tokens() this often from `flask run-jobs`
+TOKEN_SWEEP_INTERVAL = 10 * 60
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_reset_token(user_id):
+    """Create a reset token for the user (replacing any earlier one); caller commits"""
+    token = secrets.token_urlsafe(32)
+    PasswordResetToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.add(PasswordResetToken(
+        token_hash=_digest(token),
+        user_id=user_id,
+        expires_at=datetime.utcnow() + RESET_TOKEN_TTL
+    ))
+    return token
+
+
+def peek_reset_token(token):
+    """The user id a valid token belongs to, without using it up"""
+    return db.session.query(PasswordResetToken.user_id).filter(
+        PasswordResetToken.token_hash == _digest(token),
+        PasswordResetToken.expires_at > datetime.utcnow()
+    ).scalar()
+
+
+def consume_reset_token(token):
+    """Delete a valid token and return its user id, or None if it was already used or expired"""
+    return db.session.execute(
+        db.delete(PasswordResetToken).where(
+            PasswordResetToken.token_hash == _digest(token),
+            PasswordResetToken.expires_at > datetime.utcnow()
+        ).returning(PasswordResetToken.user_id)
+    ).scalar()
+
+
+def sweep_expired_tokens():
+    """Delete every expired token; returns how many were removed"""
+    result = db.session.execute(
+        db.delete(PasswordResetToken).where(PasswordResetToken.expires_at <= datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@periodic(TOKEN_SWEEP_INTERVAL)
+def sweep_tokens_job():
+    removed = sweep_expired_tokens()
+    return {'expired_tokens_removed': removed} if removed else None